@@ -0,0 +1,295 @@
+"""
+Admission control for the ASGI wrapper.
+
+Requests that reach the OpenAI API are admitted in three steps:
+
+1. the client's token bucket for the request class (search, fetch or rpc),
+   keyed by a known API key or the client IP, must have a token for each
+   call it makes, e.g. one per query of a batch search
+2. the request class must be under its own in-flight budget
+3. the server must be under its global in-flight cap
+
+A request that cannot be admitted within ``queue_timeout`` seconds is
+rejected straight away with ``AdmissionRejected``, which carries a
+``retry_after`` hint for the 429 response, instead of queueing without
+bound.
+
+A request turned away after taking a token gets the token back, so only
+requests that actually run count against a client's rate.
+
+With several workers, the token buckets can be kept in a shared store
+(``shared.SharedRateLimiter``) so a client's rate applies to the whole
+instance rather than to each worker; the in-flight caps stay per worker.
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over a limit and has to be retried later."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class ConcurrencyLimiter:
+    """
+    In-flight request cap with a FIFO queue of waiters.
+
+    A released slot is handed straight to the oldest waiter, so waiters are
+    served in arrival order and a newcomer cannot jump the queue.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.inflight = 0
+        self._waiters: "collections.deque[asyncio.Future]" = collections.deque()
+        self.peak_queue = 0
+
+    @property
+    def queued(self) -> int:
+        """Number of requests waiting for a slot."""
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        """
+        Take a slot, waiting at most ``timeout`` seconds for one.
+
+        Returns:
+            True if a slot was taken, False if the wait timed out
+        """
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            return True
+        if timeout <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.peak_queue = max(self.peak_queue, len(self._waiters))
+        try:
+            async with asyncio.timeout(timeout):
+                await waiter
+            return True
+        except TimeoutError:
+            # The slot may have been handed over just as the deadline passed
+            return waiter.done() and not waiter.cancelled()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass  # already skipped by release()
+
+    def release(self) -> None:
+        """Free a slot, handing it to the oldest waiter if there is one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the cap, current in-flight count and queue depth."""
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "peak_queued": self.peak_queue,
+        }
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: float, tokens: float = 1.0) -> Optional[float]:
+        """
+        Take ``tokens`` tokens, possibly ones only available in the future.
+
+        Returns:
+            Seconds to wait before the tokens may be used (0 if available
+            now), or None if that wait would exceed ``max_wait``, in which
+            case nothing is taken
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (tokens - self.tokens) / self.rate if self.tokens < tokens else 0.0
+        if wait > max_wait:
+            return None
+        self.tokens -= tokens
+        return wait
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Seconds until ``tokens`` tokens will be available."""
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens: float = 1.0) -> None:
+        """Return tokens taken by ``reserve`` that ended up unused."""
+        self.tokens = min(self.burst, self.tokens + tokens)
+
+
+class AdmissionBudget:
+    """Limits of one request class: in-flight cap and per-client rate."""
+
+    def __init__(self, max_inflight: int, rate: float = 0.0, burst: float = 0.0):
+        self.limiter = ConcurrencyLimiter(max_inflight)
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"rate": 0, "class": 0, "global": 0}
+
+
+class AdmissionController:
+    """
+    Global in-flight cap plus per-class budgets and per-client token buckets.
+
+    ``budgets`` maps a request class to its ``AdmissionBudget``; a rate of
+    0 disables the class's per-client token buckets. Buckets are kept for
+    the ``max_clients`` most recently seen clients; a forgotten client
+    simply starts again with a full bucket. With ``shared_buckets`` (a
+    ``shared.SharedRateLimiter``) the buckets are shared across workers,
+    falling back to the in-process ones if the shared store fails.
+    """
+
+    def __init__(self, max_inflight: int, budgets: Dict[str, AdmissionBudget],
+                 queue_timeout: float = 2.0, max_clients: int = 10000,
+                 shared_buckets=None):
+        self.limiter = ConcurrencyLimiter(max_inflight)
+        self.budgets = budgets
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self.shared_buckets = shared_buckets
+        self._buckets: "collections.OrderedDict[Tuple[str, str], TokenBucket]" = collections.OrderedDict()
+
+    def _bucket(self, request_class: str, client: str, budget: AdmissionBudget) -> TokenBucket:
+        key = (request_class, client)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(budget.rate, budget.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def acquire(self, request_class: str, client: str, cost: int = 1) -> AdmissionBudget:
+        """
+        Admit a request, waiting at most ``queue_timeout`` seconds in total.
+
+        Args:
+            request_class: Budget to charge, e.g. "search" or "fetch"
+            client: API key or IP address identifying the caller
+            cost: Tokens taken from the client's bucket, e.g. the number of
+                queries of a batch search
+
+        Returns:
+            The budget to pass to ``release`` once the request is done
+
+        Raises:
+            AdmissionRejected: If the request cannot be admitted in time
+        """
+        budget = self.budgets[request_class]
+        deadline = time.monotonic() + self.queue_timeout
+
+        bucket = None
+        if budget.rate > 0:
+            wait, retry_after, bucket = await self._reserve(request_class, client, budget, cost)
+            if wait is None:
+                budget.rejected["rate"] += 1
+                raise AdmissionRejected("rate limit exceeded", retry_after)
+
+        try:
+            if bucket is not None and wait:
+                await asyncio.sleep(wait)
+            if not await budget.limiter.acquire(deadline - time.monotonic()):
+                budget.rejected["class"] += 1
+                raise AdmissionRejected(f"too many concurrent {request_class} requests", self.queue_timeout)
+            if not await self.limiter.acquire(deadline - time.monotonic()):
+                budget.limiter.release()
+                budget.rejected["global"] += 1
+                raise AdmissionRejected("server is at capacity", self.queue_timeout)
+        except BaseException:
+            # The request never ran, so give its token back to the client
+            if bucket is not None:
+                await self._refund(request_class, client, budget, bucket, cost)
+            raise
+        budget.admitted += 1
+        return budget
+
+    async def _reserve(self, request_class: str, client: str, budget: AdmissionBudget,
+                       cost: int) -> Tuple[Optional[float], float, Any]:
+        """
+        Take ``cost`` tokens from the client's bucket.
+
+        Returns:
+            (wait or None, retry_after, bucket), where bucket is the local
+            ``TokenBucket`` the token came from, or ``self.shared_buckets``
+        """
+        if self.shared_buckets is not None:
+            try:
+                wait, retry_after = await self.shared_buckets.areserve(
+                    f"{request_class}:{client}", budget.rate, budget.burst, self.queue_timeout, cost)
+                return wait, retry_after, self.shared_buckets
+            except Exception as e:
+                logger.warning(f"Shared rate limiter failed, using local buckets: {str(e)}")
+        bucket = self._bucket(request_class, client, budget)
+        wait = bucket.reserve(self.queue_timeout, cost)
+        return wait, bucket.retry_after(cost) if wait is None else 0.0, bucket
+
+    async def _refund(self, request_class: str, client: str, budget: AdmissionBudget,
+                      bucket: Any, cost: int) -> None:
+        """Return the tokens taken by ``_reserve`` to the bucket they came from."""
+        if bucket is not self.shared_buckets:
+            bucket.refund(cost)
+            return
+        try:
+            await self.shared_buckets.arefund(f"{request_class}:{client}", budget.rate, budget.burst,
+                                              cost)
+        except Exception as e:
+            logger.warning(f"Shared rate limiter refund failed: {str(e)}")
+
+    def release(self, budget: AdmissionBudget) -> None:
+        """Free the slots taken by ``acquire``."""
+        self.limiter.release()
+        budget.limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return in-flight counts, queue depths and rejection counters."""
+        return {
+            "global": self.limiter.stats(),
+            "clients": len(self._buckets),
+            "shared_buckets": self.shared_buckets is not None,
+            "classes": {
+                name: {
+                    **budget.limiter.stats(),
+                    "rate": budget.rate,
+                    "burst": budget.burst,
+                    "admitted": budget.admitted,
+                    "rejected": dict(budget.rejected),
+                }
+                for name, budget in self.budgets.items()
+            },
+        }
@@ -0,0 +1,90 @@
+"""
+Compare fetch latency with serial vs. concurrent upstream requests.
+
+Runs the ``fetch`` tool against a stub vector store whose ``files.content``
+and ``files.retrieve`` calls, and the file name lookup, each sleep for a fixed latency, and prints the
+latency histogram of the old serial pattern next to the current concurrent
+one.
+
+Usage:
+    python benchmarks/fetch_latency.py [--latency 0.05] [--requests 50]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("VECTOR_STORE_ID", "vs_benchmark")
+
+from metrics import LatencyHistogram  # noqa: E402
+from server import create_server  # noqa: E402
+
+
+def make_stub_client(latency: float):
+    """Build a stub OpenAI client whose file endpoints sleep for ``latency``."""
+
+    async def content(vector_store_id, file_id):
+        await asyncio.sleep(latency)
+        return SimpleNamespace(data=[SimpleNamespace(text=f"Content of {file_id}")])
+
+    async def retrieve(vector_store_id, file_id):
+        await asyncio.sleep(latency)
+        return SimpleNamespace(attributes={})
+
+    async def retrieve_file(file_id):
+        await asyncio.sleep(latency)
+        return SimpleNamespace(filename=f"{file_id}.txt")
+
+    files = SimpleNamespace(content=content, retrieve=retrieve)
+    return SimpleNamespace(vector_stores=SimpleNamespace(files=files),
+                           files=SimpleNamespace(retrieve=retrieve_file))
+
+
+async def run(latency: float, requests: int):
+    client = make_stub_client(latency)
+
+    # Baseline: the requests awaited one after another
+    serial = LatencyHistogram()
+    for i in range(requests):
+        started = time.perf_counter()
+        await client.vector_stores.files.content(vector_store_id="vs", file_id=f"file_{i}")
+        await client.vector_stores.files.retrieve(vector_store_id="vs", file_id=f"file_{i}")
+        await client.files.retrieve(f"file_{i}")
+        serial.observe(time.perf_counter() - started)
+
+    mcp = create_server(client)
+    for i in range(requests):
+        await mcp._tool_manager.call_tool("fetch", {"id": f"file_{i}"})
+
+    return {
+        "latency": latency,
+        "requests": requests,
+        "serial": serial.snapshot(),
+        "concurrent": mcp.fetch_latency.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Simulated latency of each upstream request in seconds")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="Number of fetch calls per mode")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.latency, args.requests))
+    for mode in ("serial", "concurrent"):
+        stats = report[mode]
+        print(f"{mode:>10}: p50={stats['p50'] * 1000:.1f}ms "
+              f"p95={stats['p95'] * 1000:.1f}ms mean={stats['mean'] * 1000:.1f}ms")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
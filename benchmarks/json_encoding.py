@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the JSON backends on realistic search/fetch payloads.
+
+Compares every installed backend in ``serialization.BACKENDS`` at encoding
+a search response (five results with 500 character snippets) and fetch
+responses of increasing size to UTF-8 bytes.
+
+Usage:
+    python benchmarks/json_encoding.py [--repeat 200]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import serialization  # noqa: E402
+
+PARAGRAPH = (
+    "Each player begins the game with sixteen pieces. The king may castle once per game "
+    "if neither the king nor the rook has moved — “en passant” captures are also allowed. "
+)
+
+
+def search_payload():
+    return {
+        "results": [
+            {
+                "id": f"file_{i:024d}",
+                "title": f"rulebook_{i}.pdf",
+                "text": (PARAGRAPH * 4)[:500] + "...",
+                "url": f"#file-file_{i:024d}",
+            }
+            for i in range(5)
+        ],
+        "status": "ok",
+        "timestamp": "2025-07-26T23:23:36.930670",
+    }
+
+
+def fetch_payload(size):
+    return {
+        "id": "file_000000000000000000000001",
+        "title": "rulebook.pdf",
+        "text": (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size],
+        "url": "https://platform.openai.com/storage/files/file_000000000000000000000001",
+        "metadata": {"game": "chess", "edition": 3},
+        "status": "ok",
+        "timestamp": "2025-07-26T23:23:36.930670",
+    }
+
+
+def time_backend(dumps, payload, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        dumps(payload)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=200, help="Encodings per measurement")
+    args = parser.parse_args()
+
+    backends = {}
+    for name in serialization.BACKENDS:
+        if name != "json" and importlib.util.find_spec(name) is None:
+            continue
+        backends[name] = serialization.load_backend(name)[1]
+
+    payloads = {
+        "search (5 results)": search_payload(),
+        "fetch 100 KB": fetch_payload(100 * 1024),
+        "fetch 5 MB": fetch_payload(5 * 1024 * 1024),
+    }
+    for label, payload in payloads.items():
+        repeat = max(args.repeat // 50, 5) if "MB" in label else args.repeat
+        timings = {name: time_backend(dumps, payload, repeat) for name, dumps in backends.items()}
+        baseline = timings["json"]
+        print(label)
+        for name, seconds in timings.items():
+            print(f"  {name:>8}: {seconds * 1e6:10.1f} us  ({baseline / seconds:4.1f}x json)")
+
+
+if __name__ == "__main__":
+    main()
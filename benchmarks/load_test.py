@@ -0,0 +1,425 @@
+"""
+Load-test the server end to end against the local OpenAI stub.
+
+Starts ``benchmarks/openai_stub.py`` and the server under uvicorn (unless
+``--target`` points at one already running), then drives each scenario
+with a fixed number of concurrent clients for a fixed duration:
+
+- health: ``GET /health``
+- search: ``POST /search`` over a pool of queries (``--queries 0`` makes
+  every query unique, so nothing is served from the cache)
+- fetch: ``POST /fetch`` over a pool of document IDs
+- sse: ``--sse-connections`` concurrent ``GET /sse`` streams held open
+  for the scenario duration
+
+Each scenario reports requests per second, p50/p95/p99 latency, errors and
+the resident memory of every server worker. ``--output`` saves the report
+as JSON; ``--compare`` checks it against a saved baseline and exits with
+status 1 if throughput dropped or p95 latency rose by more than
+``--tolerance``, so it can gate CI.
+
+Per-client rate limits are disabled on the spawned server since all load
+comes from one client; the in-flight caps stay on.
+
+Usage:
+    python benchmarks/load_test.py [--duration 10] [--concurrency 32] [--workers 1]
+        [--scenarios health,search,fetch,sse] [--latency 0.05]
+        [--output results.json] [--compare baseline.json --tolerance 0.1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SCENARIOS = ("health", "search", "fetch", "sse")
+
+QUERY_WORDS = (
+    "how do rooks move castling rules en passant promotion stalemate check "
+    "opening principles endgame technique knight fork bishop pair tempo"
+).split()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident set size of a process, from /proc (None where unavailable)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(pid: int) -> List[int]:
+    """
+    PIDs of the processes serving requests: uvicorn's spawned workers, or
+    the process itself when it runs a single worker in-process.
+    """
+    workers = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [pid]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name may contain spaces, so split after it
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+            if ppid != pid:
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as cmdline:
+                if b"spawn_main" in cmdline.read():
+                    workers.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return sorted(workers) or [pid]
+
+
+def memory_snapshot(pid: Optional[int]) -> Optional[Dict[str, Any]]:
+    if pid is None:
+        return None
+    workers = {str(worker): rss_bytes(worker) for worker in worker_pids(pid)}
+    known = [rss for rss in workers.values() if rss is not None]
+    return {
+        "workers": workers,
+        "total_bytes": sum(known) if known else None,
+    }
+
+
+def summarize(latencies: List[float], statuses: Counter, elapsed: float) -> Dict[str, Any]:
+    """Throughput and latency percentiles (milliseconds) of one scenario."""
+    samples = np.array(latencies, dtype=np.float64) * 1000.0
+    ok = sum(count for status, count in statuses.items()
+             if isinstance(status, int) and status < 400)
+    report = {
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "elapsed": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if len(samples):
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        report.update(p50_ms=p50, p95_ms=p95, p99_ms=p99,
+                      mean_ms=float(samples.mean()), max_ms=float(samples.max()))
+    return report
+
+
+async def closed_loop(make_request: Callable[[], Awaitable[int]], concurrency: int,
+                      duration: float) -> Dict[str, Any]:
+    """Run ``concurrency`` clients that each issue requests back to back."""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await make_request()
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+async def sse_scenario(client: httpx.AsyncClient, connections: int,
+                       duration: float, on_held: Callable[[], None]) -> Dict[str, Any]:
+    """
+    Open ``connections`` SSE streams at once and hold them for ``duration``.
+
+    Latency is the time to the first event; ``on_held`` runs once every
+    stream is connected, to sample memory under load.
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    events = 0
+    pending = connections
+    settled = asyncio.Event()
+
+    def settle():
+        nonlocal pending
+        pending -= 1
+        if not pending:
+            settled.set()
+
+    async def stream():
+        nonlocal events
+        started = time.perf_counter()
+        first_event = None
+        status: Any = None
+        try:
+            async with client.stream("GET", "/sse", headers={"accept": "text/event-stream"}) as response:
+                status = response.status_code
+                async with asyncio.timeout(duration):
+                    async for line in response.aiter_lines():
+                        if not line.startswith("event:"):
+                            continue
+                        events += 1
+                        if first_event is None:
+                            first_event = time.perf_counter() - started
+                            settle()
+        except TimeoutError:
+            pass
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finally:
+            if first_event is None:
+                settle()
+            else:
+                latencies.append(first_event)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(stream()) for _ in range(connections)]
+    try:
+        async with asyncio.timeout(duration):
+            await settled.wait()
+    except TimeoutError:
+        pass
+    on_held()
+    await asyncio.gather(*tasks)
+    report = summarize(latencies, statuses, time.perf_counter() - started)
+    # A stream that never delivered an event counts as an error
+    report.update(connections=connections, connected=len(latencies), events=events,
+                  errors=connections - len(latencies))
+    return report
+
+
+async def run_scenarios(base_url: str, args, server_pid: Optional[int]) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.sample(QUERY_WORDS, 4)) for _ in range(args.queries)]
+    counter = iter(range(10 ** 12))
+
+    def next_query() -> str:
+        if not queries:
+            return f"{rng.choice(QUERY_WORDS)} {next(counter)}"
+        return rng.choice(queries)
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.sse_connections) + 8,
+                          max_keepalive_connections=args.concurrency + 8)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits,
+                                 timeout=httpx.Timeout(60.0)) as client:
+        async def health():
+            return (await client.get("/health")).status_code
+
+        async def search():
+            return (await client.post("/search", json={"query": next_query()})).status_code
+
+        async def fetch():
+            document = f"file_{rng.randrange(args.documents)}"
+            return (await client.post("/fetch", json={"id": document})).status_code
+
+        requests = {"health": health, "search": search, "fetch": fetch}
+        results = {}
+        for name in args.scenarios:
+            memory_before = memory_snapshot(server_pid)
+            if name == "sse":
+                held = {}
+                report = await sse_scenario(
+                    client, args.sse_connections, args.duration,
+                    lambda: held.setdefault("memory", memory_snapshot(server_pid)))
+                report["memory_held"] = held.get("memory")
+            else:
+                # Warm up connections, caches and the upstream latency windows
+                await closed_loop(requests[name], args.concurrency, min(1.0, args.duration / 5))
+                report = await closed_loop(requests[name], args.concurrency, args.duration)
+            report["memory_before"] = memory_before
+            report["memory_after"] = memory_snapshot(server_pid)
+            results[name] = report
+            print(format_line(name, report), flush=True)
+        return results
+
+
+def format_line(name: str, report: Dict[str, Any]) -> str:
+    line = (f"{name:>8}: {report['rps']:8.1f} rps  "
+            f"p50={report.get('p50_ms', 0):7.1f}ms  p95={report.get('p95_ms', 0):7.1f}ms  "
+            f"p99={report.get('p99_ms', 0):7.1f}ms  errors={report['errors']}")
+    memory = report.get("memory_held") or report.get("memory_after")
+    if memory and memory["total_bytes"]:
+        line += f"  rss={memory['total_bytes'] / 2 ** 20:.0f}MiB"
+    return line
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """List the scenarios whose throughput or p95 latency regressed past ``tolerance``."""
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if name != "sse" and previous.get("rps") and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']:.1f} -> {current['rps']:.1f}")
+        if previous.get("p95_ms") and current.get("p95_ms", 0) > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+    return regressions
+
+
+def start(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    # Output goes to a file rather than a pipe: nobody reads the pipe while
+    # the load runs, and a child blocked on a full pipe stalls every request
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **env},
+                               stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    return process
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            process.log.seek(0)
+            output = process.log.read().decode(errors="replace")
+            raise RuntimeError(f"{url} exited early:\n{output[-4000:]}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout:.0f}s")
+
+
+def stop(process: Optional[subprocess.Popen]) -> None:
+    if process is None:
+        return
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    process.log.close()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--target", help="URL of a running server; skips starting the stub and server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma-separated scenarios to run")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--sse-connections", type=int, default=200,
+                        help="SSE streams held open in the sse scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Distinct search queries (0 for a unique query per request)")
+    parser.add_argument("--documents", type=int, default=200, help="Distinct document IDs fetched")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Stub latency spread")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Stub slow-tail fraction")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="Stub slow-tail latency")
+    parser.add_argument("--chunk-bytes", type=int, default=800, help="Stub search chunk size")
+    parser.add_argument("--document-bytes", type=int, default=20000, help="Stub document size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed relative drop in rps or rise in p95 before failing")
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stub = server = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            server_pid = None
+        else:
+            stub_port, server_port = free_port(), free_port()
+            stub = start([
+                sys.executable, "benchmarks/openai_stub.py", "--port", str(stub_port),
+                "--latency", str(args.latency), "--jitter", str(args.jitter),
+                "--slow-rate", str(args.slow_rate), "--slow-latency", str(args.slow_latency),
+                "--chunk-bytes", str(args.chunk_bytes), "--document-bytes", str(args.document_bytes),
+            ], {})
+            wait_ready(f"http://127.0.0.1:{stub_port}/", stub)
+            server = start([
+                sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                "--port", str(server_port), "--workers", str(args.workers),
+                "--log-level", "warning",
+            ], {
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+                "OPENAI_API_KEY": "stub",
+                "VECTOR_STORE_ID": "vs_load_test",
+                "ADMISSION_SEARCH_RATE": "0",
+                "ADMISSION_FETCH_RATE": "0",
+                "ADMISSION_RPC_RATE": "0",
+                "SSE_MAX_CONNECTIONS": str(max(1000, args.sse_connections)),
+            })
+            base_url = f"http://127.0.0.1:{server_port}"
+            wait_ready(f"{base_url}/health", server)
+            server_pid = server.pid
+
+        scenarios = asyncio.run(run_scenarios(base_url, args, server_pid))
+    finally:
+        stop(server)
+        stop(stub)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "compare")},
+        },
+        "scenarios": scenarios,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, default=float)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
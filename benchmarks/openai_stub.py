@@ -0,0 +1,194 @@
+"""
+Local stub of the OpenAI vector store API for load tests.
+
+Serves the four endpoints the server calls (search, file content, vector
+store file metadata and the file's name) with a configurable latency and payload size, so the real SDK
+and HTTP pool are exercised end to end without an API key. Point the
+server at it with ``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1``.
+
+Usage:
+    python benchmarks/openai_stub.py [--port 8900] [--latency 0.05] [--jitter 0.2]
+        [--slow-rate 0.01] [--slow-latency 1.0] [--results 20]
+        [--chunk-bytes 800] [--document-bytes 20000]
+"""
+
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+WORDS = (
+    "rook bishop knight queen king pawn castle check mate board move capture "
+    "piece square rank file opening endgame tempo fork pin skewer gambit"
+).split()
+
+
+@dataclass
+class StubConfig:
+    """Latency and payload shape of the stub's responses."""
+
+    latency: float = 0.05
+    jitter: float = 0.2
+    slow_rate: float = 0.0
+    slow_latency: float = 1.0
+    results: int = 20
+    files: int = 1000
+    chunk_bytes: int = 800
+    document_bytes: int = 20000
+    error_rate: float = 0.0
+
+
+def make_text(seed: str, size: int) -> str:
+    """Deterministic filler text of roughly ``size`` bytes for ``seed``."""
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def create_app(config: StubConfig) -> Starlette:
+    """Build the stub API application."""
+    # Filler is generated once per file and reused, so payload construction
+    # does not dominate the stub's own CPU time
+    chunks = {}
+    documents = {}
+
+    def chunk(file_id: str) -> str:
+        if file_id not in chunks:
+            chunks[file_id] = make_text(file_id, config.chunk_bytes)
+        return chunks[file_id]
+
+    def document(file_id: str) -> str:
+        if file_id not in documents:
+            documents[file_id] = make_text(file_id, config.document_bytes)
+        return documents[file_id]
+
+    async def delay() -> bool:
+        """Sleep for the simulated latency; return False for an injected error."""
+        if config.slow_rate and random.random() < config.slow_rate:
+            seconds = config.slow_latency
+        else:
+            spread = config.latency * config.jitter
+            seconds = random.uniform(config.latency - spread, config.latency + spread)
+        await asyncio.sleep(max(0.0, seconds))
+        return not (config.error_rate and random.random() < config.error_rate)
+
+    def server_error() -> JSONResponse:
+        return JSONResponse(
+            {"error": {"message": "stub failure", "type": "server_error"}}, status_code=500)
+
+    async def search(request: Request) -> JSONResponse:
+        body = await request.json()
+        if not await delay():
+            return server_error()
+        limit = min(int(body.get("max_num_results") or 10), config.results)
+        rng = random.Random(str(body.get("query")))
+        data = []
+        for rank in range(limit):
+            file_id = f"file_{rng.randrange(config.files)}"
+            data.append({
+                "file_id": file_id,
+                "filename": f"{file_id}.txt",
+                "score": round(1.0 - rank / (limit + 1), 4),
+                "attributes": {},
+                "content": [{"type": "text", "text": chunk(file_id)}],
+            })
+        return JSONResponse({
+            "object": "vector_store.search_results.page",
+            "search_query": [body.get("query")],
+            "data": data,
+            "has_more": False,
+            "next_page": None,
+        })
+
+    async def file_content(request: Request) -> JSONResponse:
+        if not await delay():
+            return server_error()
+        return JSONResponse({
+            "object": "vector_store.file_content.page",
+            "data": [{"type": "text", "text": document(request.path_params["file_id"])}],
+            "has_more": False,
+            "next_page": None,
+        })
+
+    async def file_info(request: Request) -> JSONResponse:
+        if not await delay():
+            return server_error()
+        file_id = request.path_params["file_id"]
+        return JSONResponse({
+            "id": file_id,
+            "object": "vector_store.file",
+            "usage_bytes": config.document_bytes,
+            "created_at": 1700000000,
+            "vector_store_id": request.path_params["vector_store_id"],
+            "status": "completed",
+            "last_error": None,
+            "attributes": {},
+        })
+
+    async def file_object(request: Request) -> JSONResponse:
+        if not await delay():
+            return server_error()
+        file_id = request.path_params["file_id"]
+        return JSONResponse({
+            "id": file_id,
+            "object": "file",
+            "bytes": config.document_bytes,
+            "created_at": 1700000000,
+            "filename": f"{file_id}.txt",
+            "purpose": "assistants",
+            "status": "processed",
+        })
+
+    return Starlette(routes=[
+        Route("/v1/vector_stores/{vector_store_id}/search", search, methods=["POST"]),
+        Route("/v1/vector_stores/{vector_store_id}/files/{file_id}/content", file_content),
+        Route("/v1/vector_stores/{vector_store_id}/files/{file_id}", file_info),
+        Route("/v1/files/{file_id}", file_object),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=StubConfig.latency,
+                        help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter,
+                        help="Latency spread as a fraction of the mean")
+    parser.add_argument("--slow-rate", type=float, default=StubConfig.slow_rate,
+                        help="Fraction of responses delayed by --slow-latency instead")
+    parser.add_argument("--slow-latency", type=float, default=StubConfig.slow_latency,
+                        help="Latency of the slow tail in seconds")
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate,
+                        help="Fraction of responses answered with a 500")
+    parser.add_argument("--results", type=int, default=StubConfig.results,
+                        help="Maximum search hits per query")
+    parser.add_argument("--files", type=int, default=StubConfig.files,
+                        help="Number of distinct file IDs search hits are drawn from")
+    parser.add_argument("--chunk-bytes", type=int, default=StubConfig.chunk_bytes,
+                        help="Size of each search hit's content chunk")
+    parser.add_argument("--document-bytes", type=int, default=StubConfig.document_bytes,
+                        help="Size of each fetched document")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency, error_rate=args.error_rate, results=args.results,
+        files=args.files, chunk_bytes=args.chunk_bytes, document_bytes=args.document_bytes,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure per-request framework overhead of the ASGI wrapper.
+
+Drives ``FastMCPASGIWrapper`` directly with in-memory ASGI ``receive`` and
+``send`` callables, so the numbers include routing, tool dispatch and
+response encoding but no network or upstream latency. Search requests hit
+a warm cache.
+
+Usage:
+    python benchmarks/router_overhead.py [--requests 5000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("VECTOR_STORE_ID", "vs_benchmark")
+# All requests come from one client, so keep the in-flight caps but not the
+# per-client rate limit, which would turn most searches into 429s
+os.environ.setdefault("ADMISSION_SEARCH_RATE", "0")
+
+from server import FastMCPASGIWrapper, create_server  # noqa: E402
+
+
+def make_stub_client():
+    """Build a stub OpenAI client that answers searches instantly."""
+
+    async def search(vector_store_id, query, max_num_results):
+        item = SimpleNamespace(file_id="file_1", filename="rules.txt",
+                               content=[SimpleNamespace(text="Rooks move in straight lines.")])
+        return SimpleNamespace(data=[item])
+
+    return SimpleNamespace(vector_stores=SimpleNamespace(search=search))
+
+
+async def request(app, method, path, body=b""):
+    scope = {"type": "http", "method": method, "path": path, "headers": []}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def run(requests):
+    app = FastMCPASGIWrapper(create_server(make_stub_client()))
+    search_body = json.dumps({"query": "how do rooks move"}).encode()
+    cases = {
+        "GET /health": ("GET", "/health", b""),
+        "POST /search (cached)": ("POST", "/search", search_body),
+        "GET / (info)": ("GET", "/", b""),
+    }
+
+    report = {}
+    for name, (method, path, body) in cases.items():
+        # Warm up the route and caches
+        for _ in range(50):
+            await request(app, method, path, body)
+        started = time.perf_counter()
+        for _ in range(requests):
+            await request(app, method, path, body)
+        elapsed = time.perf_counter() - started
+        report[name] = {"requests": requests, "us_per_request": elapsed / requests * 1e6}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=5000,
+                        help="Number of requests per route")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.requests))
+    for name, stats in report.items():
+        print(f"{name:>24}: {stats['us_per_request']:.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Measure cold-start time: importing the server, startup and the first request.
+
+Each run starts a fresh interpreter that imports ``server``, runs the ASGI
+lifespan startup (building the OpenAI client, the upstream pool and the
+MCP server) and serves one ``GET /health`` in memory, timing each step.
+Scaled-to-zero containers and dynos pay all three before answering the
+request that woke them. The process time also includes interpreter
+startup and shutdown.
+
+Usage:
+    python benchmarks/startup_time.py [--runs 5] [--importtime 15]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs in the fresh interpreter and prints its timings as JSON
+CHILD = """
+import asyncio, json, time
+
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+
+
+async def first_request():
+    app = server.app
+    await app.startup()
+    ready = time.perf_counter()
+    scope = {"type": "http", "method": "GET", "path": "/health", "headers": []}
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    statuses = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await app(scope, receive, send)
+    answered = time.perf_counter()
+    await app.shutdown()
+    return ready, answered, statuses[0]
+
+
+ready, answered, status = asyncio.run(first_request())
+print(json.dumps({
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_request": answered - ready,
+    "status": status,
+}))
+"""
+
+STEPS = ("import", "startup", "first_request", "process")
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("VECTOR_STORE_ID", "vs_benchmark")
+    return env
+
+
+def run_once():
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+def slowest_imports(count):
+    """Top-level modules imported by ``server``, slowest (cumulative) first."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"],
+                            cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        # Direct imports of server are indented by exactly three spaces
+        if cumulative.strip().isdigit() and name.startswith("   ") and not name.startswith("    "):
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="Also list the N slowest modules imported by server")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    if any(run["status"] != 200 for run in runs):
+        sys.exit(f"First request failed: {[run['status'] for run in runs]}")
+    for step in STEPS:
+        values = [run[step] * 1000 for run in runs]
+        print(f"{step:>14}: median {statistics.median(values):7.1f} ms  "
+              f"min {min(values):7.1f} ms  max {max(values):7.1f} ms")
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative):")
+        for microseconds, name in slowest_imports(args.importtime):
+            print(f"{microseconds / 1000:9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
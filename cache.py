@@ -0,0 +1,407 @@
+"""
+In-process caching primitives for the GameBot MCP server.
+
+The search tool is hit repeatedly by deep research sessions with the same or
+trivially different queries, so results are kept in a small TTL + LRU cache
+keyed on a normalized form of the query. Concurrent identical calls that miss
+the cache are coalesced by ``SingleFlight`` so only one upstream request is
+made. Paraphrased queries can be answered by ``SemanticCache``, which matches
+queries by embedding similarity.
+"""
+
+import asyncio
+import importlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from stopwords import STOPWORDS
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query so trivially different queries share a cache key.
+
+    Case is folded, punctuation is dropped and runs of whitespace are
+    collapsed, so "Level up  FAST?" and "level up fast" normalize the same.
+
+    Args:
+        query: Raw query string from the client
+
+    Returns:
+        Normalized query string
+    """
+    query = _PUNCTUATION_RE.sub(" ", query.casefold())
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+class TTLCache:
+    """
+    Size-bounded cache with per-entry TTL and LRU eviction.
+
+    Entries older than ``ttl`` seconds are treated as misses; once the cache
+    holds ``maxsize`` entries the least recently used one is evicted. All
+    operations are O(1) and guarded by a lock so the cache can be shared with
+    worker threads.
+
+    With a ``stale_ttl``, expired entries are kept for that many more seconds
+    so ``get_stale`` can still serve them while the upstream is failing.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, stale_ttl: float = 0.0):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key`` or ``default`` on a miss."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                # Keep the entry around for get_stale until the stale window ends
+                if expires_at + self.stale_ttl <= now:
+                    del self._data[key]
+                    self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the value for ``key`` even if it has expired, as long as it is
+        within ``stale_ttl`` of its expiry; ``default`` otherwise.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] + self.stale_ttl <= time.monotonic():
+                return default
+            self.stale_hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value`` under ``key``, evicting the LRU entry if full."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = (expires_at, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        """
+        Drop one entry, or every entry when ``key`` is None.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            if key is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            return 1 if self._data.pop(key, None) is not None else 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single awaitable.
+
+    The first caller for a key starts the work in its own task; callers that
+    arrive while it is in flight await the same task and receive the same
+    result or exception. Cancelling one waiter does not cancel the shared
+    work for the others.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run ``fn`` for ``key`` unless an identical call is already running.
+
+        Args:
+            key: Identity of the call, e.g. the normalized query or file ID
+            fn: Zero-argument coroutine function performing the work
+
+        Returns:
+            The result of the (possibly shared) call
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters of total and coalesced calls."""
+        return {
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
+
+
+class HashingEmbedder:
+    """
+    Dependency-free local query embedder.
+
+    Each content word of the normalized query and each character n-gram of
+    those words is hashed (CRC32, so vectors are stable across processes)
+    into a signed ``dim``-dimensional bag of features. The n-grams let
+    "fastest" and "fast" share most of their features, which is enough to
+    match short paraphrases without a model.
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float) -> None:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        vector[digest % self.dim] += weight if digest & 0x80000000 else -weight
+
+    def __call__(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = normalize_query(text).split()
+        for word in [w for w in words if w not in STOPWORDS] or words:
+            self._add(vector, word, 1.0)
+            padded = f"<{word}>"
+            for i in range(len(padded) - self.ngram + 1):
+                self._add(vector, padded[i:i + self.ngram], 0.5)
+        return vector
+
+
+def load_embedder(spec: str = "hashing") -> Callable[[str], np.ndarray]:
+    """
+    Resolve an embedding function.
+
+    Args:
+        spec: "hashing" for ``HashingEmbedder``, or "module:attribute" naming
+            a callable that maps a query string to a 1-D vector (a class or
+            factory is called once without arguments to build it)
+    """
+    if spec == "hashing":
+        return HashingEmbedder()
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Embedder must be 'hashing' or 'module:attribute', got {spec!r}")
+    target = getattr(importlib.import_module(module_name), attribute)
+    return target() if isinstance(target, type) else target
+
+
+class SemanticCache:
+    """
+    Cache of query results matched by embedding similarity.
+
+    Query embeddings are L2-normalized and kept as rows of one float32
+    matrix, so a lookup is a single matrix-vector product. The closest
+    cached query is a hit when its cosine similarity reaches ``threshold``
+    and its entry is younger than ``ttl``. Once ``maxsize`` queries are
+    cached the least recently used row is overwritten.
+
+    ``aget`` and ``aset`` run the embedder in a worker thread when
+    ``offload`` is set, which is the default for anything but the cheap
+    built-in ``HashingEmbedder``, so a real model does not block the event
+    loop.
+    """
+
+    def __init__(self, embed: Callable[[str], np.ndarray], maxsize: int = 1024,
+                 ttl: float = 300.0, threshold: float = 0.9, offload: Optional[bool] = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.embed = embed
+        self.offload = not isinstance(embed, HashingEmbedder) if offload is None else offload
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[Hashable] = []
+        self._values: List[Any] = []
+        self._expires = np.zeros(maxsize, dtype=np.float64)
+        self._used = np.zeros(maxsize, dtype=np.float64)
+        self._rows: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _vector(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embed(query), dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def lookup(self, query: str) -> Tuple[Any, float]:
+        """
+        Find the cached value of the most similar query.
+
+        Returns:
+            (value, similarity), or (None, best similarity) on a miss
+        """
+        vector = self._vector(query)
+        with self._lock:
+            size = len(self._keys)
+            if not size or self._matrix is None:
+                self.misses += 1
+                return None, 0.0
+            similarities = self._matrix[:size] @ vector
+            # Expired rows can never match
+            similarities[self._expires[:size] <= time.monotonic()] = -1.0
+            row = int(np.argmax(similarities))
+            similarity = float(similarities[row])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, max(similarity, 0.0)
+            self._used[row] = time.monotonic()
+            self.hits += 1
+            return self._values[row], similarity
+
+    def get(self, query: str, default: Any = None) -> Any:
+        """Return the value cached for the most similar query, or ``default``."""
+        value, _ = self.lookup(query)
+        return default if value is None else value
+
+    def set(self, key: Hashable, query: str, value: Any) -> None:
+        """
+        Cache ``value`` for ``query``; ``key`` identifies the entry for
+        replacement and ``invalidate``.
+        """
+        vector = self._vector(query)
+        now = time.monotonic()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            row = self._rows.get(key)
+            if row is None:
+                if len(self._keys) < self.maxsize:
+                    row = len(self._keys)
+                    self._keys.append(key)
+                    self._values.append(value)
+                else:
+                    row = int(np.argmin(self._used))
+                    del self._rows[self._keys[row]]
+                    self._keys[row] = key
+                    self.evictions += 1
+                self._rows[key] = row
+            self._matrix[row] = vector
+            self._values[row] = value
+            self._expires[row] = now + self.ttl
+            self._used[row] = now
+
+    async def aget(self, query: str, default: Any = None) -> Any:
+        """Async ``get``, embedding the query off the event loop if ``offload`` is set."""
+        if self.offload:
+            return await asyncio.to_thread(self.get, query, default)
+        return self.get(query, default)
+
+    async def aset(self, key: Hashable, query: str, value: Any) -> None:
+        """Async ``set``, embedding the query off the event loop if ``offload`` is set."""
+        if self.offload:
+            await asyncio.to_thread(self.set, key, query, value)
+        else:
+            self.set(key, query, value)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        """
+        Drop one entry, or every entry when ``key`` is None.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            if key is None:
+                removed = len(self._keys)
+                self._keys.clear()
+                self._values.clear()
+                self._rows.clear()
+                return removed
+            row = self._rows.get(key)
+            if row is None:
+                return 0
+            # Expire the row in place and mark it least recently used, so it
+            # never matches and is the next one to be overwritten
+            self._expires[row] = 0.0
+            self._used[row] = 0.0
+            self._values[row] = None
+            return 1
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._keys),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,229 @@
+"""
+Persistent on-disk document store for fetched vector store files.
+
+Documents returned by the fetch tool are kept in a SQLite database so they
+survive restarts and are shared between uvicorn workers on the same host.
+The database runs in WAL mode, which lets any number of worker processes
+read concurrently while one of them writes.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    vector_store_id TEXT NOT NULL,
+    title TEXT,
+    url TEXT,
+    text TEXT NOT NULL,
+    metadata TEXT,
+    size INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_accessed_at ON documents (accessed_at);
+"""
+
+# Reads only bump a document's access time when it is older than this, so a
+# hot document does not turn every read into a write
+ACCESS_RESOLUTION = 60.0
+
+
+def _checksum(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentStore:
+    """
+    SQLite-backed store of fetched documents.
+
+    Freshness and validation rules applied on read:
+
+    - documents stored for a different vector store are ignored
+    - documents older than ``max_age`` seconds are expired (0 disables expiry,
+      which suits vector store files since they are immutable)
+    - documents whose text no longer matches the stored checksum are dropped
+
+    Once the stored text exceeds ``max_bytes`` the least recently accessed
+    documents are evicted.
+    """
+
+    def __init__(self, path: str, vector_store_id: str, max_bytes: int = 256 * 1024 * 1024,
+                 max_age: float = 0.0):
+        self.path = path
+        self.vector_store_id = vector_store_id
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalid = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, doc_id: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored document for ``doc_id`` if it is fresh and valid.
+
+        Args:
+            doc_id: Vector store file ID
+            allow_stale: Also return documents older than ``max_age``, for
+                serving while the upstream is unavailable
+
+        Returns:
+            Document dict in the fetch tool's shape, or None on a miss
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT vector_store_id, title, url, text, metadata, checksum, stored_at, accessed_at "
+            "FROM documents WHERE id = ?",
+            (doc_id,),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        vector_store_id, title, url, text, metadata, checksum, stored_at, accessed_at = row
+        now = time.time()
+        if vector_store_id != self.vector_store_id or (
+                self.max_age and now - stored_at > self.max_age and not allow_stale):
+            self.misses += 1
+            return None
+        if _checksum(text) != checksum:
+            logger.warning(f"Dropping corrupt stored document: {doc_id}")
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            self.invalid += 1
+            self.misses += 1
+            return None
+
+        if now - accessed_at > ACCESS_RESOLUTION:
+            conn.execute("UPDATE documents SET accessed_at = ? WHERE id = ?", (now, doc_id))
+
+        self.hits += 1
+        return {
+            "id": doc_id,
+            "title": title,
+            "text": text,
+            "url": url,
+            "metadata": json.loads(metadata) if metadata else None,
+        }
+
+    def put(self, document: Dict[str, Any]) -> None:
+        """Store a document returned by the fetch tool and enforce the size cap."""
+        text = document.get("text") or ""
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(id, vector_store_id, title, url, text, metadata, size, checksum, stored_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                document["id"],
+                self.vector_store_id,
+                document.get("title"),
+                document.get("url"),
+                text,
+                json.dumps(document.get("metadata"), default=str),
+                size,
+                _checksum(text),
+                now,
+                now,
+            ),
+        )
+        self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Delete least recently accessed documents until under ``max_bytes``."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for doc_id, size in conn.execute(
+                    "SELECT id, size FROM documents ORDER BY accessed_at ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+                total -= size
+                self.evictions += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, doc_id: Optional[str] = None) -> int:
+        """Delete one document, or all documents when ``doc_id`` is None."""
+        conn = self._connect()
+        if doc_id is None:
+            cursor = conn.execute("DELETE FROM documents")
+        else:
+            cursor = conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        return cursor.rowcount
+
+    def contains(self, doc_id: str) -> bool:
+        """Return whether a fresh copy of ``doc_id`` is stored, without counting a lookup."""
+        row = self._connect().execute(
+            "SELECT vector_store_id, stored_at FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return row is not None and row[0] == self.vector_store_id and not (
+            self.max_age and time.time() - row[1] > self.max_age)
+
+    async def acontains(self, doc_id: str) -> bool:
+        """Async wrapper around ``contains`` that keeps SQLite off the event loop."""
+        return await asyncio.to_thread(self.contains, doc_id)
+
+    async def aget(self, doc_id: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Async wrapper around ``get`` that keeps SQLite off the event loop."""
+        return await asyncio.to_thread(self.get, doc_id, allow_stale)
+
+    async def aput(self, document: Dict[str, Any]) -> None:
+        """Async wrapper around ``put`` that keeps SQLite off the event loop."""
+        await asyncio.to_thread(self.put, document)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return store size and hit/miss/eviction counters."""
+        count, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return {
+            "path": self.path,
+            "documents": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalid": self.invalid,
+        }
+
+    def close(self) -> None:
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
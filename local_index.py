@@ -0,0 +1,356 @@
+"""
+Local mirror of the OpenAI Vector Store as a BM25 inverted index.
+
+A sync job pulls every file in the vector store, splits it into chunks and
+builds a BM25 index stored as NumPy arrays on disk. At startup the arrays are
+memory-mapped, so the search tool can score queries locally in a few
+milliseconds without an upstream round trip.
+
+Usage:
+    python local_index.py sync [--dir data/index]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DEFAULT_CHUNK_CHARS = 1500
+DEFAULT_CHUNK_OVERLAP = 200
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into case-folded word tokens."""
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def chunk_text(text: str, chunk_chars: int = DEFAULT_CHUNK_CHARS,
+               overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into overlapping chunks of roughly ``chunk_chars`` characters.
+
+    Chunk boundaries are moved back to the nearest whitespace so words are
+    not cut in half.
+    """
+    text = text.strip()
+    if len(text) <= chunk_chars:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            boundary = text.rfind(" ", start + overlap, end)
+            if boundary > start:
+                end = boundary
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        # Start the next chunk on a word boundary inside the overlap window
+        boundary = text.find(" ", max(end - overlap, start + 1), end)
+        start = boundary + 1 if boundary != -1 else end
+    return [chunk for chunk in chunks if chunk]
+
+
+class LocalIndex:
+    """
+    BM25 inverted index over document chunks.
+
+    Postings are stored term-major in CSR form: the postings of term ``t``
+    are ``chunk_ids[indptr[t]:indptr[t + 1]]`` with matching term
+    frequencies in ``tfs``. Chunk texts live in one UTF-8 blob addressed by
+    ``text_offsets``, which is memory-mapped rather than loaded.
+    """
+
+    ARRAYS = ("indptr", "chunk_ids", "tfs", "idf", "doc_len", "chunk_file", "text_offsets")
+
+    def __init__(self, vocab: Dict[str, int], files: List[Dict[str, str]], arrays: Dict[str, Any],
+                 texts, meta: Dict[str, Any]):
+        self.vocab = vocab
+        self.files = files
+        self.meta = meta
+        self.texts = texts
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.avgdl = float(meta.get("avgdl") or 1.0)
+        # Per-chunk length normalization is query independent, so compute it once
+        self._norm = BM25_K1 * (1.0 - BM25_B + BM25_B * np.asarray(self.doc_len) / self.avgdl)
+
+    @classmethod
+    def build(cls, documents: Iterable[Dict[str, Any]], chunk_chars: int = DEFAULT_CHUNK_CHARS,
+              overlap: int = DEFAULT_CHUNK_OVERLAP, vector_store_id: str = "") -> "LocalIndex":
+        """
+        Build an in-memory index from documents.
+
+        Args:
+            documents: Dicts with 'id', 'title' and 'text' keys
+            chunk_chars: Target chunk size in characters
+            overlap: Characters shared between consecutive chunks
+            vector_store_id: Store the index mirrors, recorded in its metadata
+
+        Returns:
+            The built index
+        """
+        vocab: Dict[str, int] = {}
+        files: List[Dict[str, str]] = []
+        postings: List[List[tuple]] = []
+        doc_len: List[int] = []
+        chunk_file: List[int] = []
+        blob = bytearray()
+        text_offsets = [0]
+
+        for document in documents:
+            file_index = len(files)
+            files.append({"id": document["id"], "title": document.get("title") or document["id"]})
+            for chunk in chunk_text(document.get("text") or "", chunk_chars, overlap):
+                chunk_id = len(doc_len)
+                counts = Counter(tokenize(chunk))
+                for term, tf in counts.items():
+                    term_id = vocab.setdefault(term, len(vocab))
+                    if term_id == len(postings):
+                        postings.append([])
+                    postings[term_id].append((chunk_id, tf))
+                doc_len.append(sum(counts.values()))
+                chunk_file.append(file_index)
+                blob += chunk.encode("utf-8")
+                text_offsets.append(len(blob))
+
+        n_chunks = len(doc_len)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings], dtype=np.int64)
+        chunk_ids = np.fromiter((c for p in postings for c, _ in p), dtype=np.int32,
+                                count=int(indptr[-1]))
+        tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float32,
+                          count=int(indptr[-1]))
+        df = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((n_chunks - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        arrays = {
+            "indptr": indptr,
+            "chunk_ids": chunk_ids,
+            "tfs": tfs,
+            "idf": idf,
+            "doc_len": np.asarray(doc_len, dtype=np.float32),
+            "chunk_file": np.asarray(chunk_file, dtype=np.int32),
+            "text_offsets": np.asarray(text_offsets, dtype=np.int64),
+        }
+        meta = {
+            "vector_store_id": vector_store_id,
+            "built_at": time.time(),
+            "chunks": n_chunks,
+            "terms": len(vocab),
+            "avgdl": (sum(doc_len) / n_chunks) if n_chunks else 1.0,
+        }
+        return cls(vocab, files, arrays, bytes(blob), meta)
+
+    def save(self, directory: str) -> None:
+        """Write the index to ``directory``, replacing any previous index atomically."""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        for name in self.ARRAYS:
+            np.save(os.path.join(staging, f"{name}.npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(staging, "texts.bin"), "wb") as f:
+            f.write(bytes(self.texts))
+        with open(os.path.join(staging, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f)
+        with open(os.path.join(staging, "files.json"), "w", encoding="utf-8") as f:
+            json.dump(self.files, f)
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+        previous = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, previous)
+        os.rename(staging, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, vector_store_id: str = "") -> "LocalIndex":
+        """
+        Memory-map an index previously written by ``save``.
+
+        Args:
+            directory: Index directory
+            vector_store_id: If set, the store the index must mirror
+
+        Raises:
+            FileNotFoundError: If no index has been written to ``directory``
+            ValueError: If the index was synced from a different vector store
+        """
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in cls.ARRAYS
+        }
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+        with open(os.path.join(directory, "files.json"), encoding="utf-8") as f:
+            files = json.load(f)
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if vector_store_id and meta.get("vector_store_id") != vector_store_id:
+            raise ValueError(
+                f"Index at {directory} mirrors vector store {meta.get('vector_store_id')!r}, "
+                f"not {vector_store_id!r}"
+            )
+
+        texts: Any = b""
+        with open(os.path.join(directory, "texts.bin"), "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(vocab, files, arrays, texts, meta)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def chunk(self, chunk_id: int) -> str:
+        """Return the text of a chunk."""
+        start, end = self.text_offsets[chunk_id], self.text_offsets[chunk_id + 1]
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def score(self, query: str) -> np.ndarray:
+        """Return BM25 scores of every chunk for ``query``."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = self._norm
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            ids = self.chunk_ids[start:end]
+            tf = self.tfs[start:end]
+            # Chunk IDs are unique within a term's postings, so a plain
+            # fancy-indexed add is safe here
+            scores[ids] += self.idf[term_id] * tf * (BM25_K1 + 1.0) / (tf + norm[ids])
+        return scores
+
+    def search(self, query: str, limit: int = 5) -> List[SimpleNamespace]:
+        """
+        Return the top ``limit`` chunks for ``query``.
+
+        Results mimic the items of ``vector_stores.search`` responses, with
+        ``file_id``, ``filename``, ``score`` and a ``content`` list, so they
+        can be shaped by the same code as remote results.
+        """
+        if not len(self):
+            return []
+        scores = self.score(query)
+        matched = np.flatnonzero(scores > 0)
+        if not matched.size:
+            return []
+        if matched.size > limit:
+            top = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        else:
+            top = matched
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for chunk_id in top:
+            file = self.files[int(self.chunk_file[chunk_id])]
+            results.append(SimpleNamespace(
+                file_id=file["id"],
+                filename=file["title"],
+                score=float(scores[chunk_id]),
+                content=[SimpleNamespace(type="text", text=self.chunk(int(chunk_id)))],
+            ))
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Return index size and build metadata."""
+        return {"files": len(self.files), **self.meta}
+
+
+async def sync_index(openai_client, vector_store_id: str, directory: str,
+                     concurrency: int = 8) -> LocalIndex:
+    """
+    Mirror every file of a vector store into a local index on disk.
+
+    Args:
+        openai_client: AsyncOpenAI client (or a stub with the same interface)
+        vector_store_id: Vector store to mirror
+        directory: Where to write the index
+        concurrency: Maximum number of concurrent content downloads
+
+    Returns:
+        The freshly built index
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(file) -> Dict[str, Any]:
+        # Vector store file entries carry no filename, so read it from the
+        # file object alongside the content
+        async with semaphore:
+            content, file_info = await asyncio.gather(
+                openai_client.vector_stores.files.content(
+                    vector_store_id=vector_store_id, file_id=file.id),
+                openai_client.files.retrieve(file.id),
+            )
+        parts = [item.text for item in getattr(content, "data", None) or [] if hasattr(item, "text")]
+        return {
+            "id": file.id,
+            "title": getattr(file_info, "filename", None) or f"Document {file.id}",
+            "text": "\n".join(parts),
+        }
+
+    files = [file async for file in openai_client.vector_stores.files.list(
+        vector_store_id=vector_store_id)]
+    logger.info(f"Mirroring {len(files)} files from vector store {vector_store_id}")
+    documents = await asyncio.gather(*(download(file) for file in files))
+
+    index = LocalIndex.build(documents, vector_store_id=vector_store_id)
+    index.save(directory)
+    logger.info(f"Wrote local index with {len(index)} chunks to {directory}")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local vector store mirror.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync = subparsers.add_parser("sync", help="Mirror the vector store into a local index")
+    sync.add_argument("--dir", default=os.environ.get("LOCAL_INDEX_PATH", "data/index"),
+                      help="Index directory (default: LOCAL_INDEX_PATH or data/index)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from openai import AsyncOpenAI
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(override=True)
+    vector_store_id = os.environ.get("VECTOR_STORE_ID", "")
+    if not vector_store_id:
+        raise SystemExit("VECTOR_STORE_ID is required")
+
+    async def run():
+        client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        try:
+            await sync_index(client, vector_store_id, args.dir)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Lightweight latency instrumentation for the GameBot MCP server.
+
+Besides the histograms used internally, this module has a small metrics
+registry that renders the Prometheus text exposition format. Counters,
+gauges and histograms are updated on the request path with a dict lookup
+and a few integer operations; everything else (cache, upstream and
+admission statistics the components already keep) is read by collector
+functions only when ``/metrics`` is scraped.
+"""
+
+import bisect
+import math
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Default bucket upper bounds in seconds, from 1ms up to the 30s upstream timeout
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2,
+    0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Observations are O(log buckets) and only touch a few integers, so the
+    histogram is cheap enough to record every request. Percentiles are
+    estimated by linear interpolation within the matching bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Record a single latency observation in seconds."""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Estimate the ``q``-th percentile (0-100) of the observed latencies.
+
+        Returns:
+            Estimated latency in seconds, or None if nothing was observed
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self.count
+        if not total:
+            return None
+        rank = q / 100.0 * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * ((rank - seen) / bucket_count)
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return cumulative bucket counts and summary statistics."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self.count
+            total_sum = self.sum
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append(("+Inf" if bound == float("inf") else bound, running))
+        return {
+            "count": total,
+            "sum": total_sum,
+            "mean": (total_sum / total) if total else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": cumulative,
+        }
+
+
+class RollingLatency:
+    """
+    Latencies of the most recent ``size`` observations.
+
+    Unlike ``LatencyHistogram`` the percentiles are exact and only reflect
+    the recent window, so they follow an upstream whose latency shifts.
+    The sorted window is cached and only rebuilt after ``refresh`` new
+    observations, keeping percentile lookups cheap on the request path.
+    """
+
+    def __init__(self, size: int = 1000, refresh: int = 16):
+        self._window = deque(maxlen=size)
+        self.refresh = max(1, refresh)
+        self._sorted: List[float] = []
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+    def observe(self, seconds: float) -> None:
+        """Record a single latency observation in seconds."""
+        self._window.append(seconds)
+        self._stale += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Return the ``q``-th percentile (0-100) of the window by nearest rank.
+
+        Returns:
+            Latency in seconds, or None if nothing was observed
+        """
+        if self._stale >= self.refresh or len(self._sorted) != len(self._window):
+            self._sorted = sorted(self._window)
+            self._stale = 0
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, max(0, int(q / 100.0 * len(self._sorted) + 0.5) - 1))
+        return self._sorted[index]
+
+
+class MetricFamily(NamedTuple):
+    """One metric as exposed to Prometheus: its samples plus HELP and TYPE."""
+
+    name: str
+    kind: str  # counter, gauge or histogram
+    help: str
+    # (sample name, labels, value)
+    samples: List[Tuple[str, Dict[str, str], float]]
+
+
+class _Metric:
+    """Base of the labelled metrics: one child per combination of label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the child for ``values``, one per label name, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _labelled(self):
+        for values, child in list(self._children.items()):
+            yield dict(zip(self.labelnames, values)), child
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter; by convention its name ends in ``_total``."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increment an unlabelled counter."""
+        self.labels().inc(amount)
+
+    def collect(self) -> List[MetricFamily]:
+        samples = [(self.name, labels, child.value) for labels, child in self._labelled()]
+        return [MetricFamily(self.name, self.kind, self.help, samples)]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        """Decrement an unlabelled gauge."""
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        """Set an unlabelled gauge."""
+        self.labels().set(value)
+
+
+def histogram_samples(name: str, labels: Dict[str, str],
+                      histogram: LatencyHistogram) -> List[Tuple[str, Dict[str, str], float]]:
+    """Render a ``LatencyHistogram`` as cumulative ``_bucket``, ``_sum`` and ``_count`` samples."""
+    snapshot = histogram.snapshot()
+    samples = [(f"{name}_bucket", {**labels, "le": str(bound)}, count)
+               for bound, count in snapshot["buckets"]]
+    samples.append((f"{name}_sum", labels, snapshot["sum"]))
+    samples.append((f"{name}_count", labels, snapshot["count"]))
+    return samples
+
+
+class Histogram(_Metric):
+    """Latency histogram per combination of label values, backed by ``LatencyHistogram``."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return LatencyHistogram(self.buckets)
+
+    def observe(self, seconds: float) -> None:
+        """Record an observation on an unlabelled histogram."""
+        self.labels().observe(seconds)
+
+    def collect(self) -> List[MetricFamily]:
+        samples = []
+        for labels, child in self._labelled():
+            samples.extend(histogram_samples(self.name, labels, child))
+        return [MetricFamily(self.name, self.kind, self.help, samples)]
+
+
+Collector = Callable[[], Iterable[MetricFamily]]
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """
+    Set of metrics and scrape-time collectors rendered together.
+
+    Collectors are called on every ``render`` and return ``MetricFamily``
+    tuples built from statistics kept elsewhere, so exposing them costs
+    nothing until something scrapes.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Collector) -> Collector:
+        """Add a function returning ``MetricFamily`` values at scrape time; usable as a decorator."""
+        self._collectors.append(collector)
+        return collector
+
+    def collect(self) -> List[MetricFamily]:
+        families = []
+        for metric in self._metrics:
+            families.extend(metric.collect())
+        for collector in self._collectors:
+            families.extend(collector())
+        return families
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format (version 0.0.4)."""
+        return render_families(self.collect())
+
+
+def render_families(families: Iterable[MetricFamily]) -> str:
+    """Render metric families in the Prometheus text exposition format."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for name, labels, value in family.samples:
+            if value is None:
+                continue
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,105 @@
+"""
+Background prefetch of documents that appear in search results.
+
+Agents almost always follow a search with a fetch of one of its top hits,
+so the search tool hands the IDs of its top results to a ``Prefetcher``,
+which fetches them into the local document tiers before they are asked
+for. Prefetching is low priority: a few workers at most, a token bucket
+limiting documents per second, and a bounded queue. Work that does not fit
+the budget is dropped rather than delayed, since a late prefetch is
+useless.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Set
+
+from admission import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Fetches scheduled document IDs in the background under a budget.
+
+    Args:
+        fetch: Coroutine function fetching one document into the local
+            tiers; it should return quickly when the document is local
+        rate: Documents per second the budget refills at
+        burst: Documents that may be prefetched back to back
+        concurrency: Maximum number of prefetches in flight
+        max_queue: Maximum number of IDs waiting; extras are dropped
+        remember: Number of recently prefetched IDs not scheduled again
+    """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[Any]], rate: float = 1.0,
+                 burst: float = 10.0, concurrency: int = 1, max_queue: int = 100,
+                 remember: int = 1024):
+        self._fetch = fetch
+        self._bucket = TokenBucket(rate, max(1.0, burst))
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.remember = remember
+        self._queue: "OrderedDict[str, None]" = OrderedDict()
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._workers: Set[asyncio.Task] = set()
+        self.scheduled = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.fetched = 0
+        self.failed = 0
+
+    def schedule(self, ids: Iterable[str]) -> None:
+        """Queue documents for prefetching; returns immediately."""
+        for doc_id in ids:
+            if doc_id in self._queue or doc_id in self._recent:
+                self.skipped += 1
+                continue
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                continue
+            self._queue[doc_id] = None
+            self.scheduled += 1
+        while self._queue and len(self._workers) < self.concurrency:
+            task = asyncio.ensure_future(self._run())
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+
+    async def _run(self) -> None:
+        while self._queue:
+            doc_id, _ = self._queue.popitem(last=False)
+            if self._bucket.reserve(0.0) is None:
+                # Over budget: drop the rest of the queue as well
+                self.dropped += 1 + len(self._queue)
+                self._queue.clear()
+                return
+            self._recent[doc_id] = None
+            if len(self._recent) > self.remember:
+                self._recent.popitem(last=False)
+            try:
+                await self._fetch(doc_id)
+                self.fetched += 1
+            except Exception as e:
+                logger.info(f"Prefetch of {doc_id} failed: {str(e)}")
+                self.failed += 1
+
+    async def close(self) -> None:
+        """Cancel the queued and running prefetches."""
+        self._queue.clear()
+        for task in list(self._workers):
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, in-flight count and prefetch counters."""
+        return {
+            "queued": len(self._queue),
+            "inflight": len(self._workers),
+            "scheduled": self.scheduled,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "fetched": self.fetched,
+            "failed": self.failed,
+        }
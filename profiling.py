@@ -0,0 +1,230 @@
+"""
+Opt-in request profiling and slow-request capture.
+
+A profiled request carries a ``RequestTrace`` in a context variable, so
+the stages of the wrapper, the tools and the upstream policies can add
+timed spans to it with ``record_span`` without it being passed around;
+when no request is profiled that costs one context variable lookup.
+Requests are profiled when sampled at ``sample_rate`` or when they send
+the configured token in the ``x-profile-token`` header.
+
+One profiled request at a time also runs under ``cProfile``. The profiler
+sees every task on the event loop while it is enabled, so a CPU profile
+shows what the process was doing during the request, not only the
+request's own code. Requests slower than ``slow_threshold`` are kept in a
+bounded list of recent slow requests with their spans and hottest
+functions, and their profiles are written as pstats files (readable with
+``python -m pstats``, snakeviz or flameprof) to a directory that keeps
+only the newest ``max_files`` dumps.
+"""
+
+import asyncio
+import cProfile
+import contextvars
+import hmac
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b'x-profile-token'
+
+# Functions listed per slow request, by own (exclusive) time
+HOTSPOT_COUNT = 10
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    'request_trace', default=None)
+
+
+def record_span(name: str, started: float, duration: float, **attributes: Any) -> None:
+    """
+    Add a timed span to the trace of the current request, if it is profiled.
+
+    Args:
+        name: Span name, e.g. "parse" or "upstream.fetch"
+        started: ``time.perf_counter()`` when the span started
+        duration: Span length in seconds
+        attributes: Extra JSON-serializable details of the span
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append({
+            "name": name,
+            "start": started - trace.started,
+            "duration": duration,
+            **attributes,
+        })
+
+
+class RequestTrace:
+    """Spans and optional CPU profile of one profiled request."""
+
+    def __init__(self, trace_id: int, route: str):
+        self.id = trace_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.spans: List[Dict[str, Any]] = []
+        self.profile: Optional[cProfile.Profile] = None
+        self._token: Optional[contextvars.Token] = None
+
+
+def hotspots(profile: cProfile.Profile, limit: int = HOTSPOT_COUNT) -> List[Dict[str, Any]]:
+    """Return the ``limit`` functions with the most own time in ``profile``."""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_seconds": own,
+            "cumulative_seconds": cumulative,
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+class RequestProfiler:
+    """
+    Samples requests for tracing and keeps the slow ones.
+
+    Args:
+        sample_rate: Fraction of requests profiled (0.01 profiles 1%)
+        slow_threshold: Seconds above which a profiled request is kept
+        directory: Where pstats dumps of slow requests are written; empty
+            keeps them in memory only
+        max_files: Number of dumps kept in ``directory``
+        max_recent: Number of slow requests listed by ``recent``
+        token: Secret that profiles a request sent with it in the
+            ``x-profile-token`` header; empty disables the header
+    """
+
+    def __init__(self, sample_rate: float = 0.0, slow_threshold: float = 1.0,
+                 directory: str = "", max_files: int = 50, max_recent: int = 100,
+                 token: str = ""):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.directory = directory
+        self.max_files = max_files
+        self.token = token.encode() if token else b""
+        self.recent: "deque[Dict[str, Any]]" = deque(maxlen=max_recent)
+        self._ids = itertools.count(1)
+        self._profiling: Optional[RequestTrace] = None
+        self.profiled = 0
+        self.slow = 0
+        self.dumps = 0
+
+    def authorized(self, headers) -> bool:
+        """True if ``headers`` carry the profiling token."""
+        if not self.token:
+            return False
+        for name, value in headers:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def start(self, route: str, headers) -> Optional[RequestTrace]:
+        """
+        Decide whether to profile a request and start its trace if so.
+
+        Must be paired with ``finish`` in the same context.
+
+        Returns:
+            The trace of a profiled request, or None
+        """
+        if not (self.sample_rate and random.random() < self.sample_rate) and not self.authorized(headers):
+            return None
+        trace = RequestTrace(next(self._ids), route)
+        if self._profiling is None:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (a debugger, coverage) owns the hook
+                profile = None
+            if profile is not None:
+                trace.profile = profile
+                self._profiling = trace
+        trace._token = _current_trace.set(trace)
+        self.profiled += 1
+        return trace
+
+    async def finish(self, trace: RequestTrace, status: int) -> Optional[Dict[str, Any]]:
+        """
+        Stop profiling a request and keep it if it was slow.
+
+        Returns:
+            The slow-request entry, or None if the request was fast
+        """
+        duration = time.perf_counter() - trace.started
+        _current_trace.reset(trace._token)
+        if trace.profile is not None:
+            trace.profile.disable()
+            self._profiling = None
+        if duration < self.slow_threshold:
+            return None
+
+        entry = {
+            "id": trace.id,
+            "route": trace.route,
+            "status": status,
+            "duration": duration,
+            "started_at": trace.started_at.isoformat(),
+            "spans": trace.spans,
+            "hotspots": None,
+            "profile": None,
+        }
+        if trace.profile is not None:
+            # Building the stats and writing the dump is blocking work
+            entry["hotspots"], entry["profile"] = await asyncio.to_thread(self._save, trace)
+        self.slow += 1
+        self.recent.appendleft(entry)
+        logger.warning(f"Slow request {trace.route} took {duration:.3f}s (trace {trace.id})")
+        return entry
+
+    def _save(self, trace: RequestTrace):
+        top = hotspots(trace.profile)
+        if not self.directory:
+            return top, None
+        os.makedirs(self.directory, exist_ok=True)
+        route = re.sub(r"[^A-Za-z0-9]+", "_", trace.route).strip("_")
+        # Timestamp first so names sort by age; the pid keeps workers apart
+        name = f"{trace.started_at:%Y%m%dT%H%M%S}-{os.getpid()}-{trace.id:06d}-{route}.pstats"
+        try:
+            trace.profile.dump_stats(os.path.join(self.directory, name))
+            self.dumps += 1
+            self._prune()
+        except OSError as e:
+            logger.error(f"Could not write profile {name}: {str(e)}")
+            return top, None
+        return top, name
+
+    def _prune(self) -> None:
+        """Delete the oldest dumps beyond ``max_files``."""
+        dumps = sorted(name for name in os.listdir(self.directory) if name.endswith(".pstats"))
+        for name in dumps[:max(0, len(dumps) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the profiling settings and counters."""
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_threshold": self.slow_threshold,
+            "directory": self.directory or None,
+            "max_files": self.max_files,
+            "header": bool(self.token),
+            "profiled": self.profiled,
+            "slow": self.slow,
+            "dumps": self.dumps,
+        }
@@ -0,0 +1,121 @@
+"""
+Re-ranking and deduplication of raw search hits.
+
+The vector store returns one hit per matching chunk, so a single file can
+take several of the result slots. The search tool overfetches, merges the
+chunks of each file into one document and optionally re-scores the
+documents with a small BM25 computed over just the candidates, so agents
+get the top-k distinct documents per call.
+"""
+
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, List, Sequence
+
+import numpy as np
+
+from local_index import BM25_B, BM25_K1, tokenize
+
+# none: upstream order; bm25: local lexical score only; hybrid: equal blend
+# of the min-max normalized upstream and lexical scores
+RERANK_MODES = ("none", "bm25", "hybrid")
+
+
+def content_texts(item: Any) -> List[str]:
+    """Return the text of each content chunk of a search hit."""
+    texts = []
+    for content in getattr(item, 'content', None) or []:
+        if hasattr(content, 'text'):
+            texts.append(content.text)
+        elif isinstance(content, dict):
+            texts.append(content.get('text', ''))
+    return texts
+
+
+def merge_by_file(items: Sequence[Any]) -> List[Any]:
+    """
+    Merge hits that share a ``file_id`` into one document per file.
+
+    Documents keep the position of their first (best ranked) chunk, take
+    the highest chunk score, and carry every chunk in ``content``. Hits
+    without a ``file_id`` are passed through unchanged.
+    """
+    merged = {}
+    for index, item in enumerate(items):
+        file_id = getattr(item, 'file_id', None)
+        if file_id is None:
+            merged[('item', index)] = item
+            continue
+        document = merged.get(file_id)
+        score = getattr(item, 'score', None) or 0.0
+        content = list(getattr(item, 'content', None) or [])
+        if document is None:
+            merged[file_id] = SimpleNamespace(
+                file_id=file_id,
+                filename=getattr(item, 'filename', None),
+                score=score,
+                attributes=getattr(item, 'attributes', None),
+                content=content,
+            )
+        else:
+            document.score = max(document.score, score)
+            document.content.extend(content)
+    return list(merged.values())
+
+
+def bm25_scores(query: str, texts: Sequence[str]) -> np.ndarray:
+    """
+    Score ``texts`` against ``query`` with BM25, using the texts themselves
+    as the collection for document frequencies and average length.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not texts:
+        return np.zeros(len(texts), dtype=np.float64)
+
+    tf = np.zeros((len(texts), len(terms)), dtype=np.float64)
+    doc_len = np.zeros(len(texts), dtype=np.float64)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        doc_len[row] = len(tokens)
+        tf[row] = [counts.get(term, 0) for term in terms]
+
+    n = len(texts)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+    avg_len = doc_len.mean() or 1.0
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / avg_len)
+    return (tf * (BM25_K1 + 1.0) / (tf + norm[:, None])) @ idf
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span > 0 else np.zeros_like(values)
+
+
+def rerank(query: str, items: Sequence[Any], limit: int, mode: str = "none") -> List[Any]:
+    """
+    Merge hits by file, re-score them according to ``mode`` and keep the top ``limit``.
+
+    Args:
+        query: Search query
+        items: Raw hits, best first, as returned by the search backend
+        limit: Number of distinct documents to return
+        mode: One of ``RERANK_MODES``
+
+    Returns:
+        Up to ``limit`` documents, best first
+    """
+    documents = merge_by_file(items)
+    if mode == "none" or len(documents) < 2:
+        return documents[:limit]
+
+    lexical = bm25_scores(query, ["\n".join(content_texts(d)) for d in documents])
+    if mode == "bm25":
+        keys = lexical
+    else:
+        upstream = np.array([getattr(d, 'score', None) or 0.0 for d in documents], dtype=np.float64)
+        keys = 0.5 * _min_max(upstream) + 0.5 * _min_max(lexical)
+    # Stable sort so ties keep the upstream order
+    order = np.argsort(-keys, kind="stable")[:limit]
+    return [documents[i] for i in order]
@@ -0,0 +1,203 @@
+"""
+Production entry point for the MCP server.
+
+Runs ``server:app`` under uvicorn with:
+
+- one worker process per available CPU, counting the CPU affinity mask and
+  a cgroup CPU quota, so a container limited to 2 CPUs on a 64-core host
+  runs 2 workers; ``WEB_CONCURRENCY`` (set by Heroku) overrides it
+- uvloop and httptools when they are installed, asyncio and h11 otherwise
+- a graceful drain on SIGTERM: the listening socket is closed, open SSE
+  streams are ended so their clients reconnect elsewhere, and in-flight
+  requests get ``GRACEFUL_SHUTDOWN_TIMEOUT`` seconds to finish before they
+  are cancelled
+- client addresses taken from ``X-Forwarded-For`` when the peer is one of
+  the proxies in ``FORWARDED_ALLOW_IPS``; for proxies with unknown addresses,
+  such as Heroku's router, set ``FORWARDED_TRUSTED_HOPS`` instead
+- with more than one worker, a search cache tier and per-client rate limits
+  shared by the workers through SQLite at ``SHARED_STATE_PATH``, which
+  defaults to a file in the temp directory (set it empty to keep them per
+  worker)
+- with more than one worker, the ``WARMUP_FILE`` warm-up runs once, into the
+  shared tiers, before the workers start; the workers skip their own only
+  when both ``SHARED_STATE_PATH`` and ``DOCUMENT_STORE_PATH`` keep its results
+
+Usage:
+    python runner.py [--host 0.0.0.0] [--port 8000] [--workers N]
+"""
+
+import argparse
+import importlib.util
+import logging
+import math
+import os
+import sys
+import tempfile
+from typing import Optional
+
+import uvicorn
+from uvicorn.importer import import_from_string
+from uvicorn.supervisors import Multiprocess
+
+logger = logging.getLogger(__name__)
+
+APP = "server:app"
+
+# Seconds in-flight requests get to finish after SIGTERM. Heroku sends
+# SIGKILL 30 seconds after SIGTERM, so the default leaves room for the
+# lifespan shutdown
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.environ.get("GRACEFUL_SHUTDOWN_TIMEOUT", "25"))
+
+# Seconds an idle client connection is kept open
+KEEPALIVE_TIMEOUT = int(os.environ.get("KEEPALIVE_TIMEOUT", "5"))
+
+# Proxy addresses trusted to set X-Forwarded-For and X-Forwarded-Proto, so
+# the client IP used for per-client rate limits is the real client's rather
+# than the load balancer's. Comma-separated. Do not use "*": uvicorn then
+# takes the leftmost X-Forwarded-For entry, which the client controls. When
+# the proxies' addresses are not known, set FORWARDED_TRUSTED_HOPS instead
+FORWARDED_ALLOW_IPS = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Exit status uvicorn uses when the application fails to start
+STARTUP_FAILURE = 3
+
+
+def cgroup_cpu_limit(root: str = "/sys/fs/cgroup") -> Optional[float]:
+    """
+    Return the CPU quota of the container, in CPUs, or None if unlimited.
+
+    Reads ``cpu.max`` (cgroup v2) or ``cpu.cfs_quota_us`` and
+    ``cpu.cfs_period_us`` (cgroup v1).
+    """
+    try:
+        with open(os.path.join(root, "cpu.max")) as limit:
+            quota, period = limit.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as quota_file:
+            quota = int(quota_file.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as period_file:
+            period = int(period_file.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def available_cpus(cgroup_root: str = "/sys/fs/cgroup") -> int:
+    """Number of CPUs this process may use: affinity mask capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(cgroup_root)
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def default_workers() -> int:
+    """Worker count from WEB_CONCURRENCY, or one per available CPU."""
+    configured = os.environ.get("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    return available_cpus()
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def warm_up_instance() -> None:
+    """
+    Run the startup warm-up once here instead of in every worker.
+
+    The shared tiers are filled before the workers start. The workers' own
+    warm-up is turned off only when everything it would do is persisted:
+    the searches in ``SHARED_STATE_PATH`` and, when documents are fetched,
+    the documents in ``DOCUMENT_STORE_PATH``. Otherwise the workers still
+    warm their own caches.
+    """
+    import asyncio
+
+    import server  # after SHARED_STATE_PATH is set
+
+    if asyncio.run(server.warm_up_instance()):
+        os.environ["WARMUP_ON_STARTUP"] = "false"
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that lets the application drain before shutting down.
+
+    uvicorn waits for every open connection to finish before running the
+    lifespan shutdown, so an SSE stream would hold a worker until the
+    graceful shutdown timeout. The app's ``drain`` is awaited first, to end
+    those streams.
+    """
+
+    async def shutdown(self, sockets=None) -> None:
+        app = import_from_string(self.config.app) if isinstance(self.config.app, str) else self.config.app
+        drain = getattr(app, "drain", None)
+        if drain is not None:
+            try:
+                await drain()
+            except Exception as e:
+                logger.error(f"Error draining application: {str(e)}")
+        await super().shutdown(sockets=sockets)
+
+
+def main():
+    """Run the server with production settings."""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: WEB_CONCURRENCY or one per available CPU)")
+    parser.add_argument("--forwarded-allow-ips", default=FORWARDED_ALLOW_IPS,
+                        help="Proxy addresses trusted to set X-Forwarded-For "
+                             "(default: FORWARDED_ALLOW_IPS or 127.0.0.1)")
+    args = parser.parse_args()
+    workers = args.workers or default_workers()
+
+    # Set before the server module is imported, here or in the spawned workers
+    if workers > 1:
+        os.environ.setdefault(
+            "SHARED_STATE_PATH", os.path.join(tempfile.gettempdir(), f"gamebot-{args.port}.sqlite3"))
+
+    if workers > 1:
+        warm_up_instance()
+
+    config = uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop="uvloop" if installed("uvloop") else "asyncio",
+        http="httptools" if installed("httptools") else "h11",
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+    )
+    logger.info(
+        f"Starting {workers} worker(s) on {args.host}:{args.port} "
+        f"(loop={config.loop}, http={config.http}, "
+        f"shared state={os.environ.get('SHARED_STATE_PATH') or 'off'})")
+
+    server = DrainingServer(config=config)
+    if workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(STARTUP_FAILURE)
+
+
+if __name__ == "__main__":
+    main()
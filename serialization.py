@@ -0,0 +1,93 @@
+"""
+Pluggable JSON serialization for HTTP responses.
+
+Uses orjson or msgspec when installed and falls back to the standard
+library. ``dumps`` always returns UTF-8 bytes, so responses can be sent
+without an extra ``.encode()`` copy. Select a backend explicitly with the
+JSON_BACKEND environment variable (auto, orjson, msgspec or json).
+"""
+
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _stdlib_loads(data) -> Any:
+    return json.loads(data)
+
+
+def _load_orjson() -> Tuple[Callable[[Any], bytes], Callable[[Any], Any]]:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson is stricter than the stdlib (e.g. non-str keys, big ints)
+            return _stdlib_dumps(obj)
+
+    return dumps, orjson.loads
+
+
+def _load_msgspec() -> Tuple[Callable[[Any], bytes], Callable[[Any], Any]]:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return encoder.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            return _stdlib_dumps(obj)
+
+    def loads(data) -> Any:
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    return dumps, loads
+
+
+BACKENDS: Dict[str, Callable[[], Tuple[Callable[[Any], bytes], Callable[[Any], Any]]]] = {
+    "orjson": _load_orjson,
+    "msgspec": _load_msgspec,
+    "json": lambda: (_stdlib_dumps, _stdlib_loads),
+}
+
+
+def load_backend(name: str = "auto") -> Tuple[str, Callable[[Any], bytes], Callable[[Any], Any]]:
+    """
+    Resolve a JSON backend by name.
+
+    Args:
+        name: "auto" picks the fastest installed backend; otherwise one of
+            "orjson", "msgspec" or "json"
+
+    Returns:
+        Tuple of (backend name, dumps, loads)
+    """
+    candidates = ("orjson", "msgspec", "json") if name == "auto" else (name,)
+    for candidate in candidates:
+        if candidate not in BACKENDS:
+            raise ValueError(f"Unknown JSON backend: {candidate}")
+        try:
+            dumps_fn, loads_fn = BACKENDS[candidate]()
+        except ImportError:
+            if name != "auto":
+                logger.warning(f"JSON backend {candidate} is not installed, using json")
+                return ("json",) + BACKENDS["json"]()
+            continue
+        return candidate, dumps_fn, loads_fn
+    return ("json",) + BACKENDS["json"]()
+
+
+backend, dumps, loads = load_backend(os.environ.get("JSON_BACKEND", "auto").lower())
@@ -6,29 +6,67 @@ capabilities designed to work with ChatGPT's chat and deep research features.
 """
 
 import asyncio
-import json
+import contextlib
+import contextvars
+import functools
+import hashlib
+import importlib
 import logging
 import os
 import time
-import uuid
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union, Set, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
-import fastapi
-from fastapi import FastAPI, Request, Response, status, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from fastmcp import FastMCP
-from fastmcp.tools import Tool  # ToolResult is not available in this version
-from openai import AsyncOpenAI
-from fastapi import HTTPException, Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.exceptions import RequestValidationError
-from pydantic import ValidationError as PydanticValidationError
-from aiohttp import ClientTimeout
+import httpx
+from starlette.exceptions import HTTPException
+
+from admission import AdmissionBudget, AdmissionController, AdmissionRejected
+from cache import SemanticCache, SingleFlight, TTLCache, load_embedder, normalize_query
+from docstore import DocumentStore
+from local_index import LocalIndex
+from metrics import MetricFamily, MetricsRegistry, render_families
+from prefetch import Prefetcher
+from profiling import RequestProfiler, record_span
+from rerank import RERANK_MODES, content_texts, rerank
+from shared import SharedCache, SharedDatabase, SharedRateLimiter
+from snippets import extract_snippet
+import serialization
+from sse import ConnectionRegistry, TooManyConnections
+from upstream import CircuitBreaker, UpstreamPolicy, UpstreamTransport
+from warmup import load_queries, warm_up
+
+# fastmcp and openai take most of the module's import time, so they are
+# imported when the server is built on startup rather than with the module.
+# Looked up through ``_lazy`` and cached as module globals, so tests can
+# still patch e.g. ``server.AsyncOpenAI``
+_LAZY_IMPORTS = {
+    "AsyncOpenAI": ("openai", "AsyncOpenAI"),
+    "FastMCP": ("fastmcp", "FastMCP"),
+}
+
+
+def _lazy(name: str):
+    """Return a lazily imported name, importing its module on first use."""
+    value = globals().get(name)
+    if value is None:
+        module, attribute = _LAZY_IMPORTS[name]
+        if module == "fastmcp":
+            # fastmcp renders a syntax-highlighted traceback for every failed
+            # tool call, which blocks the event loop for up to seconds per
+            # error, exactly when an upstream incident makes errors common.
+            # Must be set before fastmcp is imported
+            os.environ.setdefault("FASTMCP_ENABLE_RICH_TRACEBACKS", "false")
+        value = getattr(importlib.import_module(module), attribute)
+        globals()[name] = value
+    return value
+
+
+def __getattr__(name: str):
+    if name in _LAZY_IMPORTS:
+        return _lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Configure logging
@@ -43,6 +81,170 @@ load_dotenv(dotenv_path=env_path, override=True)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 VECTOR_STORE_ID = os.environ.get("VECTOR_STORE_ID", "")
 
+# HTTP request limits
+MAX_BODY_SIZE = int(os.environ.get("MAX_BODY_SIZE", str(1024 * 1024)))
+BODY_READ_TIMEOUT = float(os.environ.get("BODY_READ_TIMEOUT", "10"))
+
+# Admission control: a global in-flight cap, separate in-flight budgets for
+# search, fetch and JSON-RPC requests, and per-client token buckets (requests
+# per second and burst) keyed by API key or IP. Requests that cannot be
+# admitted within ADMISSION_QUEUE_TIMEOUT seconds get a 429. Off by default:
+# clients behind one NAT or proxy share an IP, and so a bucket
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "false").lower() in ("1", "true", "yes")
+ADMISSION_MAX_INFLIGHT = int(os.environ.get("ADMISSION_MAX_INFLIGHT", "256"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_SEARCH_MAX_INFLIGHT = int(os.environ.get("ADMISSION_SEARCH_MAX_INFLIGHT", "128"))
+ADMISSION_SEARCH_RATE = float(os.environ.get("ADMISSION_SEARCH_RATE", "10"))
+ADMISSION_SEARCH_BURST = float(os.environ.get("ADMISSION_SEARCH_BURST", "20"))
+ADMISSION_FETCH_MAX_INFLIGHT = int(os.environ.get("ADMISSION_FETCH_MAX_INFLIGHT", "64"))
+ADMISSION_FETCH_RATE = float(os.environ.get("ADMISSION_FETCH_RATE", "5"))
+ADMISSION_FETCH_BURST = float(os.environ.get("ADMISSION_FETCH_BURST", "10"))
+ADMISSION_RPC_MAX_INFLIGHT = int(os.environ.get("ADMISSION_RPC_MAX_INFLIGHT", "128"))
+ADMISSION_RPC_RATE = float(os.environ.get("ADMISSION_RPC_RATE", "10"))
+ADMISSION_RPC_BURST = float(os.environ.get("ADMISSION_RPC_BURST", "20"))
+# Comma-separated API keys that get a bucket of their own. Keys are not
+# otherwise checked, so any other Authorization or X-API-Key value is ignored
+# and the client is rate limited by IP; trusting unknown keys would let a
+# client dodge its limit by sending a new key with every request
+ADMISSION_API_KEYS = [key.strip() for key in os.environ.get("ADMISSION_API_KEYS", "").split(",")
+                      if key.strip()]
+
+# MCP JSON-RPC transport
+MCP_PROTOCOL_VERSION = "2025-06-18"
+RPC_BATCH_MAX_SIZE = int(os.environ.get("RPC_BATCH_MAX_SIZE", "50"))
+# JSON-RPC error code, in the implementation-defined server error range, of
+# a call turned away by admission control
+RPC_RATE_LIMITED = -32029
+
+# SSE connection limits and keepalive interval in seconds
+SSE_MAX_CONNECTIONS = int(os.environ.get("SSE_MAX_CONNECTIONS", "1000"))
+SSE_KEEPALIVE_INTERVAL = float(os.environ.get("SSE_KEEPALIVE_INTERVAL", "15"))
+
+# Search configuration
+SEARCH_RESULT_LIMIT = int(os.environ.get("SEARCH_RESULT_LIMIT", "5"))
+# Chunks requested from the backend per search; they are merged by file so
+# SEARCH_RESULT_LIMIT distinct documents can be returned (OpenAI allows up to 50)
+SEARCH_UPSTREAM_LIMIT = int(os.environ.get("SEARCH_UPSTREAM_LIMIT", "20"))
+# Re-scoring of the merged documents: none, bm25 or hybrid
+SEARCH_RERANK = os.environ.get("SEARCH_RERANK", "none").lower()
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "300"))
+# How long past its TTL a cached result may still be served, marked stale,
+# when the upstream is failing
+SEARCH_STALE_TTL = float(os.environ.get("SEARCH_STALE_TTL", "3600"))
+# Serve paraphrased queries from the results of a similar cached query. The
+# built-in hashing embedder only matches near-duplicates (reordered words,
+# plurals); set SEMANTIC_CACHE_EMBEDDER to "module:callable" to use a real
+# embedding model and a lower threshold
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_EMBEDDER = os.environ.get("SEMANTIC_CACHE_EMBEDDER", "hashing")
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "20"))
+SEARCH_BATCH_CONCURRENCY = int(os.environ.get("SEARCH_BATCH_CONCURRENCY", "4"))
+
+# Size in bytes of the query-aware snippet returned for each search hit, and
+# the marker placed around matched terms (empty disables highlighting)
+SNIPPET_BUDGET = int(os.environ.get("SNIPPET_BUDGET", "500"))
+SNIPPET_HIGHLIGHT = os.environ.get("SNIPPET_HIGHLIGHT", "**")
+
+# Opt-in request profiling: trace a sampled fraction of requests (0.01 is
+# 1%), or requests sending PROFILE_TOKEN in the x-profile-token header, and
+# keep those slower than PROFILE_SLOW_THRESHOLD seconds, with pstats dumps
+# in PROFILE_DIR when it is set
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_THRESHOLD = float(os.environ.get("PROFILE_SLOW_THRESHOLD", "1"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+
+# Maximum characters of text per event when streaming /fetch/stream responses
+FETCH_STREAM_CHUNK_CHARS = int(os.environ.get("FETCH_STREAM_CHUNK_CHARS", "65536"))
+
+# Persistent document store for fetched files (disabled when no path is set)
+DOCUMENT_STORE_PATH = os.environ.get("DOCUMENT_STORE_PATH", "")
+DOCUMENT_STORE_MAX_BYTES = int(os.environ.get("DOCUMENT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOCUMENT_STORE_MAX_AGE = float(os.environ.get("DOCUMENT_STORE_MAX_AGE", "0"))
+
+# SQLite file holding state shared by the workers of one instance: a second
+# search cache tier and the per-client rate limits (disabled when unset;
+# runner.py sets it when it starts more than one worker)
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", "")
+SHARED_CACHE_SIZE = int(os.environ.get("SHARED_CACHE_SIZE", "10000"))
+
+# Background prefetch of the top PREFETCH_TOP_N documents of each search
+# result, at most PREFETCH_RATE documents per second (PREFETCH_BURST back
+# to back) and PREFETCH_CONCURRENCY at a time; excess work is dropped
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", "3"))
+PREFETCH_RATE = float(os.environ.get("PREFETCH_RATE", "1"))
+PREFETCH_BURST = float(os.environ.get("PREFETCH_BURST", "10"))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "1"))
+PREFETCH_QUEUE_SIZE = int(os.environ.get("PREFETCH_QUEUE_SIZE", "100"))
+
+# In-memory cache of fetched documents, holding prefetched and warmed
+# documents when no DOCUMENT_STORE_PATH is set
+DOCUMENT_CACHE_SIZE = int(os.environ.get("DOCUMENT_CACHE_SIZE", "256"))
+DOCUMENT_CACHE_TTL = float(os.environ.get("DOCUMENT_CACHE_TTL", "3600"))
+
+# Warm-up on startup: replay the WARMUP_QUERIES most frequent queries of
+# the JSONL log WARMUP_FILE through search and fetch the top
+# WARMUP_FETCH_TOP documents of each, giving up after WARMUP_TIMEOUT seconds.
+# The timeout stays well under Heroku's 60 second boot limit, since a single
+# uvicorn process binds its port only after startup. runner.py warms the
+# shared tiers once per instance and, when SHARED_STATE_PATH and
+# DOCUMENT_STORE_PATH keep the results, sets WARMUP_ON_STARTUP=false for its
+# workers so they do not each replay the log
+WARMUP_FILE = os.environ.get("WARMUP_FILE", "")
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_QUERIES = int(os.environ.get("WARMUP_QUERIES", "100"))
+WARMUP_FETCH_TOP = int(os.environ.get("WARMUP_FETCH_TOP", "3"))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", "4"))
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "20"))
+WARMUP_QUERY_FIELD = os.environ.get("WARMUP_QUERY_FIELD", "query")
+
+# Search backend: "remote" (OpenAI Vector Store), "local" (mirrored BM25 index)
+# or "hybrid" (local index first, remote when the index has no hits)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "remote").lower()
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", "data/index")
+SEARCH_BACKENDS = ("remote", "local", "hybrid")
+
+# Upstream HTTP connection pool used by the OpenAI client. UPSTREAM_HTTP2 is
+# "auto" (on when the h2 package is installed), "true" or "false"
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "auto").lower()
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "30"))
+UPSTREAM_WRITE_TIMEOUT = float(os.environ.get("UPSTREAM_WRITE_TIMEOUT", "30"))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", "5"))
+
+# Hedged requests and adaptive timeouts for search and fetch upstream calls.
+# A call slower than the UPSTREAM_HEDGE_QUANTILE latency is duplicated (for
+# at most UPSTREAM_HEDGE_BUDGET of all calls), and calls time out after
+# UPSTREAM_TIMEOUT_MULTIPLIER x p99, clamped to the min/max bounds
+UPSTREAM_LATENCY_WINDOW = int(os.environ.get("UPSTREAM_LATENCY_WINDOW", "1000"))
+UPSTREAM_HEDGE_QUANTILE = float(os.environ.get("UPSTREAM_HEDGE_QUANTILE", "95"))
+UPSTREAM_HEDGE_BUDGET = float(os.environ.get("UPSTREAM_HEDGE_BUDGET", "0.05"))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.environ.get("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+UPSTREAM_TIMEOUT_MIN = float(os.environ.get("UPSTREAM_TIMEOUT_MIN", "2"))
+UPSTREAM_TIMEOUT_MAX = float(os.environ.get("UPSTREAM_TIMEOUT_MAX", "30"))
+
+# Circuit breaker per upstream endpoint: opens when, over the last
+# CIRCUIT_BREAKER_WINDOW calls, the error rate or the rate of calls slower
+# than CIRCUIT_BREAKER_SLOW_CALL_DURATION reaches its threshold, then fails
+# calls fast for CIRCUIT_BREAKER_OPEN_SECONDS before letting trial calls through
+CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_BREAKER_WINDOW = int(os.environ.get("CIRCUIT_BREAKER_WINDOW", "20"))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.environ.get("CIRCUIT_BREAKER_MIN_CALLS", "10"))
+CIRCUIT_BREAKER_ERROR_RATE = float(os.environ.get("CIRCUIT_BREAKER_ERROR_RATE", "0.5"))
+CIRCUIT_BREAKER_SLOW_CALL_DURATION = float(os.environ.get("CIRCUIT_BREAKER_SLOW_CALL_DURATION", "10"))
+CIRCUIT_BREAKER_SLOW_CALL_RATE = float(os.environ.get("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(os.environ.get("CIRCUIT_BREAKER_HALF_OPEN_CALLS", "3"))
+
 server_instructions = """
 This MCP server provides search and document retrieval capabilities
 for chat and deep research connectors. Use the search tool to find relevant documents
@@ -51,15 +253,420 @@ document content with citations.
 """
 
 
-def create_server(openai_client):
-    """Create and configure the MCP server with search and fetch tools."""
+async def gather_or_cancel(*aws):
+    """
+    Run awaitables concurrently and return their results in order.
+
+    Unlike ``asyncio.gather``, the first failure cancels the remaining
+    awaitables before the exception is re-raised, so a failed request does
+    not leave its sibling running in the background.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def validate_range(offset: int, length: Optional[int]) -> None:
+    """Reject negative fetch ranges with a 400."""
+    if offset < 0 or (length is not None and length < 0):
+        raise HTTPException(
+            status_code=400,
+            detail="offset and length must not be negative"
+        )
+
+
+def slice_text(text: str, offset: int = 0, length: Optional[int] = None) -> str:
+    """Return ``length`` characters of ``text`` starting at ``offset``."""
+    end = None if length is None else offset + length
+    return text[offset:end]
+
+
+async def retrieve_filename(openai_client, file_id: str) -> Optional[str]:
+    """
+    Return the name of an uploaded file, or None if it cannot be read.
+
+    Vector store file entries carry the attributes but no filename, so
+    document titles come from the file object; a failed lookup only costs
+    the document its title.
+    """
+    try:
+        file = await openai_client.files.retrieve(file_id)
+    except Exception as e:
+        logger.warning(f"Error reading filename of {file_id}: {str(e)}")
+        return None
+    filename = getattr(file, 'filename', None)
+    return filename if isinstance(filename, str) and filename else None
+
+
+async def iter_content_parts(content):
+    """
+    Yield the text of each content item of a ``files.content`` response.
+
+    Accepts either the SDK's async paginator, which is iterated page by
+    page as results arrive, or an awaitable resolving to a page with a
+    ``data`` list.
+    """
+    if hasattr(content, '__aiter__'):
+        async for item in content:
+            if hasattr(item, 'text'):
+                yield item.text
+        return
+    response = await content
+    for item in getattr(response, 'data', None) or []:
+        if hasattr(item, 'text'):
+            yield item.text
+
+
+async def iter_text_range(parts, offset: int, length: Optional[int], chunk_chars: int):
+    """
+    Re-chunk text parts into slices of at most ``chunk_chars`` characters.
+
+    Parts are joined with newlines, as in the fetch tool, and only the
+    characters in ``[offset, offset + length)`` are yielded. Only one part
+    is held in memory at a time.
+    """
+    end = None if length is None else offset + length
+    position = 0
+    first = True
+    if not hasattr(parts, '__aiter__'):
+        parts = _aiter(parts)
+    async for part in parts:
+        if not first:
+            part = "\n" + part
+        first = False
+        part_start, part_end = position, position + len(part)
+        position = part_end
+        if part_end <= offset:
+            continue
+        if end is not None and part_start >= end:
+            break
+        lo = max(offset - part_start, 0)
+        hi = len(part) if end is None else min(end - part_start, len(part))
+        for i in range(lo, hi, chunk_chars):
+            yield part[i:min(i + chunk_chars, hi)]
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+async def _prepend(first, rest):
+    if first is None:
+        return
+    yield first
+    async for item in rest:
+        yield item
+
+
+def search_cache_key(query: str, limit: int = SEARCH_RESULT_LIMIT) -> Tuple[str, str, int]:
+    """Build the search cache key for a query against the configured store."""
+    return (VECTOR_STORE_ID, normalize_query(query), limit)
+
+
+def create_upstream_policy(name: str) -> UpstreamPolicy:
+    """
+    Create a hedging/adaptive timeout policy from the UPSTREAM_* settings,
+    guarded by a circuit breaker from the CIRCUIT_BREAKER_* settings.
+    """
+    breaker = None
+    if CIRCUIT_BREAKER_ENABLED:
+        breaker = CircuitBreaker(
+            name,
+            window=CIRCUIT_BREAKER_WINDOW,
+            min_calls=CIRCUIT_BREAKER_MIN_CALLS,
+            failure_rate=CIRCUIT_BREAKER_ERROR_RATE,
+            slow_call_duration=CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+            slow_call_rate=CIRCUIT_BREAKER_SLOW_CALL_RATE,
+            open_seconds=CIRCUIT_BREAKER_OPEN_SECONDS,
+            half_open_calls=CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+        )
+    return UpstreamPolicy(
+        name,
+        window=UPSTREAM_LATENCY_WINDOW,
+        hedge_quantile=UPSTREAM_HEDGE_QUANTILE,
+        hedge_budget=UPSTREAM_HEDGE_BUDGET,
+        timeout_multiplier=UPSTREAM_TIMEOUT_MULTIPLIER,
+        min_timeout=UPSTREAM_TIMEOUT_MIN,
+        max_timeout=UPSTREAM_TIMEOUT_MAX,
+        breaker=breaker,
+    )
+
+
+def create_profiler() -> Optional[RequestProfiler]:
+    """Create the request profiler from the PROFILE_* settings, or None if disabled."""
+    if not PROFILING_ENABLED:
+        return None
+    return RequestProfiler(
+        sample_rate=PROFILE_SAMPLE_RATE,
+        slow_threshold=PROFILE_SLOW_THRESHOLD,
+        directory=PROFILE_DIR,
+        max_files=PROFILE_MAX_FILES,
+        token=PROFILE_TOKEN,
+    )
+
+
+def _key_digest(key: bytes) -> str:
+    """Digest an API key, so bucket tables never hold raw keys."""
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+ADMISSION_KEY_DIGESTS = frozenset(_key_digest(key.encode()) for key in ADMISSION_API_KEYS)
+
+# Proxies in front of the server that append the address they received a
+# request from to X-Forwarded-For (1 behind Heroku's router). Rate limits
+# then key on the entry the outermost of them added: everything to its left
+# was sent by the client and can be anything
+FORWARDED_TRUSTED_HOPS = int(os.environ.get("FORWARDED_TRUSTED_HOPS", "0"))
+
+
+def forwarded_client_ip(scope) -> Optional[str]:
+    """
+    Return the client IP added to X-Forwarded-For by the outermost of the
+    FORWARDED_TRUSTED_HOPS proxies, or None if the header has fewer entries,
+    meaning the request did not come through all of them.
+    """
+    hops = []
+    for name, value in scope.get('headers', ()):
+        if name == b'x-forwarded-for':
+            hops.extend(hop.strip() for hop in value.decode('latin-1').split(','))
+    if FORWARDED_TRUSTED_HOPS <= 0 or len(hops) < FORWARDED_TRUSTED_HOPS:
+        return None
+    return hops[-FORWARDED_TRUSTED_HOPS] or None
+
+
+def create_admission_controller() -> Optional[AdmissionController]:
+    """Create the admission controller from the ADMISSION_* settings."""
+    if not ADMISSION_ENABLED:
+        return None
+    return AdmissionController(
+        max_inflight=ADMISSION_MAX_INFLIGHT,
+        budgets={
+            "search": AdmissionBudget(ADMISSION_SEARCH_MAX_INFLIGHT,
+                                      ADMISSION_SEARCH_RATE, ADMISSION_SEARCH_BURST),
+            "fetch": AdmissionBudget(ADMISSION_FETCH_MAX_INFLIGHT,
+                                     ADMISSION_FETCH_RATE, ADMISSION_FETCH_BURST),
+            "rpc": AdmissionBudget(ADMISSION_RPC_MAX_INFLIGHT,
+                                   ADMISSION_RPC_RATE, ADMISSION_RPC_BURST),
+        },
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        shared_buckets=SharedRateLimiter(SharedDatabase(SHARED_STATE_PATH)) if SHARED_STATE_PATH else None,
+    )
+
+
+def create_document_store() -> Optional[DocumentStore]:
+    """Create the persistent document store if DOCUMENT_STORE_PATH is set."""
+    if not DOCUMENT_STORE_PATH:
+        return None
+    logger.info(f"Using document store: {DOCUMENT_STORE_PATH}")
+    return DocumentStore(
+        DOCUMENT_STORE_PATH,
+        vector_store_id=VECTOR_STORE_ID,
+        max_bytes=DOCUMENT_STORE_MAX_BYTES,
+        max_age=DOCUMENT_STORE_MAX_AGE,
+    )
+
+
+def load_local_index() -> Optional[LocalIndex]:
+    """Memory-map the local index at LOCAL_INDEX_PATH if it has been synced."""
+    try:
+        index = LocalIndex.load(LOCAL_INDEX_PATH, vector_store_id=VECTOR_STORE_ID)
+    except FileNotFoundError:
+        logger.warning(
+            f"Local index not found at {LOCAL_INDEX_PATH}. "
+            "Run 'python local_index.py sync' to build it."
+        )
+        return None
+    except ValueError as e:
+        logger.warning(f"Ignoring local index: {e}. Run 'python local_index.py sync' to rebuild it.")
+        return None
+    logger.info(f"Loaded local index with {len(index)} chunks from {LOCAL_INDEX_PATH}")
+    return index
+
+
+def create_shared_cache() -> Optional[SharedCache]:
+    """Create the search cache tier shared by the workers if SHARED_STATE_PATH is set."""
+    if not SHARED_STATE_PATH:
+        return None
+    logger.info(f"Using shared state: {SHARED_STATE_PATH}")
+    # The database outlives the process, so keep each store's results apart:
+    # after VECTOR_STORE_ID changes, no worker may serve the old store's hits
+    return SharedCache(SharedDatabase(SHARED_STATE_PATH), f"search:{VECTOR_STORE_ID}",
+                       maxsize=SHARED_CACHE_SIZE,
+                       ttl=SEARCH_CACHE_TTL, stale_ttl=SEARCH_STALE_TTL)
+
+
+def create_document_cache(document_store: Optional[DocumentStore]) -> Optional[TTLCache]:
+    """Create the in-memory document cache when prefetch or warm-up needs one."""
+    if document_store is not None or not (PREFETCH_ENABLED or WARMUP_FILE):
+        return None
+    return TTLCache(maxsize=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_CACHE_TTL)
+
+
+def create_prefetcher(fetch) -> Optional[Prefetcher]:
+    """Create the background prefetcher from the PREFETCH_* settings if enabled."""
+    if not PREFETCH_ENABLED:
+        return None
+    return Prefetcher(fetch, rate=PREFETCH_RATE, burst=PREFETCH_BURST,
+                      concurrency=PREFETCH_CONCURRENCY, max_queue=PREFETCH_QUEUE_SIZE)
+
+
+def create_semantic_cache(embedder=None) -> Optional[SemanticCache]:
+    """
+    Create the semantic search cache from the SEMANTIC_CACHE_* settings.
+
+    Args:
+        embedder: Optional embedding function; forces the cache on when given,
+            otherwise SEMANTIC_CACHE_EMBEDDER is loaded if the cache is enabled
+    """
+    if embedder is None:
+        if not SEMANTIC_CACHE_ENABLED:
+            return None
+        embedder = load_embedder(SEMANTIC_CACHE_EMBEDDER)
+    return SemanticCache(embedder, maxsize=SEMANTIC_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+                         threshold=SEMANTIC_CACHE_THRESHOLD)
+
+
+# Circuit breaker states as gauge values
+CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def server_metric_families(mcp) -> List[MetricFamily]:
+    """
+    Collect cache, single-flight and upstream statistics of a server created
+    by ``create_server`` as metric families. Called only when /metrics is
+    scraped; the components keep these counters anyway.
+    """
+    cache_lookups, cache_entries, cache_evictions = [], [], []
+    caches = (
+        ("search", getattr(mcp, 'search_cache', None)),
+        ("semantic", getattr(mcp, 'semantic_cache', None)),
+        ("shared", getattr(mcp, 'shared_cache', None)),
+        ("documents", getattr(mcp, 'document_store', None)),
+        ("document_cache", getattr(mcp, 'document_cache', None)),
+    )
+    for name, cache in caches:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        labels = {"cache": name}
+        cache_lookups.append(("gamebot_cache_lookups_total", {**labels, "result": "hit"}, stats["hits"]))
+        cache_lookups.append(("gamebot_cache_lookups_total", {**labels, "result": "miss"}, stats["misses"]))
+        if "stale_hits" in stats:
+            cache_lookups.append(
+                ("gamebot_cache_lookups_total", {**labels, "result": "stale"}, stats["stale_hits"]))
+        cache_entries.append(("gamebot_cache_entries", labels, stats.get("size", stats.get("documents"))))
+        cache_evictions.append(("gamebot_cache_evictions_total", labels, stats["evictions"]))
+
+    flight_calls, flight_shared, flight_inflight = [], [], []
+    for name in ("search", "fetch"):
+        flight = getattr(mcp, f'{name}_flight', None)
+        if flight is None:
+            continue
+        stats = flight.stats()
+        labels = {"tool": name}
+        flight_calls.append(("gamebot_singleflight_calls_total", labels, stats["calls"]))
+        flight_shared.append(("gamebot_singleflight_shared_total", labels, stats["shared"]))
+        flight_inflight.append(("gamebot_singleflight_inflight", labels, stats["inflight"]))
+
+    calls, failures, hedges, hedge_wins, timeouts, circuits = [], [], [], [], [], []
+    for name, policy in (getattr(mcp, 'upstream_policies', None) or {}).items():
+        stats = policy.stats()
+        labels = {"endpoint": name}
+        calls.append(("gamebot_upstream_calls_total", labels, stats["calls"]))
+        failures.append(("gamebot_upstream_failures_total", {**labels, "reason": "error"}, stats["errors"]))
+        failures.append(("gamebot_upstream_failures_total", {**labels, "reason": "timeout"}, stats["timeouts"]))
+        hedges.append(("gamebot_upstream_hedges_total", labels, stats["hedges"]))
+        hedge_wins.append(("gamebot_upstream_hedge_wins_total", labels, stats["hedge_wins"]))
+        timeouts.append(("gamebot_upstream_timeout_seconds", labels, stats["timeout"]))
+        circuit = stats["circuit"]
+        if circuit is not None:
+            failures.append(("gamebot_upstream_failures_total",
+                             {**labels, "reason": "circuit_open"}, circuit["rejected"]))
+            circuits.append(("gamebot_circuit_state", labels, CIRCUIT_STATE_VALUES[circuit["state"]]))
+
+    families = [
+        MetricFamily("gamebot_cache_lookups_total", "counter", "Cache lookups by cache and result", cache_lookups),
+        MetricFamily("gamebot_cache_entries", "gauge", "Entries held by each cache", cache_entries),
+        MetricFamily("gamebot_cache_evictions_total", "counter", "Entries evicted from each cache", cache_evictions),
+        MetricFamily("gamebot_singleflight_calls_total", "counter", "Tool calls that needed the upstream", flight_calls),
+        MetricFamily("gamebot_singleflight_shared_total", "counter",
+                     "Calls that joined an identical in-flight upstream request", flight_shared),
+        MetricFamily("gamebot_singleflight_inflight", "gauge", "Distinct upstream requests in flight", flight_inflight),
+        MetricFamily("gamebot_upstream_calls_total", "counter", "Upstream calls by endpoint", calls),
+        MetricFamily("gamebot_upstream_failures_total", "counter",
+                     "Failed upstream calls by endpoint and reason", failures),
+        MetricFamily("gamebot_upstream_hedges_total", "counter", "Hedged duplicate upstream requests", hedges),
+        MetricFamily("gamebot_upstream_hedge_wins_total", "counter",
+                     "Hedged requests that answered first", hedge_wins),
+        MetricFamily("gamebot_upstream_timeout_seconds", "gauge", "Current adaptive upstream timeout", timeouts),
+        MetricFamily("gamebot_circuit_state", "gauge",
+                     "Circuit breaker state (0 closed, 1 half open, 2 open)", circuits),
+    ]
+
+    prefetcher = getattr(mcp, 'prefetcher', None)
+    if prefetcher is not None:
+        stats = prefetcher.stats()
+        prefetched = [("gamebot_prefetch_documents_total", {"result": result}, stats[result])
+                      for result in ("fetched", "failed", "dropped", "skipped")]
+        families.append(MetricFamily("gamebot_prefetch_documents_total", "counter",
+                                     "Documents handed to the background prefetcher by outcome",
+                                     prefetched))
+
+    transport = getattr(mcp, 'upstream_transport', None)
+    if transport is not None:
+        stats = transport.stats()
+        families.append(MetricFamily("gamebot_upstream_connections", "gauge", "Pooled upstream connections by state", [
+            ("gamebot_upstream_connections", {"state": "active"}, stats["active"]),
+            ("gamebot_upstream_connections", {"state": "idle"}, stats["idle"]),
+        ]))
+        families.append(MetricFamily("gamebot_upstream_pool_waiting", "gauge",
+                                     "Requests waiting for a free upstream connection",
+                                     [("gamebot_upstream_pool_waiting", {}, stats["waiting"])]))
+    return families
+
+
+def create_server(openai_client, document_store: Optional[DocumentStore] = None,
+                  local_index: Optional[LocalIndex] = None,
+                  search_backend: Optional[str] = None, embedder=None):
+    """
+    Create and configure the MCP server with search and fetch tools.
+
+    Args:
+        openai_client: AsyncOpenAI client used for vector store requests
+        document_store: Optional persistent store for fetched documents;
+            defaults to the one configured by DOCUMENT_STORE_PATH
+        local_index: Optional local mirror of the vector store; loaded from
+            LOCAL_INDEX_PATH when the search backend needs it
+        search_backend: "remote", "local" or "hybrid"; defaults to SEARCH_BACKEND
+        embedder: Optional query embedding function for the semantic cache;
+            enables it regardless of SEMANTIC_CACHE_ENABLED
+    """
+    search_backend = (search_backend or SEARCH_BACKEND).lower()
+    if search_backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Invalid search backend: {search_backend}")
+    if SEARCH_RERANK not in RERANK_MODES:
+        raise ValueError(f"Invalid search rerank mode: {SEARCH_RERANK}")
+    # Overfetch so duplicate chunks of one file do not crowd out other files
+    upstream_limit = max(SEARCH_RESULT_LIMIT, SEARCH_UPSTREAM_LIMIT)
 
     # Initialize the FastMCP server
-    mcp = FastMCP(
+    mcp = _lazy("FastMCP")(
         name="Sample MCP Server",
         instructions=server_instructions,
     )
 
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from starlette.requests import Request
+
     # Define security headers middleware as a class
     class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         async def dispatch(self, request: Request, call_next):
@@ -71,6 +678,67 @@ def create_server(openai_client):
 
     # Add security headers middleware
     mcp.add_middleware(SecurityHeadersMiddleware)
+
+    # Cache search results keyed on the normalized query so repeated or
+    # trivially different queries skip the upstream round trip
+    search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+                            stale_ttl=SEARCH_STALE_TTL)
+    mcp.search_cache = search_cache
+
+    # Second tier matched by query embedding similarity (None when disabled)
+    semantic_cache = create_semantic_cache(embedder)
+    mcp.semantic_cache = semantic_cache
+
+    # Tier shared with the other workers, consulted after this worker's own
+    # cache misses (None when SHARED_STATE_PATH is unset)
+    shared_cache = create_shared_cache()
+    mcp.shared_cache = shared_cache
+
+    # Coalesce concurrent identical search and fetch calls into one upstream request
+    search_flight = SingleFlight()
+    fetch_flight = SingleFlight()
+    mcp.search_flight = search_flight
+    mcp.fetch_flight = fetch_flight
+
+    # Hedging and adaptive timeouts, tracked separately per upstream endpoint
+    search_policy = create_upstream_policy("search")
+    fetch_policy = create_upstream_policy("fetch")
+    mcp.upstream_policies = {"search": search_policy, "fetch": fetch_policy}
+
+    # Per-stage latency of the tools, exposed on /metrics together with the
+    # statistics of the caches and upstream policies collected at scrape time
+    metrics = MetricsRegistry()
+    tool_stages = metrics.histogram(
+        "gamebot_tool_stage_duration_seconds",
+        "Time spent in each stage of a tool call", ("tool", "stage"))
+    metrics.register_collector(lambda: server_metric_families(mcp))
+    mcp.metrics = metrics
+    search_backend_latency = tool_stages.labels("search", "backend")
+    search_shape_latency = tool_stages.labels("search", "shape")
+    fetch_store_latency = tool_stages.labels("fetch", "store")
+
+    # Upstream latency of the fetch tool's content + metadata requests
+    fetch_latency = tool_stages.labels("fetch", "upstream")
+    mcp.fetch_latency = fetch_latency
+
+    # Fetched documents are immutable, so keep them on disk across restarts
+    if document_store is None:
+        document_store = create_document_store()
+    mcp.document_store = document_store
+
+    # Without a store, prefetched documents are kept in memory instead
+    document_cache = create_document_cache(document_store)
+    mcp.document_cache = document_cache
+
+    # Fetches the top hits of each search in the background (None when disabled)
+    prefetcher = create_prefetcher(lambda id: prefetch_document(id))
+    mcp.prefetcher = prefetcher
+
+    # Local mirror of the vector store for offline and hybrid search
+    if local_index is None and search_backend != "remote":
+        local_index = load_local_index()
+    mcp.local_index = local_index
+    mcp.search_backend = search_backend
     
     # Register tools with proper MCP tool decorators
     @mcp.tool()
@@ -84,48 +752,181 @@ def create_server(openai_client):
         Returns:
             Dictionary with 'results' key containing list of matching documents
         """
+        result = await run_search(query)
+        schedule_prefetch(result)
+        return result
+
+    @mcp.tool()
+    async def search_batch(queries: List[str]) -> Dict[str, Any]:
+        """
+        Run several searches in one call.
+
+        Queries run concurrently (up to SEARCH_BATCH_CONCURRENCY at a time)
+        and repeated queries are only searched once. An error in one query
+        is reported in its own entry without failing the others.
+
+        Args:
+            queries: List of search query strings
+
+        Returns:
+            Dictionary with 'results' key containing one entry per query,
+            in request order, each with the query and its results
+        """
+        if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries are allowed per batch"
+            )
+
+        semaphore = asyncio.Semaphore(SEARCH_BATCH_CONCURRENCY)
+
+        async def run_one(query: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await run_search(query)
+                except Exception as e:
+                    logger.error(f"Batch search error for {query!r}: {str(e)}")
+                    return {"error": str(e), "results": []}
+
+        # Dedupe on the cache key so trivially different queries share a search
+        tasks = {}
+        for query in queries:
+            key = search_cache_key(query)
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(run_one(query))
+        await asyncio.gather(*tasks.values())
+        for task in tasks.values():
+            schedule_prefetch(task.result())
+
+        return {
+            "results": [
+                {"query": query, **tasks[search_cache_key(query)].result()}
+                for query in queries
+            ]
+        }
+
+    def schedule_prefetch(result: Dict[str, Any]) -> None:
+        """Queue the top documents of a search result for background prefetch."""
+        if prefetcher is None:
+            return
+        prefetcher.schedule(
+            hit["id"] for hit in result.get("results", [])[:PREFETCH_TOP_N]
+            if str(hit.get("id", "")).startswith("file_"))
+
+    async def run_search(query: str) -> Dict[str, Any]:
+        """Answer a search from the cache or a single shared upstream request."""
         if not query or not query.strip():
             return {"results": []}
 
+        cache_key = search_cache_key(query)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        if shared_cache is not None:
+            cached = await shared_lookup(cache_key)
+            if cached is not None:
+                # Kept locally for a full TTL, so a result may be served for
+                # up to twice SEARCH_CACHE_TTL after it was fetched
+                search_cache.set(cache_key, cached)
+                return cached
+        if semantic_cache is not None:
+            cached = await semantic_cache.aget(query)
+            if cached is not None:
+                return cached
+
+        # Concurrent identical queries share a single upstream request
+        return await search_flight.do(
+            cache_key, lambda: search_upstream(query, cache_key))
+
+    async def shared_lookup(cache_key: Tuple[str, str, int], stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Look a search up in the shared tier; errors count as misses."""
         try:
-            response = await openai_client.vector_stores.search(
-                vector_store_id=VECTOR_STORE_ID,
-                query=query,
-                with_content=True,
-                limit=5  # Limit results for testing
-            )
+            if stale:
+                return await shared_cache.aget_stale(cache_key)
+            return await shared_cache.aget(cache_key)
+        except Exception as e:
+            logger.error(f"Shared cache error: {str(e)}")
+            return None
+
+    async def search_remote(query: str) -> List[Any]:
+        """Search the OpenAI Vector Store and return the raw result items."""
+        response = await search_policy.call(lambda: openai_client.vector_stores.search(
+            vector_store_id=VECTOR_STORE_ID,
+            query=query,
+            max_num_results=upstream_limit
+        ))
+        return response.data if hasattr(response, 'data') and response.data else []
+
+    async def search_items(query: str) -> List[Any]:
+        """Return raw result items from the configured search backend."""
+        if search_backend == "remote":
+            return await search_remote(query)
+        if local_index is None:
+            if search_backend == "local":
+                raise RuntimeError("Local index is not available")
+            return await search_remote(query)
+
+        # Scoring is vectorized NumPy and takes a few milliseconds at most
+        items = local_index.search(query, upstream_limit)
+        if search_backend == "local" or items:
+            return items
+        return await search_remote(query)
+
+    async def search_upstream(query: str, cache_key: Tuple[str, str, int]) -> Dict[str, Any]:
+        """Run a search against the configured backend and cache the shaped results."""
+        try:
+            started = time.perf_counter()
+            items = await search_items(query)
+            shaping = time.perf_counter()
+            search_backend_latency.observe(shaping - started)
+            record_span("search.backend", started, shaping - started)
+
+            # Merge chunks by file and keep the top distinct documents
+            items = rerank(query, items, SEARCH_RESULT_LIMIT, SEARCH_RERANK)
             
             results = []
-            if hasattr(response, 'data') and response.data:
-                for i, item in enumerate(response.data):
+            if items:
+                for i, item in enumerate(items):
                     # Extract file_id, filename, and content
                     item_id = getattr(item, 'file_id', f"vs_{i}")
-                    item_filename = getattr(item, 'filename', f"Document {i+1}")
+                    item_filename = getattr(item, 'filename', None) or f"Document {i+1}"
                     
-                    # Extract text content from the content array
-                    content_list = getattr(item, 'content', [])
-                    text_content = ""
-                    if content_list and len(content_list) > 0:
-                        first_content = content_list[0]
-                        if hasattr(first_content, 'text'):
-                            text_content = first_content.text
-                        elif isinstance(first_content, dict):
-                            text_content = first_content.get('text', '')
-                    
-                    if not text_content:
-                        text_content = f"Content not available for {item_filename}"
+                    # Build the snippet from every content chunk of the file,
+                    # not just the first one
+                    snippet = extract_snippet(
+                        query, content_texts(item), SNIPPET_BUDGET, SNIPPET_HIGHLIGHT)
+
+                    if not snippet:
+                        snippet = f"Content not available for {item_filename}"
                     
                     results.append({
                         "id": item_id,
                         "title": item_filename,
-                        "text": text_content[:500] + ("..." if len(text_content) > 500 else ""),
+                        "text": snippet,
                         "url": f"#file-{item_id}"  # Placeholder URL
                     })
-            
+            search_shape_latency.observe(time.perf_counter() - shaping)
+            record_span("search.shape", shaping, time.perf_counter() - shaping)
+
+            # Only successful responses are cached; errors fall through below
+            search_cache.set(cache_key, {"results": results})
+            if semantic_cache is not None:
+                await semantic_cache.aset(cache_key, query, {"results": results})
+            if shared_cache is not None:
+                try:
+                    await shared_cache.aset(cache_key, {"results": results})
+                except Exception as e:
+                    logger.error(f"Shared cache error: {str(e)}")
             return {"results": results}
             
         except Exception as e:
             logger.error(f"Search error: {str(e)}")
+            # Serve the last known good results rather than nothing
+            stale = search_cache.get_stale(cache_key)
+            if stale is None and shared_cache is not None:
+                stale = await shared_lookup(cache_key, stale=True)
+            if stale is not None:
+                return {**stale, "stale": True}
             return {"error": str(e), "results": []}
     
     # Health check endpoint as a FastMCP tool
@@ -144,10 +945,6 @@ def create_server(openai_client):
             "service": "gamebot",
             "version": "1.0.0"
         }
-        
-        # Convert to a JSON string and back to ensure it's serializable
-        # This will raise an exception immediately if there are any serialization issues
-        import json
 
     @mcp.tool()
     async def fetch(document_id: str) -> Dict[str, Any]:
@@ -200,7 +997,7 @@ def create_server(openai_client):
             return {"error": str(e)}
 
     @mcp.tool()
-    async def fetch(id: str) -> Dict[str, Any]:
+    async def fetch(id: str, offset: int = 0, length: Optional[int] = None) -> Dict[str, Any]:
         """Fetch document with security checks."""
         if not id or not isinstance(id, str) or not id.startswith("file_"):
             raise HTTPException(
@@ -216,32 +1013,165 @@ def create_server(openai_client):
 
         Args:
             id: File ID from vector store (file-xxx) or local document ID
+            offset: Character offset to start the returned text at
+            length: Maximum number of characters of text to return;
+                the whole remainder when omitted
 
         Returns:
             Complete document with id, title, full text content,
-            optional URL, and metadata
+            optional URL, and metadata. When a range is requested the
+            'range' key holds the offset, length and total text length.
 
         Raises:
             ValueError: If the specified ID is not found
         """
         if not id:
             raise ValueError("Document ID is required")
+        validate_range(offset, length)
 
-        logger.info(f"Fetching content from vector store for file ID: {id}")
+        document = document_cache.get(id) if document_cache is not None else None
+        if document is None and document_store is not None:
+            started = time.perf_counter()
+            document = await document_store.aget(id)
+            fetch_store_latency.observe(time.perf_counter() - started)
+            record_span("fetch.store", started, time.perf_counter() - started, hit=document is not None)
+        if document is None:
+            # Concurrent fetches of the same document share a single upstream request
+            try:
+                document = await fetch_flight.do(id, lambda: fetch_upstream(id))
+            except Exception:
+                # Fall back to an expired stored copy while the upstream fails
+                stale = None
+                if document_store is not None:
+                    stale = await document_store.aget(id, allow_stale=True)
+                if stale is None:
+                    raise
+                logger.warning(f"Serving stale stored document: {id}")
+                document = {**stale, "stale": True}
+
+        if not offset and length is None:
+            return document
+        # The document may be shared with other waiters, so slice a copy
+        text = document.get("text") or ""
+        sliced = slice_text(text, offset, length)
+        return {
+            **document,
+            "text": sliced,
+            "range": {"offset": offset, "length": len(sliced), "total": len(text)},
+        }
+
+    async def fetch_stream(id: str, offset: int = 0, length: Optional[int] = None):
+        """
+        Stream a document as a sequence of events with bounded memory.
+
+        Yields a 'metadata' event, then 'content' events carrying at most
+        FETCH_STREAM_CHUNK_CHARS characters of text each, then an 'end'
+        event. Content parts are forwarded as the upstream pages arrive
+        instead of being joined into one string first.
+
+        The upstream reads up to the first content page go through the
+        fetch policy and its circuit breaker; if they fail, an expired
+        stored copy is streamed instead, as in the fetch tool.
+        """
+        validate_range(offset, length)
 
-        # Fetch file content from vector store
-        content_response = await openai_client.vector_stores.files.content(
-            vector_store_id=VECTOR_STORE_ID, file_id=id)
+        document = document_cache.get(id) if document_cache is not None else None
+        if document is None and document_store is not None:
+            document = await document_store.aget(id)
 
-        # Get file metadata
-        file_info = await openai_client.vector_stores.files.retrieve(
-            vector_store_id=VECTOR_STORE_ID, file_id=id)
+        upstream = None
+        if document is None:
+            try:
+                upstream = await fetch_policy.call(lambda: open_upstream_stream(id))
+            except Exception:
+                stale = None
+                if document_store is not None:
+                    stale = await document_store.aget(id, allow_stale=True)
+                if stale is None:
+                    raise
+                logger.warning(f"Serving stale stored document: {id}")
+                document = {**stale, "stale": True}
+
+        if document is not None:
+            event = {
+                "type": "metadata",
+                "id": id,
+                "title": document.get("title"),
+                "url": document.get("url"),
+                "metadata": document.get("metadata"),
+            }
+            if document.get("stale"):
+                event["stale"] = True
+            yield event
+            parts = [document.get("text") or ""]
+        else:
+            file_info, filename, parts = upstream
+            yield {
+                "type": "metadata",
+                "id": id,
+                "title": filename or f"Document {id}",
+                "url": f"https://platform.openai.com/storage/files/{id}",
+                "metadata": getattr(file_info, 'attributes', None) or None,
+            }
+
+        sent = 0
+        async for text in iter_text_range(parts, offset, length, FETCH_STREAM_CHUNK_CHARS):
+            sent += len(text)
+            yield {"type": "content", "text": text}
+        yield {"type": "end", "length": sent}
+
+    async def open_upstream_stream(id: str):
+        """
+        Request a document's metadata and first content page concurrently.
+
+        Returns the vector store file, its filename and an iterator over all
+        of its content parts, starting with the page already read.
+        """
+        content_parts = iter_content_parts(openai_client.vector_stores.files.content(
+            vector_store_id=VECTOR_STORE_ID, file_id=id))
+        file_info, filename, first_part = await gather_or_cancel(
+            openai_client.vector_stores.files.retrieve(
+                vector_store_id=VECTOR_STORE_ID, file_id=id),
+            retrieve_filename(openai_client, id),
+            anext(content_parts, None),
+        )
+        return file_info, filename, _prepend(first_part, content_parts)
+
+    mcp.fetch_stream = fetch_stream
+
+    async def prefetch_document(id: str) -> None:
+        """Bring a document into the local tiers unless it is already there."""
+        if document_cache is not None and id in document_cache:
+            return
+        if document_store is not None and await document_store.acontains(id):
+            return
+        await fetch_flight.do(id, lambda: fetch_upstream(id))
+
+    # Entry points for the warm-up, which bypasses the tool layer
+    mcp.run_search = run_search
+    mcp.prefetch_document = prefetch_document
+
+    async def fetch_upstream(id: str) -> Dict[str, Any]:
+        """Retrieve a document's content and metadata from the vector store."""
+        logger.info(f"Fetching content from vector store for file ID: {id}")
+
+        # Fetch file content and metadata concurrently; if either request
+        # fails the other one is cancelled. A slow pair is hedged as a whole
+        started = time.perf_counter()
+        content_response, file_info, filename = await fetch_policy.call(lambda: gather_or_cancel(
+            openai_client.vector_stores.files.content(
+                vector_store_id=VECTOR_STORE_ID, file_id=id),
+            openai_client.vector_stores.files.retrieve(
+                vector_store_id=VECTOR_STORE_ID, file_id=id),
+            retrieve_filename(openai_client, id),
+        ))
+        fetch_latency.observe(time.perf_counter() - started)
 
         # Extract content from paginated response
         file_content = ""
+        content_parts = []
         if hasattr(content_response, 'data') and content_response.data:
             # Combine all content chunks from FileContentResponse objects
-            content_parts = []
             for content_item in content_response.data:
                 if hasattr(content_item, 'text'):
                     content_parts.append(content_item.text)
@@ -250,11 +1180,9 @@ def create_server(openai_client):
             file_content = "No content available"
 
         # Use filename as title and create proper URL for citations
-        filename = getattr(file_info, 'filename', f"Document {id}")
-
         result = {
             "id": id,
-            "title": filename,
+            "title": filename or f"Document {id}",
             "text": file_content,
             "url": f"https://platform.openai.com/storage/files/{id}",
             "metadata": None
@@ -264,325 +1192,520 @@ def create_server(openai_client):
         if hasattr(file_info, 'attributes') and file_info.attributes:
             result["metadata"] = file_info.attributes
 
+        # Placeholder results for empty content are not worth keeping
+        if document_store is not None and content_parts:
+            try:
+                await document_store.aput(result)
+            except Exception as e:
+                logger.error(f"Error storing document {id}: {str(e)}")
+        if document_cache is not None and content_parts:
+            document_cache.set(id, result)
+
         logger.info(f"Fetched vector store file: {id}")
         return result
 
     return mcp
 
 
-def create_openai_client():
-    """Create and return an OpenAI client with the configured API key."""
+def create_upstream_transport() -> UpstreamTransport:
+    """Create the pooled upstream HTTP transport from the UPSTREAM_* settings."""
+    http2 = {"true": True, "1": True, "false": False, "0": False}.get(UPSTREAM_HTTP2)
+    return UpstreamTransport(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        http2=http2,
+        connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout=UPSTREAM_READ_TIMEOUT,
+        write_timeout=UPSTREAM_WRITE_TIMEOUT,
+        pool_timeout=UPSTREAM_POOL_TIMEOUT,
+    )
+
+
+def create_openai_client(http_client: Optional[httpx.AsyncClient] = None):
+    """
+    Create and return an OpenAI client with the configured API key.
+
+    Args:
+        http_client: Pooled HTTP client to send requests through; the SDK
+            creates its own when omitted
+    """
     if not OPENAI_API_KEY:
         logger.error(
             "OpenAI API key not found. Please set OPENAI_API_KEY environment variable."
         )
         raise ValueError("OpenAI API key is required")
-    
-    return AsyncOpenAI(
+
+    # The SDK passes its own timeout on every request, overriding the one
+    # set on http_client, so hand it the same connect/read/write/pool values
+    if http_client is not None:
+        timeout = http_client.timeout
+    else:
+        timeout = httpx.Timeout(
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            read=UPSTREAM_READ_TIMEOUT,
+            write=UPSTREAM_WRITE_TIMEOUT,
+            pool=UPSTREAM_POOL_TIMEOUT,
+        )
+    return _lazy("AsyncOpenAI")(
         api_key=OPENAI_API_KEY,
-        timeout=ClientTimeout(total=30.0)
+        http_client=http_client,
+        timeout=timeout
     )
 
-# Verify Vector Store ID is set
-if not VECTOR_STORE_ID:
-    logger.error(
-        "Vector Store ID not found. Please set VECTOR_STORE_ID environment variable."
-    )
-    raise ValueError("Vector Store ID is required")
+@contextlib.asynccontextmanager
+async def server_lifespan():
+    """
+    Build the FastMCP server for the lifetime of the ASGI app.
+
+    The upstream connection pool is opened on startup and closed, with
+    every kept-alive connection, on shutdown. Configuration errors, such
+    as a missing VECTOR_STORE_ID, fail startup rather than the import.
+    """
+    # Verify Vector Store ID is set
+    if not VECTOR_STORE_ID:
+        logger.error(
+            "Vector Store ID not found. Please set VECTOR_STORE_ID environment variable."
+        )
+        raise ValueError("Vector Store ID is required")
+    logger.info(f"Using vector store: {VECTOR_STORE_ID}")
+
+    upstream_transport = create_upstream_transport()
+    async with upstream_transport as http_client:
+        mcp = create_server(create_openai_client(http_client))
+        mcp.upstream_transport = upstream_transport
+        if WARMUP_FILE and WARMUP_ON_STARTUP:
+            await warm_up_server(mcp)
+        try:
+            yield mcp
+        finally:
+            if mcp.prefetcher is not None:
+                await mcp.prefetcher.close()
+
+
+async def warm_up_server(mcp, fetch_top: Optional[int] = None) -> None:
+    """
+    Fill the caches of a new server from the query log at WARMUP_FILE.
+
+    Startup waits at most WARMUP_TIMEOUT seconds; a failed or unfinished
+    warm-up is logged and the server starts anyway.
+
+    Args:
+        mcp: Server to warm
+        fetch_top: Documents fetched per query (default WARMUP_FETCH_TOP)
+    """
+    if fetch_top is None:
+        fetch_top = WARMUP_FETCH_TOP
+    try:
+        queries = load_queries(WARMUP_FILE, WARMUP_QUERIES, WARMUP_QUERY_FIELD)
+        report = await asyncio.wait_for(
+            warm_up(mcp.run_search, mcp.prefetch_document, queries,
+                    fetch_top, WARMUP_CONCURRENCY),
+            WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Warm-up did not finish within {WARMUP_TIMEOUT}s; starting anyway")
+    except Exception as e:
+        logger.error(f"Warm-up from {WARMUP_FILE} failed: {str(e)}")
+    else:
+        logger.info(
+            f"Warm-up: {report['searched']}/{report['queries']} queries and "
+            f"{report['documents']} documents in {report['elapsed']:.1f}s")
+
+
+async def warm_up_instance() -> bool:
+    """
+    Warm the tiers shared by every worker of the instance, in this process.
+
+    Run by runner.py before it starts its workers, so N workers do not each
+    replay the warm-up against the same cold shared tier. Searches are
+    kept by the shared cache at SHARED_STATE_PATH and documents by the
+    store at DOCUMENT_STORE_PATH; a phase with nowhere to keep its results
+    is skipped, since whatever this process caches in memory is lost when
+    it starts the workers.
+
+    Returns:
+        True if both phases were kept and the workers can skip their own
+        warm-up; False if each worker still has to warm itself (against
+        whichever shared tier this warm-up did fill)
+    """
+    if not WARMUP_FILE or not (SHARED_STATE_PATH or DOCUMENT_STORE_PATH):
+        return False
+    fetch_top = WARMUP_FETCH_TOP if DOCUMENT_STORE_PATH else 0
+    async with create_upstream_transport() as http_client:
+        mcp = create_server(create_openai_client(http_client))
+        try:
+            await warm_up_server(mcp, fetch_top)
+        finally:
+            if mcp.prefetcher is not None:
+                await mcp.prefetcher.close()
+    return bool(SHARED_STATE_PATH) and (bool(DOCUMENT_STORE_PATH) or WARMUP_FETCH_TOP == 0)
+
+
+class RPCError(Exception):
+    """JSON-RPC error with an explicit error code"""
+
+    def __init__(self, rpc_code, message):
+        super().__init__(message)
+        self.rpc_code = rpc_code
+
+
+class RequestBodyTooLarge(Exception):
+    """Raised when a request body exceeds MAX_BODY_SIZE"""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client disconnects while the body is being read"""
+
+
+# Initial events sent on every SSE connection, encoded once
+SSE_INIT_EVENT = (
+    b'event: init\n'
+    b'data: ' + serialization.dumps({
+        'jsonrpc': '2.0',
+        'id': 1,
+        'result': {
+            'capabilities': {'tools': {'allowedTools': ['search', 'fetch']}},
+            'serverInfo': {'name': 'GameBot MCP Server', 'version': '1.0.0'}
+        }
+    }) + b'\n\n'
+    b'event: ready\n'
+    b'data: {}\n\n'
+    b'event: keepalive\n'
+    b'data: {}\n\n'
+)
 
-logger.info(f"Using vector store: {VECTOR_STORE_ID}")
+# Route label of the request being handled, so helpers deep in the handlers
+# can attribute their stage timings without it being passed down
+_request_route = contextvars.ContextVar('request_route', default=None)
 
-# Create the FastMCP server
-mcp_server = create_server(create_openai_client())
+# Response for plain GET requests on the root and /sse paths
+SERVER_INFO_RESPONSE = {
+    'status': 'ok',
+    'server': 'GameBot MCP Server',
+    'version': '1.0.0',
+    'endpoints': {
+        'mcp_initialize': {'method': 'POST', 'path': '/'},
+        'search': {'method': 'POST', 'path': '/search'},
+        'search_batch': {'method': 'POST', 'path': '/search/batch'},
+        'fetch': {'method': 'POST', 'path': '/fetch'},
+        'fetch_stream': {'method': 'POST', 'path': '/fetch/stream'},
+        'tools': {'method': 'GET', 'path': '/tools'},
+        'health': {'method': 'GET', 'path': '/health'}
+    }
+}
 
 # Create an ASGI application wrapper for FastMCP
 class FastMCPASGIWrapper:
-    def __init__(self, mcp_server):
+    # Routes served directly by an MCP tool: (method, path) -> tool name
+    TOOL_ROUTES = {
+        ('GET', '/health'): 'health_check',
+        ('POST', '/search'): 'search',
+        ('POST', '/search/batch'): 'search_batch',
+        ('POST', '/fetch'): 'fetch',
+    }
+
+    # Routes charged one call against an admission budget before their body
+    # is read: (method, path) -> class. Batch searches and JSON-RPC messages
+    # are charged per query and per call once parsed, see _call_admission.
+    # Health, stats and SSE connects are never throttled
+    ADMISSION_CLASSES = {
+        ('POST', '/search'): 'search',
+        ('POST', '/fetch'): 'fetch',
+        ('POST', '/fetch/stream'): 'fetch',
+    }
+
+    # Budget charged for a call of each tool; other tools and JSON-RPC
+    # methods are charged to "rpc"
+    TOOL_ADMISSION_CLASSES = {
+        'search': 'search',
+        'search_batch': 'search',
+        'fetch': 'fetch',
+    }
+
+    def __init__(self, mcp_server=None, lifespan=None):
+        """
+        Args:
+            mcp_server: FastMCP server to serve
+            lifespan: Zero-argument callable returning an async context
+                manager that yields the FastMCP server; entered on ASGI
+                lifespan startup (or on the first request when the ASGI
+                server has no lifespan support) and exited on shutdown
+        """
         self.mcp_server = mcp_server
+        self.lifespan = lifespan
+        self._lifespan_context = None
+        self._startup_lock = asyncio.Lock()
+        # Tool registry, resolved on first use and refreshed only when a
+        # routed tool is missing from it
+        self._tools = None
+        # MCP tool definitions for tools/list, built from the registry
+        self._tool_schemas = None
+        # Route table compiled once: (method, path) -> handler
+        self.routes = self._compile_routes()
+        # Open SSE streams, kept alive by one shared timer
+        self.sse_connections = ConnectionRegistry(
+            interval=SSE_KEEPALIVE_INTERVAL, max_connections=SSE_MAX_CONNECTIONS)
+        # Global and per-client limits; None disables admission control
+        self.admission = create_admission_controller()
+        # Request metrics for /metrics, rendered together with the server's
+        self.metrics = MetricsRegistry()
+        self.route_labels = {route: f"{route[0]} {route[1]}" for route in self.routes}
+        self.requests_total = self.metrics.counter(
+            "gamebot_http_requests_total", "HTTP requests by route and status", ("route", "status"))
+        self.request_latency = self.metrics.histogram(
+            "gamebot_http_request_duration_seconds", "Time to handle an HTTP request", ("route",))
+        self.request_stages = self.metrics.histogram(
+            "gamebot_http_stage_duration_seconds",
+            "Time spent in each stage of an HTTP request", ("route", "stage"))
+        self.inflight = 0
+        self.metrics.register_collector(self._metric_families)
+        # Sampled request tracing and slow-request capture; None when disabled
+        self.profiler = create_profiler()
+
+    def _compile_routes(self):
+        """Build the dispatch table mapping (method, path) to a handler"""
+        routes = {
+            key: functools.partial(self._handle_tool, tool_name)
+            for key, tool_name in self.TOOL_ROUTES.items()
+        }
+        routes.update({
+            ('GET', '/tools'): self._handle_tools,
+            ('GET', '/cache/stats'): self._handle_cache_stats,
+            ('GET', '/stats/latency'): self._handle_latency_stats,
+            ('GET', '/stats/connections'): self._handle_connection_stats,
+            ('GET', '/stats/upstream'): self._handle_upstream_stats,
+            ('GET', '/stats/admission'): self._handle_admission_stats,
+            ('GET', '/metrics'): self._handle_metrics,
+            ('GET', '/debug/slow-requests'): self._handle_slow_requests,
+            ('POST', '/cache/invalidate'): self._handle_cache_invalidate,
+            ('POST', '/fetch/stream'): self._handle_fetch_stream,
+        })
+        # MCP protocol initialization on both /sse and root paths
+        for path in ('/', '/sse'):
+            routes[('GET', path)] = self._handle_connect
+            routes[('POST', path)] = self._handle_rpc
+        return routes
+
+    async def get_tools(self, refresh=False):
+        """Return the cached tool registry, loading it if needed"""
+        if self._tools is None or refresh:
+            try:
+                self._tools = await self.mcp_server._tool_manager.get_tools()
+            except Exception as e:
+                logger.error(f"Error getting tools: {str(e)}")
+                return {}
+            self._tool_schemas = None
+        return self._tools
+
+    def invalidate_tools(self):
+        """Drop the cached tool registry after tools are added or removed"""
+        self._tools = None
+        self._tool_schemas = None
         
+    async def startup(self):
+        """Enter the lifespan context and build the server if not built yet"""
+        async with self._startup_lock:
+            if self.mcp_server is not None or self.lifespan is None:
+                return
+            context = self.lifespan()
+            self.mcp_server = await context.__aenter__()
+            self._lifespan_context = context
+            self.invalidate_tools()
+
+    async def drain(self):
+        """
+        Start a graceful shutdown: end open SSE streams so their clients
+        reconnect elsewhere, and refuse new ones. Called by the runner on
+        SIGTERM, before the ASGI server waits for in-flight requests.
+        """
+        ended = await self.sse_connections.drain()
+        logger.info(f"Draining: ended {ended} SSE stream(s)")
+
+    async def shutdown(self):
+        """Close SSE streams and exit the lifespan context"""
+        await self.sse_connections.close()
+        context, self._lifespan_context = self._lifespan_context, None
+        if context is not None:
+            self.mcp_server = None
+            self.invalidate_tools()
+            await context.__aexit__(None, None, None)
+
     async def __call__(self, scope, receive, send):
         if scope['type'] == 'http':
+            if self.mcp_server is None:
+                await self.startup()
             await self.handle_http(scope, receive, send)
         elif scope['type'] == 'lifespan':
-            # Handle lifespan events for Starlette's TestClient
             while True:
                 message = await receive()
                 if message['type'] == 'lifespan.startup':
+                    try:
+                        await self.startup()
+                    except Exception as e:
+                        logger.error(f"Startup failed: {str(e)}")
+                        await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                        return
                     await send({'type': 'lifespan.startup.complete'})
                 elif message['type'] == 'lifespan.shutdown':
+                    await self.shutdown()
                     await send({'type': 'lifespan.shutdown.complete'})
                     return
         else:
             raise NotImplementedError(f"Unsupported scope type: {scope['type']}")
     
     async def handle_http(self, scope, receive, send):
+        """Dispatch a request, recording its status, latency and the in-flight count"""
+        route = (scope['method'], scope['path'])
+        label = self.route_labels.get(route, 'unmatched')
+        # Stays 499 if no response is sent, e.g. when the client disconnects
+        status = 499
+
+        async def send_recording_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        trace = None
+        if self.profiler is not None and 'text/event-stream' not in self._header(scope, b'accept'):
+            # SSE streams stay open indefinitely, so they are never profiled
+            trace = self.profiler.start(label, scope.get('headers', ()))
+        started = time.perf_counter()
+        self.inflight += 1
+        token = _request_route.set(label)
+        try:
+            await self._dispatch(route, label, scope, receive, send_recording_status)
+        finally:
+            _request_route.reset(token)
+            self.inflight -= 1
+            self.request_latency.labels(label).observe(time.perf_counter() - started)
+            self.requests_total.labels(label, str(status)).inc()
+            if trace is not None:
+                await self.profiler.finish(trace, status)
+
+    def _observe_stage(self, label, stage, started):
+        """Record a request stage on the stage histogram and the request's trace"""
+        elapsed = time.perf_counter() - started
+        self.request_stages.labels(label, stage).observe(elapsed)
+        record_span(stage, started, elapsed)
+
+    async def _dispatch(self, route, label, scope, receive, send):
+        # Route the request with a single dict lookup on method and path
+        handler = self.routes.get(route)
+        if handler is None:
+            await self._send_json_response(send, {"error": "Not Found"}, 404)
+            return
+
+        request_class = self.ADMISSION_CLASSES.get(route) if self.admission else None
+        if request_class is None:
+            await self._handle_routed(handler, label, scope, receive, send)
+            return
+
+        waited = time.perf_counter()
+        try:
+            budget = await self.admission.acquire(request_class, self._client_key(scope))
+        except AdmissionRejected as e:
+            await self._send_admission_rejected(send, e)
+            return
+        self._observe_stage(label, 'admission', waited)
+        try:
+            await self._handle_routed(handler, label, scope, receive, send)
+        finally:
+            self.admission.release(budget)
+
+    async def _send_admission_rejected(self, send, e):
+        """Answer a request turned away by admission control with a 429"""
+        await self._send_json_response(send, {
+            "status": "error",
+            "error": e.reason,
+            "retry_after": e.retry_after,
+            "timestamp": datetime.utcnow().isoformat()
+        }, 429, headers=[[b'retry-after', str(e.retry_after).encode()]])
+
+    def _call_admission(self, tool_name, arguments):
+        """Return the budget and token cost of one tool call: a batch costs one token per query"""
+        request_class = self.TOOL_ADMISSION_CLASSES.get(tool_name, 'rpc')
+        queries = arguments.get('queries') if isinstance(arguments, dict) else None
+        if tool_name == 'search_batch' and isinstance(queries, list):
+            # Larger batches are refused by the tool, so they cost no more
+            return request_class, min(max(1, len(queries)), SEARCH_BATCH_MAX_QUERIES)
+        return request_class, 1
+
+    @contextlib.asynccontextmanager
+    async def _admitted(self, client, request_class, cost=1):
+        """
+        Hold an admission slot for one call; a no-op when admission control
+        is off or ``request_class`` is None.
+
+        Raises:
+            AdmissionRejected: If the call cannot be admitted in time
+        """
+        if self.admission is None or request_class is None:
+            yield
+            return
+        budget = await self.admission.acquire(request_class, client, cost)
+        try:
+            yield
+        finally:
+            self.admission.release(budget)
+
+    @staticmethod
+    def _client_key(scope):
+        """Identify the caller by API key if it sends a known one, otherwise by IP"""
+        if ADMISSION_KEY_DIGESTS:
+            for name, value in scope.get('headers', ()):
+                if name == b'authorization' or name == b'x-api-key':
+                    scheme, _, token = value.partition(b' ')
+                    if token and scheme.lower() == b'bearer':
+                        value = token.strip()
+                    digest = _key_digest(value)
+                    if digest in ADMISSION_KEY_DIGESTS:
+                        return 'key:' + digest
+        forwarded = forwarded_client_ip(scope) if FORWARDED_TRUSTED_HOPS else None
+        if forwarded:
+            return 'ip:' + forwarded
+        client = scope.get('client')
+        return 'ip:' + (client[0] if client else 'unknown')
+
+    async def _handle_routed(self, handler, label, scope, receive, send):
+        """Read and parse the request body, then run the route's handler"""
+        started = time.perf_counter()
         # Get the request body
         body = b''
         if scope['method'] in ['POST', 'PUT', 'PATCH']:
-            more_body = True
-            while more_body:
-                message = await receive()
-                body += message.get('body', b'')
-                more_body = message.get('more_body', False)
+            try:
+                # asyncio.timeout avoids the extra task wait_for would create per request
+                async with asyncio.timeout(BODY_READ_TIMEOUT):
+                    body = await self._read_body(scope, receive)
+            except RequestBodyTooLarge:
+                await self._send_json_response(send, {
+                    "status": "error",
+                    "error": f"Request body exceeds {MAX_BODY_SIZE} bytes",
+                    "timestamp": datetime.utcnow().isoformat()
+                }, 413)
+                return
+            except TimeoutError:
+                await self._send_json_response(send, {
+                    "status": "error",
+                    "error": "Timed out reading request body",
+                    "timestamp": datetime.utcnow().isoformat()
+                }, 408)
+                return
+            except ClientDisconnected:
+                return
         
-        # Parse JSON body if present
+        # Parse JSON body if present, straight from the bytes without decoding first
         request_data = {}
         if body:
             try:
-                request_data = json.loads(body.decode('utf-8'))
-            except json.JSONDecodeError:
+                request_data = serialization.loads(body)
+            except ValueError:
                 request_data = {}
-        
-        # Route the request based on path and method
-        path = scope['path']
-        method = scope['method']
-        
-        # Default response
-        response = {"error": "Not Found"}
-        status_code = 404
-        
-        # Get the tool manager and tools
-        tool_manager = self.mcp_server._tool_manager
-        tools = {}
+        self._observe_stage(label, 'parse', started)
+        handling = time.perf_counter()
+
         try:
-            tools = await tool_manager.get_tools()
-        except Exception as e:
-            logger.error(f"Error getting tools: {str(e)}")
-        
-        try:
-            # Route to the appropriate tool based on path and method
-            if path == '/health' and method == 'GET':
-                tool_name = 'health_check'
-                tool_args = {}
-            elif path == '/tools' and method == 'GET':
-                # For now, return 501 Not Implemented with MCP-compliant response
-                # We'll implement the full tool listing in a future update
-                response = {
-                    'jsonrpc': '2.0',
-                    'id': request_data.get('id', 1),
-                    'error': {
-                        'code': -32601,  # Method not found
-                        'message': 'The tools endpoint is not yet implemented',
-                        'data': {
-                            'status': 501,
-                            'message': 'Not Implemented',
-                            'details': 'The tools endpoint is planned for a future release.'
-                        }
-                    }
-                }
-                status_code = 501  # Not Implemented
-                await self._send_json_response(send, response, status_code)
-                return
-            elif path == '/search' and method == 'POST':
-                tool_name = 'search'
-                tool_args = request_data
-            elif path == '/fetch' and method == 'POST':
-                tool_name = 'fetch'
-                tool_args = request_data
-            elif path in ['/sse', '/'] and method in ['GET', 'POST']:
-                # Handle MCP protocol initialization for both /sse and root paths
-                # For GET requests, handle SSE connection
-                if method == 'GET':
-                    # Check if this is an SSE request
-                    accept_header = next((v for k, v in scope.get('headers', []) if k == b'accept'), b'').decode().lower()
-                    if 'text/event-stream' in accept_header:
-                        # Send SSE headers
-                        await send({
-                            'type': 'http.response.start',
-                            'status': 200,
-                            'headers': [
-                                [b'content-type', b'text/event-stream; charset=utf-8'],
-                                [b'cache-control', b'no-cache, no-transform'],
-                                [b'connection', b'keep-alive'],
-                                [b'access-control-allow-origin', b'*'],
-                                [b'access-control-allow-methods', b'GET, POST, OPTIONS'],
-                                [b'access-control-allow-headers', b'Content-Type, Authorization'],
-                                [b'x-accel-buffering', b'no'],  # Disable buffering for nginx
-                                [b'transfer-encoding', b'chunked'],
-                            ],
-                        })
-                        
-                        # Send initial SSE event with server info
-                        init_event = (
-                            'event: init\n'
-                            'data: {'
-                            '"jsonrpc":"2.0",'
-                            '"id":1,'
-                            '"result":{'
-                            '"capabilities":{"tools":{"allowedTools":["search","fetch"]}},'
-                            '"serverInfo":{"name":"GameBot MCP Server","version":"1.0.0"}'
-                            '}}\n\n'
-                            'event: ready\n'
-                            'data: {}\n\n'
-                            'event: keepalive\n'
-                            'data: {}\n\n'
-                        )
-                        
-                        await send({
-                            'type': 'http.response.body',
-                            'body': init_event.encode('utf-8'),
-                            'more_body': True
-                        })
-                        
-                        # Keep the connection open
-                        while True:
-                            await asyncio.sleep(15)  # Send keepalive every 15 seconds
-                            try:
-                                await send({
-                                    'type': 'http.response.body',
-                                    'body': b'event: keepalive\ndata: {}\n\n',
-                                    'more_body': True
-                                })
-                            except Exception as e:
-                                logger.info(f"Client disconnected: {e}")
-                                break
-                        return
-                    else:
-                        # Regular JSON response for non-SSE requests
-                        response = {
-                            'status': 'ok',
-                            'server': 'GameBot MCP Server',
-                            'version': '1.0.0',
-                            'endpoints': {
-                                'mcp_initialize': {'method': 'POST', 'path': '/'},
-                                'search': {'method': 'POST', 'path': '/search'},
-                                'fetch': {'method': 'POST', 'path': '/fetch'},
-                                'health': {'method': 'GET', 'path': '/health'}
-                            }
-                        }
-                        await self._send_json_response(send, response, 200)
-                        return
-                # For POST requests, handle MCP initialization
-                elif request_data.get('method') == 'initialize':
-                    response = {
-                        'jsonrpc': '2.0',
-                        'id': request_data.get('id', 1),
-                        'result': {
-                            'capabilities': {
-                                'tools': {
-                                    'allowedTools': ['search', 'fetch']
-                                }
-                            },
-                            'serverInfo': {
-                                'name': 'GameBot MCP Server',
-                                'version': '1.0.0'
-                            }
-                        }
-                    }
-                    await self._send_json_response(send, response, 200)
-                    return
-                else:
-                    response = {
-                        'jsonrpc': '2.0',
-                        'id': request_data.get('id', 1),
-                        'error': {
-                            'code': -32601,
-                            'message': 'Method not found'
-                        }
-                    }
-                    await self._send_json_response(send, response, 200)
-                    return
-                
-                tool_name = None
-            else:
-                tool_name = None
-            
-            # If we found a matching tool, call it
-            if tool_name and tool_name in tools:
-                try:
-                    # Call the tool function with the provided arguments
-                    tool_result = await tool_manager.call_tool(tool_name, tool_args)
-                    
-                    # Handle the tool result
-                    if tool_result is not None:
-                        # If the tool returns a TextContent object, use its content
-                        if hasattr(tool_result, 'content'):
-                            response = tool_result.content
-                            # If content is a list, take the first item if it exists
-                            if isinstance(response, list) and len(response) > 0:
-                                response = response[0]
-                            # If content has a text attribute, use that
-                            if hasattr(response, 'text'):
-                                response = response.text
-                        else:
-                            # Otherwise, use the result directly
-                            response = tool_result
-                    
-                    # Ensure we have a valid response
-                    if response is None:
-                        response = {"status": "error", "message": "No response from tool"}
-                        status_code = 500
-                    # If response is a string, wrap it in a dict
-                    elif isinstance(response, str):
-                        try:
-                            # Try to parse as JSON first
-                            response = json.loads(response)
-                        except json.JSONDecodeError:
-                            # If not JSON, wrap in a message field
-                            response = {"status": "ok", "message": response}
-                    # If response is a list, wrap it in a result field
-                    elif isinstance(response, list):
-                        response = {"status": "ok", "result": response}
-                    # If response is already a dict, ensure it has a status field
-                    elif isinstance(response, dict):
-                        if "status" not in response:
-                            response["status"] = "ok"
-                    # For any other type, convert to string
-                    else:
-                        response = {"status": "ok", "result": str(response)}
-                    
-                    # Add a timestamp if not already present
-                    if isinstance(response, dict) and "timestamp" not in response:
-                        response["timestamp"] = datetime.utcnow().isoformat()
-                    
-                    status_code = 200
-                    
-                except Exception as e:
-                    logger.error(f"Error in {tool_name} tool: {str(e)}", exc_info=True)
-                    
-                    # Default error response
-                    response = {
-                        "status": "error",
-                        "error": f"Error executing {tool_name}: {str(e)}",
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                    status_code = 500
-                    
-                    # Unwrap the exception to get to the root cause
-                    while hasattr(e, '__cause__') and e.__cause__ is not None:
-                        e = e.__cause__
-                    
-                    # Handle Pydantic ValidationError (422)
-                    if isinstance(e, PydanticValidationError):
-                        status_code = 422  # Unprocessable Entity
-                        response['error'] = "Validation error"
-                        response['details'] = json.loads(e.json())
-                    # Handle FastAPI's HTTPException
-                    elif hasattr(e, 'status_code') and hasattr(e, 'detail'):
-                        status_code = e.status_code
-                        if isinstance(e.detail, (str, dict, list)):
-                            response['error'] = e.detail
-                        else:
-                            response['error'] = str(e.detail)
-                    # Handle FastMCP's ToolError
-                    elif hasattr(e, 'message') and hasattr(e, 'code'):
-                        # Map common error codes to HTTP status codes
-                        error_code = getattr(e, 'code', 500)
-                        if error_code == 400:  # Bad Request
-                            status_code = 400
-                        elif error_code == 401:  # Unauthorized
-                            status_code = 401
-                        elif error_code == 403:  # Forbidden
-                            status_code = 403
-                        elif error_code == 404:  # Not Found
-                            status_code = 404
-                        response['error'] = str(e)
-                    # Handle FastAPI's RequestValidationError (422)
-                    elif hasattr(e, 'errors') and hasattr(e, 'body'):
-                        status_code = 422  # Unprocessable Entity
-                        response['error'] = "Validation error"
-                        response['details'] = e.errors()
-            
+            await handler(scope, receive, send, request_data)
         except Exception as e:
             logger.error(f"Error handling request: {str(e)}", exc_info=True)
             response = {
@@ -590,15 +1713,598 @@ class FastMCPASGIWrapper:
                 "error": f"Internal server error: {str(e)}",
                 "timestamp": datetime.utcnow().isoformat()
             }
-            status_code = 500
-        
-        # Send the response
+            await self._send_json_response(send, response, 500)
+        self._observe_stage(label, 'handler', handling)
+
+    @staticmethod
+    async def _read_body(scope, receive):
+        """
+        Read the request body into a single buffer, enforcing MAX_BODY_SIZE.
+
+        Chunks are appended to a bytearray, so accumulation is linear in the
+        body size. A Content-Length above the limit is rejected before any
+        of the body is read.
+        """
+        declared = next((v for k, v in scope.get('headers', []) if k == b'content-length'), None)
+        if declared is not None and declared.isdigit() and int(declared) > MAX_BODY_SIZE:
+            raise RequestBodyTooLarge()
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            if len(body) + len(chunk) > MAX_BODY_SIZE:
+                raise RequestBodyTooLarge()
+            body += chunk
+            more_body = message.get('more_body', False)
+        return body
+
+    async def _handle_tool(self, tool_name, scope, receive, send, request_data):
+        """Call an MCP tool with the request body as its arguments"""
+        tools = await self.get_tools()
+        if tool_name not in tools:
+            # The registry may be stale if tools were added since it was loaded
+            tools = await self.get_tools(refresh=True)
+            if tool_name not in tools:
+                await self._send_json_response(send, {"error": "Not Found"}, 404)
+                return
+
+        tool_args = request_data if isinstance(request_data, dict) else {}
+        # Batches are charged per query here; the other tool routes were
+        # charged one call in _dispatch
+        client, request_class, cost = None, None, 1
+        if tool_name == 'search_batch' and self.admission is not None:
+            client = self._client_key(scope)
+            request_class, cost = self._call_admission(tool_name, tool_args)
+        try:
+            async with self._admitted(client, request_class, cost):
+                # Call the tool function with the provided arguments
+                tool_result = await self.mcp_server._tool_manager.call_tool(tool_name, tool_args)
+            response, status_code = self._tool_response(tool_result)
+        except AdmissionRejected as e:
+            await self._send_admission_rejected(send, e)
+            return
+        except Exception as e:
+            response, status_code = self._tool_error_response(tool_name, e)
+
         await self._send_json_response(send, response, status_code)
-        
-    async def _send_json_response(self, send, data, status_code=200):
-        """Helper method to send JSON responses"""
+
+    @staticmethod
+    def _tool_response(tool_result):
+        """Convert a tool result into a JSON-serializable response dict and status code"""
+        response = None
+        if tool_result is not None:
+            # Tools return a ToolResult whose first content block holds the JSON text
+            content = getattr(tool_result, 'content', tool_result)
+            if isinstance(content, list):
+                content = content[0] if content else content
+            response = getattr(content, 'text', content)
+
+        # Ensure we have a valid response
+        if response is None:
+            return {"status": "error", "message": "No response from tool"}, 500
+        # If response is a string, wrap it in a dict
+        if isinstance(response, str):
+            try:
+                # Try to parse as JSON first
+                response = serialization.loads(response)
+            except ValueError:
+                # If not JSON, wrap in a message field
+                response = {"status": "ok", "message": response}
+        # If response is a list, wrap it in a result field
+        if isinstance(response, list):
+            response = {"status": "ok", "result": response}
+        # If response is already a dict, ensure it has a status field
+        elif isinstance(response, dict):
+            if "status" not in response:
+                response["status"] = "ok"
+        # For any other type, convert to string
+        else:
+            response = {"status": "ok", "result": str(response)}
+
+        # Add a timestamp if not already present
+        if "timestamp" not in response:
+            response["timestamp"] = datetime.utcnow().isoformat()
+        return response, 200
+
+    def _tool_error_response(self, tool_name, e):
+        """Map an exception raised by a tool to a response dict and status code"""
+        logger.error(f"Error in {tool_name} tool: {str(e)}", exc_info=True)
+
+        # Default error response
+        response = {
+            "status": "error",
+            "error": f"Error executing {tool_name}: {str(e)}",
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        status_code = 500
+
+        # Unwrap the exception to get to the root cause
+        while hasattr(e, '__cause__') and e.__cause__ is not None:
+            e = e.__cause__
+
+        # Already imported by fastmcp once a tool has run
+        from pydantic import ValidationError as PydanticValidationError
+
+        # Handle Pydantic ValidationError (422)
+        if isinstance(e, PydanticValidationError):
+            status_code = 422  # Unprocessable Entity
+            response['error'] = "Validation error"
+            response['details'] = serialization.loads(e.json())
+        # Handle Starlette's (and FastAPI's) HTTPException
+        elif hasattr(e, 'status_code') and hasattr(e, 'detail'):
+            status_code = e.status_code
+            if isinstance(e.detail, (str, dict, list)):
+                response['error'] = e.detail
+            else:
+                response['error'] = str(e.detail)
+        # Handle FastMCP's ToolError
+        elif hasattr(e, 'message') and hasattr(e, 'code'):
+            # Map common error codes to HTTP status codes
+            error_code = getattr(e, 'code', 500)
+            if error_code in (400, 401, 403, 404):
+                status_code = error_code
+            response['error'] = str(e)
+        # Handle FastAPI's RequestValidationError (422)
+        elif hasattr(e, 'errors') and hasattr(e, 'body'):
+            status_code = 422  # Unprocessable Entity
+            response['error'] = "Validation error"
+            response['details'] = e.errors()
+        return response, status_code
+
+    async def _handle_tools(self, scope, receive, send, request_data):
+        """List tools in the same shape as a JSON-RPC tools/list response"""
+        response = {
+            'jsonrpc': '2.0',
+            'id': request_data.get('id', 1),
+            'result': {'tools': await self.get_tool_schemas()}
+        }
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_cache_stats(self, scope, receive, send, request_data):
+        search_cache = getattr(self.mcp_server, 'search_cache', None)
+        semantic_cache = getattr(self.mcp_server, 'semantic_cache', None)
+        shared_cache = getattr(self.mcp_server, 'shared_cache', None)
+        document_store = getattr(self.mcp_server, 'document_store', None)
+        document_cache = getattr(self.mcp_server, 'document_cache', None)
+        prefetcher = getattr(self.mcp_server, 'prefetcher', None)
+        response = {
+            'status': 'ok',
+            'search': search_cache.stats() if search_cache else None,
+            'semantic': semantic_cache.stats() if semantic_cache is not None else None,
+            'shared': shared_cache.stats() if shared_cache is not None else None,
+            'documents': document_store.stats() if document_store else None,
+            'document_cache': document_cache.stats() if document_cache is not None else None,
+            'prefetch': prefetcher.stats() if prefetcher is not None else None,
+            'singleflight': {
+                name: flight.stats()
+                for name, flight in (
+                    ('search', getattr(self.mcp_server, 'search_flight', None)),
+                    ('fetch', getattr(self.mcp_server, 'fetch_flight', None)),
+                )
+                if flight is not None
+            }
+        }
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_latency_stats(self, scope, receive, send, request_data):
+        fetch_latency = getattr(self.mcp_server, 'fetch_latency', None)
+        response = {
+            'status': 'ok',
+            'fetch': fetch_latency.snapshot() if fetch_latency else None
+        }
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_connection_stats(self, scope, receive, send, request_data):
+        response = {'status': 'ok', 'sse': self.sse_connections.stats()}
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_upstream_stats(self, scope, receive, send, request_data):
+        upstream_transport = getattr(self.mcp_server, 'upstream_transport', None)
+        policies = getattr(self.mcp_server, 'upstream_policies', None) or {}
+        response = {
+            'status': 'ok',
+            'upstream': upstream_transport.stats() if upstream_transport else None,
+            'policies': {name: policy.stats() for name, policy in policies.items()}
+        }
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_admission_stats(self, scope, receive, send, request_data):
+        response = {
+            'status': 'ok',
+            'admission': self.admission.stats() if self.admission else None
+        }
+        await self._send_json_response(send, response, 200)
+
+    async def _handle_metrics(self, scope, receive, send, request_data):
+        """Render request, cache and upstream metrics in the Prometheus text format"""
+        families = self.metrics.collect()
+        server_metrics = getattr(self.mcp_server, 'metrics', None)
+        if server_metrics is not None:
+            families.extend(server_metrics.collect())
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [[b'content-type', b'text/plain; version=0.0.4; charset=utf-8']],
+        })
+        await send({'type': 'http.response.body', 'body': render_families(families).encode('utf-8')})
+
+    async def _handle_slow_requests(self, scope, receive, send, request_data):
+        """List recent slow profiled requests, newest first, with their spans and hotspots"""
+        if self.profiler is None:
+            await self._send_json_response(send, {
+                'status': 'error', 'error': 'Profiling is disabled (PROFILING_ENABLED)'}, 404)
+            return
+        if self.profiler.token and not self.profiler.authorized(scope.get('headers', ())):
+            await self._send_json_response(send, {'status': 'error', 'error': 'Forbidden'}, 403)
+            return
+        await self._send_json_response(send, {
+            'status': 'ok',
+            'profiling': self.profiler.stats(),
+            'requests': list(self.profiler.recent),
+        }, 200)
+
+    def _metric_families(self):
+        """Collect in-flight, SSE and admission statistics at scrape time"""
+        sse = self.sse_connections.stats()
+        families = [
+            MetricFamily("gamebot_http_requests_inflight", "gauge", "HTTP requests being handled",
+                         [("gamebot_http_requests_inflight", {}, self.inflight)]),
+            MetricFamily("gamebot_sse_connections", "gauge", "Open SSE connections",
+                         [("gamebot_sse_connections", {}, sse['connections'])]),
+            MetricFamily("gamebot_sse_connections_opened_total", "counter", "SSE connections accepted",
+                         [("gamebot_sse_connections_opened_total", {}, sse['opened'])]),
+            MetricFamily("gamebot_sse_connections_rejected_total", "counter",
+                         "SSE connections refused at SSE_MAX_CONNECTIONS",
+                         [("gamebot_sse_connections_rejected_total", {}, sse['rejected'])]),
+            MetricFamily("gamebot_sse_keepalives_sent_total", "counter", "SSE keepalive frames sent",
+                         [("gamebot_sse_keepalives_sent_total", {}, sse['keepalives_sent'])]),
+            MetricFamily("gamebot_sse_send_timeouts_total", "counter",
+                         "SSE clients dropped for not reading a keepalive in time",
+                         [("gamebot_sse_send_timeouts_total", {}, sse['send_timeouts'])]),
+        ]
+        if self.admission is None:
+            return families
+
+        stats = self.admission.stats()
+        # The global cap is reported as budget="global" next to the per-class budgets
+        budgets = {'global': stats['global'], **stats['classes']}
+        inflight = [("gamebot_admission_inflight", {"budget": name}, budget['inflight'])
+                    for name, budget in budgets.items()]
+        queued = [("gamebot_admission_queued", {"budget": name}, budget['queued'])
+                  for name, budget in budgets.items()]
+        admitted = [("gamebot_admission_admitted_total", {"class": name}, budget['admitted'])
+                    for name, budget in stats['classes'].items()]
+        rejected = [("gamebot_admission_rejected_total", {"class": name, "reason": reason}, count)
+                    for name, budget in stats['classes'].items()
+                    for reason, count in budget['rejected'].items()]
+        families += [
+            MetricFamily("gamebot_admission_inflight", "gauge", "Admitted requests in flight per budget", inflight),
+            MetricFamily("gamebot_admission_queued", "gauge", "Requests waiting for admission per budget", queued),
+            MetricFamily("gamebot_admission_admitted_total", "counter", "Requests admitted per class", admitted),
+            MetricFamily("gamebot_admission_rejected_total", "counter",
+                         "Requests rejected with 429 per class and reason", rejected),
+        ]
+        return families
+
+    async def _handle_cache_invalidate(self, scope, receive, send, request_data):
+        # Drop a single query's cached results, or everything if no query is given
+        search_cache = getattr(self.mcp_server, 'search_cache', None)
+        semantic_cache = getattr(self.mcp_server, 'semantic_cache', None)
+        shared_cache = getattr(self.mcp_server, 'shared_cache', None)
+        query = request_data.get('query')
+        key = search_cache_key(query) if query else None
+        removed = 0
+        if search_cache is not None:
+            removed = search_cache.invalidate(key)
+        if semantic_cache is not None:
+            semantic_cache.invalidate(key)
+        if shared_cache is not None:
+            # Other workers still hold their own copies until these expire
+            removed = max(removed, await asyncio.to_thread(shared_cache.invalidate, key))
+        await self._send_json_response(send, {'status': 'ok', 'invalidated': removed}, 200)
+
+    async def _handle_connect(self, scope, receive, send, request_data):
+        """Open an SSE stream, or describe the server for plain GET requests"""
+        # Check if this is an SSE request
+        if 'text/event-stream' not in self._header(scope, b'accept'):
+            # Regular JSON response for non-SSE requests
+            await self._send_json_response(send, SERVER_INFO_RESPONSE, 200)
+            return
+
+        try:
+            connection = self.sse_connections.register(send)
+        except TooManyConnections:
+            await self._send_json_response(send, {
+                "status": "error",
+                "error": "Too many open SSE connections",
+                "timestamp": datetime.utcnow().isoformat()
+            }, 503)
+            return
+
+        # Send SSE headers
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                [b'content-type', b'text/event-stream; charset=utf-8'],
+                [b'cache-control', b'no-cache, no-transform'],
+                [b'connection', b'keep-alive'],
+                [b'access-control-allow-origin', b'*'],
+                [b'access-control-allow-methods', b'GET, POST, OPTIONS'],
+                [b'access-control-allow-headers', b'Content-Type, Authorization'],
+                [b'x-accel-buffering', b'no'],  # Disable buffering for nginx
+                [b'transfer-encoding', b'chunked'],
+            ],
+        })
+
+        # Send initial SSE event with server info
+        await send({
+            'type': 'http.response.body',
+            'body': SSE_INIT_EVENT,
+            'more_body': True
+        })
+
+        # Keep the connection open; keepalives are sent by the shared
+        # registry timer, so this handler only waits for the disconnect
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        finally:
+            self.sse_connections.unregister(connection)
+        logger.info("SSE client disconnected")
+
+    async def _handle_rpc(self, scope, receive, send, request_data):
+        """Handle MCP JSON-RPC requests, including batch arrays"""
+        client = self._client_key(scope) if self.admission is not None else None
+        if isinstance(request_data, list):
+            if not request_data or len(request_data) > RPC_BATCH_MAX_SIZE:
+                response = self._rpc_error(
+                    None, -32600, f"Batch must contain 1 to {RPC_BATCH_MAX_SIZE} requests")
+                await self._send_json_response(send, response, 200)
+                return
+            # Batched calls run concurrently, each admitted on its own;
+            # notifications produce no entry
+            responses = await asyncio.gather(
+                *(self._dispatch_rpc(message, client) for message in request_data))
+            response = [r for r in responses if r is not None]
+        else:
+            response = await self._dispatch_rpc(request_data, client)
+            error = response.get('error') if response else None
+            if error and error['code'] == RPC_RATE_LIMITED:
+                retry_after = str(error['data']['retry_after']).encode()
+                await self._send_json_response(send, response, 429,
+                                               headers=[[b'retry-after', retry_after]])
+                return
+
+        if not response:
+            # Only notifications were received
+            await send({'type': 'http.response.start', 'status': 202, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self._send_json_response(send, response, 200)
+
+    async def _dispatch_rpc(self, message, client=None):
+        """
+        Dispatch a single JSON-RPC message, admitted as one call of
+        ``client`` against the budget of the tool or method it runs.
+
+        Returns:
+            The JSON-RPC response dict, or None for notifications
+        """
+        if not isinstance(message, dict) or not isinstance(message.get('method'), str):
+            request_id = message.get('id') if isinstance(message, dict) else None
+            return self._rpc_error(request_id, -32600, 'Invalid Request')
+
+        # Messages without an id are notifications; legacy clients that omit
+        # the jsonrpc field entirely are answered with id 1 as before
+        is_notification = 'id' not in message and 'jsonrpc' in message
+        request_id = message.get('id', 1)
+        method = message['method']
+        params = message.get('params') or {}
+
+        handler = self.RPC_METHODS.get(method)
+        if handler is None:
+            if is_notification or method.startswith('notifications/'):
+                return None
+            return self._rpc_error(request_id, -32601, 'Method not found')
+
+        if method == 'tools/call' and isinstance(params, dict):
+            request_class, cost = self._call_admission(params.get('name'), params.get('arguments'))
+        else:
+            request_class, cost = 'rpc', 1
+        try:
+            async with self._admitted(client, request_class, cost):
+                result = await handler(self, params)
+        except AdmissionRejected as e:
+            if is_notification:
+                return None
+            return self._rpc_error(request_id, RPC_RATE_LIMITED, e.reason,
+                                   {'retry_after': e.retry_after})
+        except Exception as e:
+            logger.error(f"Error handling {method}: {str(e)}", exc_info=True)
+            code = getattr(e, 'rpc_code', -32603)
+            return None if is_notification else self._rpc_error(request_id, code, str(e))
+        if is_notification:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    @staticmethod
+    def _rpc_error(request_id, code, message, data=None):
+        error = {
+            'code': code,
+            'message': message
+        }
+        if data is not None:
+            error['data'] = data
+        return {
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'error': error
+        }
+
+    async def _rpc_initialize(self, params):
+        return {
+            'protocolVersion': params.get('protocolVersion', MCP_PROTOCOL_VERSION),
+            'capabilities': {
+                'tools': {
+                    'listChanged': False,
+                    'allowedTools': ['search', 'fetch']
+                }
+            },
+            'serverInfo': {
+                'name': 'GameBot MCP Server',
+                'version': '1.0.0'
+            }
+        }
+
+    async def _rpc_ping(self, params):
+        return {}
+
+    async def _rpc_tools_list(self, params):
+        return {'tools': await self.get_tool_schemas()}
+
+    async def _rpc_tools_call(self, params):
+        tool_name = params.get('name')
+        arguments = params.get('arguments') or {}
+        tools = await self.get_tools()
+        if tool_name not in tools:
+            tools = await self.get_tools(refresh=True)
+        if tool_name not in tools:
+            raise RPCError(-32602, f"Unknown tool: {tool_name}")
+
+        try:
+            tool_result = await self.mcp_server._tool_manager.call_tool(tool_name, arguments)
+        except Exception as e:
+            # Tool failures are reported in the result so the model can see them
+            response, _ = self._tool_error_response(tool_name, e)
+            error = response['error']
+            return {
+                'content': [{'type': 'text', 'text': error if isinstance(error, str) else str(error)}],
+                'isError': True
+            }
+
+        result = {
+            'content': [
+                block.model_dump(mode='json', by_alias=True, exclude_none=True)
+                for block in tool_result.content
+            ],
+            'isError': False
+        }
+        if tool_result.structured_content is not None:
+            result['structuredContent'] = tool_result.structured_content
+        return result
+
+    RPC_METHODS = {
+        'initialize': _rpc_initialize,
+        'ping': _rpc_ping,
+        'tools/list': _rpc_tools_list,
+        'tools/call': _rpc_tools_call,
+    }
+
+    async def get_tool_schemas(self):
+        """Return MCP tool definitions, built once per tool registry"""
+        if self._tool_schemas is None:
+            tools = await self.get_tools()
+            self._tool_schemas = [
+                tool.to_mcp_tool().model_dump(mode='json', by_alias=True, exclude_none=True)
+                for tool in tools.values()
+            ]
+        return self._tool_schemas
+
+    async def _handle_fetch_stream(self, scope, receive, send, request_data):
+        """Stream a document as NDJSON, or SSE when the client accepts it"""
+        fetch_stream = getattr(self.mcp_server, 'fetch_stream', None)
+        if fetch_stream is None:
+            await self._send_json_response(send, {"error": "Not Found"}, 404)
+            return
+
+        doc_id = request_data.get('id')
+        offset = request_data.get('offset', 0)
+        length = request_data.get('length')
+        if not isinstance(doc_id, str) or not doc_id.startswith("file_"):
+            await self._send_json_response(send, {
+                "status": "error",
+                "error": "Invalid document ID format",
+                "timestamp": datetime.utcnow().isoformat()
+            }, 400)
+            return
+        if not isinstance(offset, int) or not (length is None or isinstance(length, int)):
+            await self._send_json_response(send, {
+                "status": "error",
+                "error": "offset and length must be integers",
+                "timestamp": datetime.utcnow().isoformat()
+            }, 422)
+            return
+
+        # Pull the first event before committing to a 200 so upstream
+        # failures can still be reported with a proper status code
+        events = fetch_stream(doc_id, offset, length)
+        try:
+            first_event = await anext(events)
+        except Exception as e:
+            logger.error(f"Error streaming document {doc_id}: {str(e)}")
+            status_code = getattr(e, 'status_code', 500)
+            await self._send_json_response(send, {
+                "status": "error",
+                "error": getattr(e, 'detail', None) or str(e),
+                "timestamp": datetime.utcnow().isoformat()
+            }, status_code if isinstance(status_code, int) else 500)
+            return
+
+        use_sse = 'text/event-stream' in self._header(scope, b'accept')
+        content_type = b'text/event-stream; charset=utf-8' if use_sse else b'application/x-ndjson'
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                [b'content-type', content_type],
+                [b'cache-control', b'no-cache, no-transform'],
+                [b'access-control-allow-origin', b'*'],
+                [b'access-control-allow-methods', b'GET, POST, OPTIONS'],
+                [b'access-control-allow-headers', b'Content-Type, Authorization'],
+                [b'x-accel-buffering', b'no'],
+            ],
+        })
+
+        def encode(event):
+            data = serialization.dumps(event)
+            if use_sse:
+                return b'event: ' + event['type'].encode('ascii') + b'\ndata: ' + data + b'\n\n'
+            return data + b'\n'
+
+        try:
+            await send({'type': 'http.response.body', 'body': encode(first_event), 'more_body': True})
+            async for event in events:
+                await send({'type': 'http.response.body', 'body': encode(event), 'more_body': True})
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Error streaming document {doc_id}: {str(e)}")
+            await send({
+                'type': 'http.response.body',
+                'body': encode({"type": "error", "error": str(e)}),
+                'more_body': True
+            })
+        finally:
+            await events.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    def _header(scope, name: bytes) -> str:
+        """Return a request header value as a lower-cased string"""
+        return next((v for k, v in scope.get('headers', []) if k == name), b'').decode().lower()
+
+    async def _send_json_response(self, send, data, status_code=200, headers=None):
+        """Helper method to send JSON responses, with optional extra headers"""
         if not isinstance(data, (str, bytes)):
-            data = json.dumps(data)
+            started = time.perf_counter()
+            data = serialization.dumps(data)
+            route = _request_route.get()
+            if route is not None:
+                self._observe_stage(route, 'encode', started)
         if isinstance(data, str):
             data = data.encode('utf-8')
             
@@ -610,6 +2316,7 @@ class FastMCPASGIWrapper:
                 [b'access-control-allow-origin', b'*'],
                 [b'access-control-allow-methods', b'GET, POST, OPTIONS'],
                 [b'access-control-allow-headers', b'Content-Type, Authorization'],
+                *(headers or ()),
             ],
         })
         await send({
@@ -618,24 +2325,13 @@ class FastMCPASGIWrapper:
         })
 
 # Create the ASGI application
-app = FastMCPASGIWrapper(mcp_server)
+app = FastMCPASGIWrapper(lifespan=server_lifespan)
 
 def main():
-    """Main function to start the MCP server."""
-    # Get host and port from environment variables
-    host = os.environ.get("HOST", "0.0.0.0")
-    port = int(os.environ.get("PORT", "8000"))
-    
-    logger.info(f"Starting MCP server on {host}:{port}")
-    logger.info("Server will be accessible via SSE transport")
-
-    # Run the FastMCP server
-    uvicorn.run(
-        "server:app",
-        host=host,
-        port=port,
-        reload=True,
-    )
+    """Main function to start the MCP server with the production runner."""
+    import runner
+
+    runner.main()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+"""
+State shared between the uvicorn workers of one instance.
+
+Every worker process has its own in-memory caches and token buckets, so
+with N workers a query can reach the upstream N times and a client gets N
+times its rate limit. ``SharedCache`` is a second search cache tier behind
+the in-process ``TTLCache``, and ``SharedRateLimiter`` keeps the per-client
+token buckets; both live in one SQLite database on local disk (tmpfs is
+best), in WAL mode like the document store, so lookups from different
+workers do not block each other.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import serialization
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (namespace, accessed_at);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    full_at REAL NOT NULL
+);
+"""
+
+# Hits only bump an entry's access time when it is older than this, so a
+# hot query does not turn every read into a write
+ACCESS_RESOLUTION = 10.0
+
+# Writes between two sweeps of expired cache entries or full token buckets
+SWEEP_INTERVAL = 256
+
+
+class SharedDatabase:
+    """
+    SQLite database holding the shared state, with one connection per thread.
+
+    Nothing is opened until first use, so one can be created while the
+    server module is imported.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it (and the schema) on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SharedCache:
+    """
+    TTL cache of JSON-serializable values shared by every worker.
+
+    Mirrors ``TTLCache``: expired entries are misses but are kept
+    ``stale_ttl`` seconds longer for ``get_stale``, and beyond ``maxsize``
+    entries the least recently used ones are evicted. Expiry and the size
+    cap are enforced by a sweep every ``SWEEP_INTERVAL`` writes rather than
+    on each one.
+
+    Args:
+        database: Shared database to store the entries in
+        namespace: Name keeping these entries apart from other caches
+        maxsize: Number of entries kept after a sweep
+        ttl: Lifetime of an entry in seconds
+        stale_ttl: Seconds past its TTL an entry may still be served stale
+    """
+
+    def __init__(self, database: SharedDatabase, namespace: str, maxsize: int = 10000,
+                 ttl: float = 300.0, stale_ttl: float = 0.0):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.database = database
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key, separators=(",", ":"), default=str)
+
+    def _read(self, key: Hashable, stale: bool) -> Any:
+        conn = self.database.connect()
+        skey = self._key(key)
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, skey),
+        ).fetchone()
+        now = time.time()
+        if row is None or now >= row[1] + (self.stale_ttl if stale else 0.0):
+            return None
+        value, _, accessed_at = row
+        if now - accessed_at > ACCESS_RESOLUTION:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, skey))
+        return serialization.loads(value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key`` or ``default`` on a miss."""
+        value = self._read(key, stale=False)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for ``key`` even if expired, within ``stale_ttl``."""
+        value = self._read(key, stale=True)
+        if value is None:
+            return default
+        self.stale_hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value`` under ``key`` for ``ttl`` seconds (default ``self.ttl``)."""
+        now = time.time()
+        conn = self.database.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, self._key(key), serialization.dumps(value),
+             now + (self.ttl if ttl is None else ttl), now),
+        )
+        self._writes += 1
+        if self._writes % SWEEP_INTERVAL == 0:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete entries past their stale window and the least recently used beyond ``maxsize``."""
+        conn = self.database.connect()
+        removed = conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at + ? < ?",
+            (self.namespace, self.stale_ttl, time.time()),
+        ).rowcount
+        evicted = conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache WHERE namespace = ? "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize),
+        ).rowcount
+        self.evictions += evicted
+        return removed + evicted
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        """Drop one entry, or every entry of the namespace when ``key`` is None."""
+        conn = self.database.connect()
+        if key is None:
+            cursor = conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        else:
+            cursor = conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?",
+                                  (self.namespace, self._key(key)))
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        return self.database.connect().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        """Async wrapper around ``get`` that keeps SQLite off the event loop."""
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aget_stale(self, key: Hashable, default: Any = None) -> Any:
+        """Async wrapper around ``get_stale`` that keeps SQLite off the event loop."""
+        return await asyncio.to_thread(self.get_stale, key, default)
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Async wrapper around ``set`` that keeps SQLite off the event loop."""
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the entry count and this worker's hit/miss/eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "path": self.database.path,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+class SharedRateLimiter:
+    """
+    Token buckets shared by every worker, refilled continuously at ``rate``
+    tokens per second like ``admission.TokenBucket``.
+
+    A bucket row is read and updated in one write transaction, so workers
+    taking tokens for the same client at once are serialized. Rows of
+    buckets that have refilled completely are swept away, since a missing
+    bucket starts full anyway.
+    """
+
+    def __init__(self, database: SharedDatabase):
+        self.database = database
+        self._writes = 0
+
+    def reserve(self, key: str, rate: float, burst: float, max_wait: float,
+                cost: float = 1.0) -> Tuple[Optional[float], float]:
+        """
+        Take ``cost`` tokens from the bucket ``key``, possibly ones only
+        available later.
+
+        Returns:
+            (wait, retry_after): seconds to wait before the tokens may be
+            used, or None if that would exceed ``max_wait`` and nothing was
+            taken; and seconds until another ``cost`` tokens are available
+        """
+        conn = self.database.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = (cost - tokens) / rate if tokens < cost else 0.0
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                return None, wait
+            tokens -= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + (burst - tokens) / rate),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % SWEEP_INTERVAL == 0:
+            conn.execute("DELETE FROM buckets WHERE full_at < ?", (now,))
+        return wait, max(0.0, (cost - tokens) / rate)
+
+    def refund(self, key: str, rate: float, burst: float, cost: float = 1.0) -> None:
+        """Return tokens taken by ``reserve`` that ended up unused."""
+        self.database.connect().execute(
+            "UPDATE buckets SET tokens = MIN(?, tokens + ?), "
+            "full_at = updated + (? - MIN(?, tokens + ?)) / ? WHERE key = ?",
+            (burst, cost, burst, burst, cost, rate, key),
+        )
+
+    async def areserve(self, key: str, rate: float, burst: float, max_wait: float,
+                       cost: float = 1.0) -> Tuple[Optional[float], float]:
+        """Async wrapper around ``reserve`` that keeps SQLite off the event loop."""
+        return await asyncio.to_thread(self.reserve, key, rate, burst, max_wait, cost)
+
+    async def arefund(self, key: str, rate: float, burst: float, cost: float = 1.0) -> None:
+        """Async wrapper around ``refund`` that keeps SQLite off the event loop."""
+        await asyncio.to_thread(self.refund, key, rate, burst, cost)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of clients with a partly drained bucket."""
+        count = self.database.connect().execute(
+            "SELECT COUNT(*) FROM buckets WHERE full_at >= ?", (time.time(),)).fetchone()[0]
+        return {"path": self.database.path, "clients": count}
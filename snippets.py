@@ -0,0 +1,193 @@
+"""
+Query-aware snippet extraction for search results.
+
+Rather than returning the first few hundred characters of a hit, the search
+tool scans every content chunk returned for the hit, finds windows where
+the query terms cluster, and returns the best passages that fit a byte
+budget, with the matched terms highlighted. Everything is a single linear
+pass over the text plus a sort of the candidate windows.
+"""
+
+import bisect
+import math
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from stopwords import STOPWORDS
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+ELLIPSIS = "..."
+
+# Passages shorter than this are not worth adding to a snippet
+MIN_PASSAGE_BYTES = 60
+
+# Bytes a passage adds besides its text: an ellipsis on each side and the
+# space joining it to the next passage
+PASSAGE_OVERHEAD = 2 * len(ELLIPSIS) + 1
+
+# A hit: (start, end, term) within one chunk's text
+Hit = Tuple[int, int, str]
+
+
+def _byte_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def truncate_bytes(text: str, limit: int) -> str:
+    """
+    Cut ``text`` to at most ``limit`` UTF-8 bytes, on a word boundary if possible.
+    """
+    encoded = text.encode("utf-8")
+    if len(encoded) <= limit:
+        return text
+    cut = encoded[:max(0, limit)].decode("utf-8", "ignore")
+    space = cut.rfind(" ")
+    return cut[:space] if space > len(cut) // 2 else cut
+
+
+def _find_hits(text: str, terms: set) -> List[Hit]:
+    """Return every query-term occurrence in ``text``, in order."""
+    hits = []
+    for match in _WORD_RE.finditer(text):
+        term = match.group().casefold()
+        if term in terms:
+            hits.append((match.start(), match.end(), term))
+    return hits
+
+
+def _best_windows(hits: List[Hit], weights: Dict[str, float], width: int,
+                  chunk: int) -> List[Tuple[float, int, int, int]]:
+    """
+    Score every window of at most ``width`` characters that ends on a hit.
+
+    A window scores the weights of the distinct terms it contains plus a
+    small bonus per repeated hit. Two pointers keep this linear in the
+    number of hits.
+
+    Returns:
+        (score, chunk, start, end) for each candidate window
+    """
+    windows = []
+    counts: Dict[str, int] = {}
+    score = 0.0
+    left = 0
+    for right, (_, end, term) in enumerate(hits):
+        if counts.get(term, 0) == 0:
+            score += weights[term]
+        counts[term] = counts.get(term, 0) + 1
+        while end - hits[left][0] > width:
+            old = hits[left][2]
+            counts[old] -= 1
+            if counts[old] == 0:
+                score -= weights[old]
+            left += 1
+        windows.append((score + 0.1 * (right - left), chunk, hits[left][0], end))
+    return windows
+
+
+def _passage_bounds(text: str, start: int, end: int, width: int) -> Tuple[int, int]:
+    """Centre the hit span in a ``width``-character passage on word boundaries."""
+    pad = max(0, (width - (end - start)) // 2)
+    lo = max(0, start - pad)
+    hi = min(len(text), end + pad)
+    if lo > 0:
+        space = text.find(" ", lo, start)
+        lo = space + 1 if space != -1 else lo
+    if hi < len(text):
+        space = text.rfind(" ", end, hi)
+        hi = space if space != -1 else hi
+    return lo, hi
+
+
+def _highlight(text: str, offset: int, hits: List[Hit], marker: str) -> str:
+    """Wrap the hits falling inside ``text`` (which starts at ``offset``) in ``marker``."""
+    if not marker:
+        return text
+    parts = []
+    position = 0
+    first = bisect.bisect_left(hits, (offset,))
+    for start, end, _ in hits[first:]:
+        start -= offset
+        end -= offset
+        if end > len(text):
+            break
+        parts.append(text[position:start])
+        parts.append(marker + text[start:end] + marker)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def extract_snippet(query: str, texts: Sequence[str], budget: int = 500,
+                    highlight: str = "**") -> str:
+    """
+    Build a snippet of the passages of ``texts`` that best match ``query``.
+
+    Terms rare among the hits weigh more than common ones, so a window with
+    "rook" and "castle" beats one repeating "the". The best non-overlapping
+    windows are added until the budget is spent and are returned in
+    document order, joined with ellipses.
+
+    Args:
+        query: Search query
+        texts: Content chunks of one search hit
+        budget: Maximum snippet size in UTF-8 bytes, not counting the
+            highlight markers
+        highlight: Marker placed on both sides of each matched term; an
+            empty string disables highlighting
+
+    Returns:
+        Snippet text, or the start of the first chunk if no term matches
+    """
+    texts = [text for text in texts if text]
+    if not texts:
+        return ""
+    terms = set(_WORD_RE.findall(query.casefold()))
+    terms = (terms - STOPWORDS) or terms
+
+    chunk_hits = [_find_hits(text, terms) for text in texts] if terms else []
+    totals: Dict[str, int] = {}
+    for hits in chunk_hits:
+        for _, _, term in hits:
+            totals[term] = totals.get(term, 0) + 1
+    if not totals:
+        text = texts[0]
+        snippet = truncate_bytes(text, budget - _byte_len(ELLIPSIS))
+        return snippet + ELLIPSIS if len(snippet) < len(text) else snippet
+
+    # Inverse frequency among the hits: rarer terms are more telling
+    all_hits = sum(totals.values())
+    weights = {term: 1.0 + math.log(all_hits / count) for term, count in totals.items()}
+
+    width = max(MIN_PASSAGE_BYTES, budget // 2)
+    windows = []
+    for chunk, hits in enumerate(chunk_hits):
+        windows.extend(_best_windows(hits, weights, width, chunk))
+    windows.sort(key=lambda window: (-window[0], window[1], window[2]))
+
+    chosen: List[Tuple[int, int, int]] = []
+    remaining = budget
+    for _, chunk, start, end in windows:
+        if remaining < MIN_PASSAGE_BYTES:
+            break
+        if any(c == chunk and start < e and s < end for c, s, e in chosen):
+            continue
+        text = texts[chunk]
+        lo, hi = _passage_bounds(text, start, end, min(width, remaining))
+        if any(c == chunk and lo < e and s < hi for c, s, e in chosen):
+            continue
+        passage = truncate_bytes(text[lo:hi], remaining - PASSAGE_OVERHEAD)
+        if not passage:
+            continue
+        hi = lo + len(passage)
+        chosen.append((chunk, lo, hi))
+        remaining -= _byte_len(passage) + PASSAGE_OVERHEAD
+
+    parts = []
+    for chunk, lo, hi in sorted(chosen):
+        text = texts[chunk]
+        passage = _highlight(text[lo:hi], lo, chunk_hits[chunk], highlight)
+        parts.append(
+            (ELLIPSIS if lo > 0 else "") + passage + (ELLIPSIS if hi < len(text) else ""))
+    return " ".join(parts)
@@ -0,0 +1,175 @@
+"""
+Shared keepalive scheduling for long-lived SSE connections.
+
+Instead of one ``asyncio.sleep`` loop per connection, every open SSE stream
+is registered with a ``ConnectionRegistry`` that drives all keepalives from
+a single timer wheel. Each connection sits in one slot of the wheel, and on
+every tick the connections in the current slot are sent a pre-encoded
+keepalive frame, so writes are spread evenly across the interval. Each send
+is bounded by ``send_timeout``, so a client that stops reading cannot stall
+the wheel for everyone else.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_FRAME = b'event: keepalive\ndata: {}\n\n'
+KEEPALIVE_MESSAGE = {'type': 'http.response.body', 'body': KEEPALIVE_FRAME, 'more_body': True}
+# Completes the response; the ASGI server then reports the stream's
+# ``receive`` as disconnected, which ends its handler
+END_MESSAGE = {'type': 'http.response.body', 'body': b'', 'more_body': False}
+
+
+class TooManyConnections(Exception):
+    """Raised when the registry is already at its connection cap."""
+
+
+class SSEConnection:
+    """A registered SSE stream and the slot of the wheel it lives in."""
+
+    __slots__ = ('send', 'slot', 'closed')
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[None]], slot: int):
+        self.send = send
+        self.slot = slot
+        self.closed = False
+
+
+class ConnectionRegistry:
+    """
+    Registry of open SSE connections with one shared keepalive timer.
+
+    The timer task only runs while at least one connection is registered.
+    A connection whose keepalive send fails, or does not complete within
+    ``send_timeout`` seconds (one tick by default), is dropped from the wheel
+    immediately; its request handler notices the disconnect through
+    ``http.disconnect`` on ``receive``.
+    """
+
+    def __init__(self, interval: float = 15.0, max_connections: int = 1000, slots: int = 15,
+                 send_timeout: Optional[float] = None):
+        self.interval = interval
+        self.max_connections = max_connections
+        self.slots = max(1, slots)
+        self.tick = interval / self.slots
+        self.send_timeout = self.tick if send_timeout is None else send_timeout
+        self._wheel: List[Set[SSEConnection]] = [set() for _ in range(self.slots)]
+        self._cursor = 0
+        self._count = 0
+        self._task = None
+        self.draining = False
+        self.opened = 0
+        self.rejected = 0
+        self.keepalives_sent = 0
+        self.send_failures = 0
+        self.send_timeouts = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def register(self, send: Callable[[Dict[str, Any]], Awaitable[None]]) -> SSEConnection:
+        """
+        Register a connection for keepalives.
+
+        Raises:
+            TooManyConnections: If ``max_connections`` streams are already open
+        """
+        if self.draining or self._count >= self.max_connections:
+            self.rejected += 1
+            raise TooManyConnections()
+        # The slot just behind the cursor comes around last, so the first
+        # keepalive is sent a full interval after the connection opens
+        slot = (self._cursor - 1) % self.slots
+        connection = SSEConnection(send, slot)
+        self._wheel[slot].add(connection)
+        self._count += 1
+        self.opened += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return connection
+
+    def unregister(self, connection: SSEConnection) -> None:
+        """Remove a connection from the wheel; safe to call more than once."""
+        if connection.closed:
+            return
+        connection.closed = True
+        self._wheel[connection.slot].discard(connection)
+        self._count -= 1
+
+    async def _run(self) -> None:
+        while self._count:
+            await asyncio.sleep(self.tick)
+            self._cursor = (self._cursor + 1) % self.slots
+            due = list(self._wheel[self._cursor])
+            if due:
+                await asyncio.gather(*(self._keepalive(c) for c in due))
+
+    async def _keepalive(self, connection: SSEConnection) -> None:
+        try:
+            async with asyncio.timeout(self.send_timeout):
+                await connection.send(KEEPALIVE_MESSAGE)
+            self.keepalives_sent += 1
+        except TimeoutError:
+            logger.info("Dropping SSE client that stopped reading")
+            self.send_timeouts += 1
+            self.unregister(connection)
+        except Exception as e:
+            logger.info(f"Client disconnected: {e}")
+            self.send_failures += 1
+            self.unregister(connection)
+
+    async def close(self) -> None:
+        """Stop the timer and forget every connection."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for slot in self._wheel:
+            for connection in list(slot):
+                self.unregister(connection)
+
+    async def drain(self) -> int:
+        """
+        End every open stream and refuse new ones, for a graceful shutdown.
+
+        EventSource clients reconnect when a stream ends, so they move to
+        another worker or instance instead of holding this one open until
+        the shutdown timeout.
+
+        Returns:
+            Number of streams ended
+        """
+        self.draining = True
+        connections = [connection for slot in self._wheel for connection in slot]
+        await asyncio.gather(*(self._end(connection) for connection in connections))
+        return len(connections)
+
+    async def _end(self, connection: SSEConnection) -> None:
+        try:
+            async with asyncio.timeout(self.send_timeout):
+                await connection.send(END_MESSAGE)
+        except TimeoutError:
+            logger.info("SSE client stopped reading before its stream ended")
+        except Exception as e:
+            logger.info(f"Client disconnected: {e}")
+        finally:
+            self.unregister(connection)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current connection count and keepalive counters."""
+        return {
+            'connections': self._count,
+            'max_connections': self.max_connections,
+            'draining': self.draining,
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'keepalives_sent': self.keepalives_sent,
+            'send_failures': self.send_failures,
+            'send_timeouts': self.send_timeouts,
+        }
@@ -0,0 +1,11 @@
+"""
+Stopwords shared by the text-matching code.
+
+Function words ignored when a query also has content words, so passages are
+not chosen (or highlighted) and queries are not matched for "the" or "how".
+"""
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it of on or that
+the this to was what when where which who why will with
+""".split())
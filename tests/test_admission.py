@@ -0,0 +1,108 @@
+"""Unit tests for admission control."""
+import asyncio
+
+import pytest
+
+from admission import (AdmissionBudget, AdmissionController, AdmissionRejected,
+                       ConcurrencyLimiter, TokenBucket)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_limiter_hands_slots_to_waiters_in_order():
+    """Released slots go to the oldest waiter first."""
+    limiter = ConcurrencyLimiter(1)
+    assert await limiter.acquire(0)
+    order = []
+
+    async def waiter(name):
+        assert await limiter.acquire(1.0)
+        order.append(name)
+        limiter.release()
+
+    tasks = [asyncio.ensure_future(waiter(name)) for name in "abc"]
+    await asyncio.sleep(0)
+    assert limiter.queued == 3
+    limiter.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ["a", "b", "c"]
+    assert limiter.stats() == {"limit": 1, "inflight": 0, "queued": 0, "peak_queued": 3}
+
+
+async def test_limiter_wait_times_out():
+    """A waiter gives up at its deadline and leaves the queue."""
+    limiter = ConcurrencyLimiter(1)
+    assert await limiter.acquire(0)
+
+    assert not await limiter.acquire(0.01)
+    assert not await limiter.acquire(0)
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.inflight == 0
+
+
+async def test_token_bucket_reserves_future_tokens_within_max_wait():
+    """Tokens beyond the burst are granted only if they arrive within max_wait."""
+    bucket = TokenBucket(rate=10.0, burst=2.0)
+    assert bucket.reserve(0) == 0.0
+    assert bucket.reserve(0) == 0.0
+    assert bucket.reserve(0) is None
+    wait = bucket.reserve(1.0)
+    assert 0 < wait <= 0.1
+    assert bucket.retry_after() > 0.1
+
+
+async def test_controller_rate_limits_per_client():
+    """Each client has its own bucket, and over-limit requests are rejected fast."""
+    controller = AdmissionController(10, {"search": AdmissionBudget(10, rate=1.0, burst=2)},
+                                     queue_timeout=0.0)
+    for _ in range(2):
+        controller.release(await controller.acquire("search", "a"))
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await controller.acquire("search", "a")
+    assert excinfo.value.retry_after == 1
+    controller.release(await controller.acquire("search", "b"))
+
+    stats = controller.stats()
+    assert stats["clients"] == 2
+    assert stats["classes"]["search"]["admitted"] == 3
+    assert stats["classes"]["search"]["rejected"]["rate"] == 1
+
+
+async def test_controller_enforces_class_and_global_caps():
+    """Separate class budgets are enforced under a shared global cap."""
+    controller = AdmissionController(2, {
+        "search": AdmissionBudget(1),
+        "fetch": AdmissionBudget(2),
+    }, queue_timeout=0.01)
+
+    search = await controller.acquire("search", "a")
+    with pytest.raises(AdmissionRejected):
+        await controller.acquire("search", "a")
+    fetch = await controller.acquire("fetch", "a")
+    with pytest.raises(AdmissionRejected, match="capacity"):
+        await controller.acquire("fetch", "a")
+
+    controller.release(search)
+    controller.release(fetch)
+    stats = controller.stats()
+    assert stats["global"]["inflight"] == 0
+    assert stats["classes"]["fetch"]["inflight"] == 0
+    assert stats["classes"]["search"]["rejected"]["class"] == 1
+    assert stats["classes"]["fetch"]["rejected"]["global"] == 1
+
+
+async def test_controller_refunds_tokens_of_rejected_requests():
+    """A request rejected after taking a token gives the token back."""
+    controller = AdmissionController(10, {"search": AdmissionBudget(1, rate=1.0, burst=1)},
+                                     queue_timeout=0.0)
+    search = await controller.acquire("search", "a")
+    with pytest.raises(AdmissionRejected, match="concurrent"):
+        await controller.acquire("search", "b")
+    controller.release(search)
+
+    # b's token was refunded, so it is admitted now rather than rate limited
+    controller.release(await controller.acquire("search", "b"))
+    assert controller.stats()["classes"]["search"]["rejected"]["rate"] == 0
@@ -0,0 +1,199 @@
+"""Unit tests for the in-process caching primitives."""
+import asyncio
+import time
+
+import pytest
+
+import numpy as np
+
+from cache import (HashingEmbedder, SemanticCache, SingleFlight, TTLCache, load_embedder,
+                   normalize_query)
+
+
+def test_normalize_query_folds_case_punctuation_and_whitespace():
+    """Trivially different queries normalize to the same key."""
+    assert normalize_query("  Level up FAST?! ") == "level up fast"
+    assert normalize_query("level\tup, fast") == "level up fast"
+
+
+def test_ttl_cache_lru_eviction():
+    """The least recently used entry is evicted once the cache is full."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expiry_and_invalidation():
+    """Expired entries are misses and invalidation removes entries."""
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set("short", "x", ttl=0.01)
+    cache.set("long", "y")
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.invalidate("long") == 1
+    assert cache.get("long") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 0
+    assert stats["misses"] == 2
+
+
+def test_ttl_cache_serves_stale_entries():
+    """Expired entries stay available to get_stale for the stale window."""
+    cache = TTLCache(maxsize=4, ttl=60, stale_ttl=60)
+    cache.set("key", "value", ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("key") is None
+    assert cache.get_stale("key") == "value"
+    assert cache.get_stale("missing") is None
+    assert cache.stats()["stale_hits"] == 1
+
+    cache.set("gone", "value", ttl=-120)
+    assert cache.get_stale("gone") is None
+    assert cache.get("gone") is None
+    assert "gone" not in cache
+
+
+def _axis_embed(text):
+    """Stub embedder: one axis per known word, so similarities are exact."""
+    words = ["dragon", "boss", "sword", "shield"]
+    return np.array([float(word in text) for word in words])
+
+
+def test_semantic_cache_matches_similar_queries():
+    """A query close enough to a cached one is served its results."""
+    cache = SemanticCache(_axis_embed, maxsize=4, threshold=0.7)
+    cache.set("k1", "dragon boss", "boss guide")
+
+    assert cache.get("dragon boss") == "boss guide"
+    value, similarity = cache.lookup("dragon")
+    assert value == "boss guide"
+    assert similarity == pytest.approx(0.7071, abs=1e-3)
+    assert cache.get("sword") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    """When full, the least recently used row is overwritten."""
+    cache = SemanticCache(_axis_embed, maxsize=2, threshold=0.99)
+    cache.set("a", "dragon", 1)
+    cache.set("b", "sword", 2)
+    assert cache.get("dragon") == 1
+
+    cache.set("c", "shield", 3)
+
+    assert len(cache) == 2
+    assert cache.get("sword") is None
+    assert cache.get("dragon") == 1
+    assert cache.get("shield") == 3
+    assert cache.stats()["evictions"] == 1
+
+    # Re-setting a key replaces its row rather than adding one
+    cache.set("a", "dragon", 4)
+    assert len(cache) == 2
+    assert cache.get("dragon") == 4
+
+
+def test_semantic_cache_expiry_and_invalidation():
+    """Expired and invalidated entries never match."""
+    cache = SemanticCache(_axis_embed, maxsize=4, ttl=0.01, threshold=0.9)
+    cache.set("a", "dragon", 1)
+    time.sleep(0.02)
+    assert cache.get("dragon") is None
+
+    cache.ttl = 60
+    cache.set("a", "dragon", 1)
+    cache.set("b", "sword", 2)
+    assert cache.invalidate("a") == 1
+    assert cache.invalidate("missing") == 0
+    assert cache.get("dragon") is None
+    assert cache.get("sword") == 2
+    assert cache.invalidate() == 2
+    assert cache.get("sword") is None
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_offloads_custom_embedders():
+    """A custom embedder runs off the event loop thread; the built-in one inline."""
+    import threading
+
+    threads = []
+
+    def embed(query):
+        threads.append(threading.current_thread())
+        return _axis_embed(query)
+
+    cache = SemanticCache(embed, maxsize=4, threshold=0.9)
+    assert cache.offload
+    assert not SemanticCache(HashingEmbedder()).offload
+
+    await cache.aset("a", "dragon", 1)
+    assert await cache.aget("dragon") == 1
+    assert threads and threading.main_thread() not in threads
+
+
+def test_hashing_embedder_is_stable_and_order_insensitive():
+    """Reordered words embed identically; unrelated queries are dissimilar."""
+    embed = HashingEmbedder(dim=128)
+
+    def similarity(a, b):
+        u, v = embed(a), embed(b)
+        return float(u @ v / (np.linalg.norm(u) * np.linalg.norm(v)))
+
+    assert embed("Dragon boss").shape == (128,)
+    assert similarity("dragon boss guide", "guide: boss dragon?") == pytest.approx(1.0)
+    assert similarity("dragon boss guide", "unlock fast travel") < 0.5
+    assert isinstance(load_embedder("hashing"), HashingEmbedder)
+    assert load_embedder("cache:HashingEmbedder").dim == 256
+    with pytest.raises(ValueError):
+        load_embedder("not-a-path")
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    """Concurrent calls with the same key run the work once."""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"value": calls}
+
+    results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {"inflight": 0, "calls": 5, "shared": 4}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_error():
+    """Every waiter receives the same exception from the shared call."""
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    results = await asyncio.gather(
+        *(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert results[0] is results[1] is results[2]
+    assert len(flight) == 0
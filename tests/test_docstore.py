@@ -0,0 +1,64 @@
+"""Unit tests for the persistent document store."""
+import sqlite3
+
+from docstore import DocumentStore
+
+
+def make_document(doc_id, text="Full document content"):
+    return {
+        "id": doc_id,
+        "title": f"{doc_id}.txt",
+        "text": text,
+        "url": f"https://platform.openai.com/storage/files/{doc_id}",
+        "metadata": {"game": "chess"},
+    }
+
+
+def test_document_store_round_trip_across_instances(tmp_path):
+    """Documents written by one worker are readable by another."""
+    path = str(tmp_path / "documents.sqlite3")
+    writer = DocumentStore(path, vector_store_id="vs_1")
+    writer.put(make_document("file_1"))
+
+    reader = DocumentStore(path, vector_store_id="vs_1")
+    assert reader.get("file_1") == make_document("file_1")
+    assert reader.get("file_2") is None
+    assert reader.stats()["hits"] == 1
+    assert reader.stats()["misses"] == 1
+
+
+def test_document_store_freshness_and_validation(tmp_path):
+    """Documents from another store, expired or corrupt documents are misses."""
+    path = str(tmp_path / "documents.sqlite3")
+    store = DocumentStore(path, vector_store_id="vs_1")
+    store.put(make_document("file_1"))
+
+    assert DocumentStore(path, vector_store_id="vs_2").get("file_1") is None
+    assert DocumentStore(path, vector_store_id="vs_1", max_age=1e-9).get("file_1") is None
+    stale = DocumentStore(path, vector_store_id="vs_1", max_age=1e-9).get("file_1", allow_stale=True)
+    assert stale["text"] == "Full document content"
+
+    assert store.contains("file_1") and not store.contains("file_2")
+    assert not DocumentStore(path, vector_store_id="vs_2").contains("file_1")
+    assert not DocumentStore(path, vector_store_id="vs_1", max_age=1e-9).contains("file_1")
+    assert store.stats()["hits"] == 0
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE documents SET text = 'tampered' WHERE id = 'file_1'")
+    assert store.get("file_1") is None
+    assert store.stats()["invalid"] == 1
+    assert store.stats()["documents"] == 0
+
+
+def test_document_store_evicts_least_recently_accessed(tmp_path):
+    """The size cap is enforced by evicting the oldest documents."""
+    store = DocumentStore(str(tmp_path / "documents.sqlite3"), vector_store_id="vs_1",
+                          max_bytes=25)
+    store.put(make_document("file_1", "a" * 10))
+    store.put(make_document("file_2", "b" * 10))
+    store.put(make_document("file_3", "c" * 10))
+
+    assert store.get("file_1") is None
+    assert store.get("file_3") is not None
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["bytes"] == 20
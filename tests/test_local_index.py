@@ -0,0 +1,77 @@
+"""Unit tests for the local vector store mirror."""
+from types import SimpleNamespace
+
+import pytest
+
+from local_index import LocalIndex, chunk_text, sync_index
+
+DOCUMENTS = [
+    {"id": "file_chess", "title": "chess.txt",
+     "text": "Castling moves the king two squares towards a rook."},
+    {"id": "file_go", "title": "go.txt",
+     "text": "Stones are captured when they have no liberties left."},
+    {"id": "file_poker", "title": "poker.txt",
+     "text": "A flush beats a straight. The king of hearts is a high card."},
+]
+
+
+def test_chunk_text_overlaps_on_word_boundaries():
+    """Long text is split into overlapping chunks without cutting words."""
+    text = " ".join(f"word{i}" for i in range(200))
+    chunks = chunk_text(text, chunk_chars=100, overlap=20)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.split()[0].startswith("word") for chunk in chunks)
+
+
+def test_local_index_round_trip_and_search(tmp_path):
+    """A saved index is memory-mapped back and ranks matching chunks first."""
+    directory = str(tmp_path / "index")
+    LocalIndex.build(DOCUMENTS, vector_store_id="vs_1").save(directory)
+    index = LocalIndex.load(directory)
+
+    results = index.search("king castling", limit=2)
+    assert [r.file_id for r in results] == ["file_chess", "file_poker"]
+    assert results[0].filename == "chess.txt"
+    assert "Castling" in results[0].content[0].text
+    assert index.search("zebra unicorn") == []
+    assert index.stats()["vector_store_id"] == "vs_1"
+
+
+def test_local_index_load_rejects_other_store(tmp_path):
+    """An index synced from another vector store is refused."""
+    directory = str(tmp_path / "index")
+    LocalIndex.build(DOCUMENTS, vector_store_id="vs_1").save(directory)
+
+    assert len(LocalIndex.load(directory, vector_store_id="vs_1").files) == 3
+    with pytest.raises(ValueError):
+        LocalIndex.load(directory, vector_store_id="vs_2")
+
+
+@pytest.mark.asyncio
+async def test_sync_index_with_stub_client(tmp_path):
+    """The sync job mirrors every file of the store without network access."""
+    async def list_files(vector_store_id):
+        for document in DOCUMENTS:
+            yield SimpleNamespace(id=document["id"], status="completed")
+
+    async def content(vector_store_id, file_id):
+        text = next(d["text"] for d in DOCUMENTS if d["id"] == file_id)
+        return SimpleNamespace(data=[SimpleNamespace(text=text)])
+
+    async def retrieve(file_id):
+        title = next(d["title"] for d in DOCUMENTS if d["id"] == file_id)
+        return SimpleNamespace(id=file_id, filename=title)
+
+    files = SimpleNamespace(list=list_files, content=content)
+    client = SimpleNamespace(vector_stores=SimpleNamespace(files=files),
+                             files=SimpleNamespace(retrieve=retrieve))
+
+    directory = str(tmp_path / "index")
+    await sync_index(client, "vs_1", directory)
+
+    index = LocalIndex.load(directory)
+    assert len(index.files) == 3
+    assert index.search("liberties")[0].file_id == "file_go"
+    assert index.search("liberties")[0].filename == "go.txt"
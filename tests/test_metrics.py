@@ -0,0 +1,81 @@
+"""Unit tests for the latency instrumentation."""
+import pytest
+
+from metrics import LatencyHistogram, MetricFamily, MetricsRegistry, RollingLatency
+
+
+def test_latency_histogram_snapshot():
+    """Observations land in cumulative buckets with percentile estimates."""
+    histogram = LatencyHistogram(buckets=(0.1, 0.2, 0.5))
+    for seconds in (0.05, 0.15, 0.15, 0.3, 1.0):
+        histogram.observe(seconds)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["buckets"] == [(0.1, 1), (0.2, 3), (0.5, 4), ("+Inf", 5)]
+    assert 0.1 <= snapshot["p50"] <= 0.2
+    assert snapshot["p99"] == 0.5
+
+
+def test_latency_histogram_empty():
+    """An empty histogram reports no percentiles."""
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.snapshot()["mean"] is None
+
+
+def test_rolling_latency_tracks_recent_window():
+    """Percentiles only reflect the most recent observations."""
+    window = RollingLatency(size=100, refresh=1)
+    assert window.percentile(95) is None
+
+    for i in range(1, 101):
+        window.observe(i / 1000)
+    assert window.percentile(50) == 0.05
+    assert window.percentile(95) == 0.095
+
+    for _ in range(100):
+        window.observe(1.0)
+    assert len(window) == 100
+    assert window.percentile(50) == 1.0
+
+
+def test_registry_renders_prometheus_text():
+    """Counters, gauges and histograms render in the text exposition format."""
+    registry = MetricsRegistry()
+    requests = registry.counter("app_requests_total", "Requests", ("route", "status"))
+    inflight = registry.gauge("app_inflight", "In flight")
+    latency = registry.histogram("app_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+
+    requests.labels("/search", "200").inc()
+    requests.labels("/search", "200").inc(2)
+    inflight.set(3)
+    latency.labels('say "hi"\n').observe(0.5)
+
+    text = registry.render()
+    assert "# TYPE app_requests_total counter" in text
+    assert 'app_requests_total{route="/search",status="200"} 3.0' in text
+    assert "app_inflight 3" in text
+    assert 'app_seconds_bucket{route="say \\"hi\\"\\n",le="0.1"} 0' in text
+    assert 'app_seconds_bucket{route="say \\"hi\\"\\n",le="+Inf"} 1' in text
+    assert 'app_seconds_count{route="say \\"hi\\"\\n"} 1' in text
+    assert text.endswith("\n")
+
+    with pytest.raises(ValueError):
+        requests.labels("/search")
+
+
+def test_registry_calls_collectors_at_scrape_time():
+    """Collectors are evaluated on every render, and None samples are skipped."""
+    registry = MetricsRegistry()
+    state = {"size": 1}
+    registry.register_collector(lambda: [MetricFamily(
+        "app_cache_entries", "gauge", "Entries",
+        [("app_cache_entries", {"cache": "search"}, state["size"]),
+         ("app_cache_entries", {"cache": "semantic"}, None)])])
+
+    assert 'app_cache_entries{cache="search"} 1' in registry.render()
+    state["size"] = 7
+    text = registry.render()
+    assert 'app_cache_entries{cache="search"} 7' in text
+    assert "semantic" not in text
@@ -0,0 +1,68 @@
+"""Unit tests for the background prefetcher."""
+import asyncio
+
+import pytest
+
+from prefetch import Prefetcher
+
+pytestmark = pytest.mark.asyncio
+
+
+async def drain(prefetcher):
+    while prefetcher.stats()["inflight"]:
+        await asyncio.sleep(0)
+
+
+async def test_prefetcher_fetches_each_document_once():
+    """Scheduled IDs are fetched in order; queued or recent IDs are skipped."""
+    fetched = []
+
+    async def fetch(doc_id):
+        fetched.append(doc_id)
+
+    prefetcher = Prefetcher(fetch, rate=100, burst=10)
+    prefetcher.schedule(["file_1", "file_2", "file_1"])
+    await drain(prefetcher)
+    prefetcher.schedule(["file_2", "file_3"])
+    await drain(prefetcher)
+
+    assert fetched == ["file_1", "file_2", "file_3"]
+    stats = prefetcher.stats()
+    assert stats["scheduled"] == 3
+    assert stats["skipped"] == 2
+    assert stats["fetched"] == 3
+
+
+async def test_prefetcher_drops_work_over_budget():
+    """Beyond the burst and the queue size, documents are dropped, not delayed."""
+    fetched = []
+
+    async def fetch(doc_id):
+        fetched.append(doc_id)
+
+    prefetcher = Prefetcher(fetch, rate=0.001, burst=2, max_queue=3)
+    prefetcher.schedule([f"file_{i}" for i in range(5)])
+    await drain(prefetcher)
+
+    assert fetched == ["file_0", "file_1"]
+    assert prefetcher.stats()["dropped"] == 3
+    assert prefetcher.stats()["queued"] == 0
+
+
+async def test_prefetcher_counts_failures_and_close_cancels():
+    """A failed fetch is counted; close cancels the prefetches in flight."""
+    started = asyncio.Event()
+
+    async def fetch(doc_id):
+        if doc_id == "file_bad":
+            raise RuntimeError("boom")
+        started.set()
+        await asyncio.sleep(10)
+
+    prefetcher = Prefetcher(fetch, rate=100, burst=10)
+    prefetcher.schedule(["file_bad", "file_slow"])
+    await asyncio.wait_for(started.wait(), 1)
+    await prefetcher.close()
+
+    assert prefetcher.stats()["failed"] == 1
+    assert prefetcher.stats()["inflight"] == 0
@@ -0,0 +1,91 @@
+"""Unit tests for request profiling and slow-request capture."""
+import asyncio
+import time
+
+import pytest
+
+from profiling import RequestProfiler, record_span
+
+pytestmark = pytest.mark.asyncio
+
+TOKEN_HEADERS = [(b'x-profile-token', b'secret')]
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def test_requests_are_not_profiled_by_default():
+    """Without sampling or a valid token no trace is started."""
+    profiler = RequestProfiler(sample_rate=0.0, token="secret")
+
+    assert profiler.start("GET /health", []) is None
+    assert profiler.start("GET /health", [(b'x-profile-token', b'wrong')]) is None
+    assert RequestProfiler().start("GET /health", TOKEN_HEADERS) is None
+    record_span("parse", time.perf_counter(), 0.1)  # no trace: ignored
+    assert profiler.stats()["profiled"] == 0
+
+
+async def test_slow_request_is_kept_with_spans_and_hotspots(tmp_path):
+    """A slow profiled request keeps its spans, hotspots and a pstats dump."""
+    profiler = RequestProfiler(slow_threshold=0.01, directory=str(tmp_path), token="secret")
+
+    trace = profiler.start("POST /fetch", TOKEN_HEADERS)
+    started = time.perf_counter()
+    await asyncio.sleep(0.01)
+    record_span("upstream.fetch", started, time.perf_counter() - started, outcome="ok")
+    _busy(0.01)
+    entry = await profiler.finish(trace, 200)
+
+    assert entry["route"] == "POST /fetch"
+    assert entry["status"] == 200
+    assert entry["duration"] >= 0.01
+    assert entry["spans"][0]["name"] == "upstream.fetch"
+    assert entry["spans"][0]["outcome"] == "ok"
+    assert any("_busy" in hotspot["function"] for hotspot in entry["hotspots"])
+    assert (tmp_path / entry["profile"]).exists()
+    assert list(profiler.recent) == [entry]
+
+    # Spans after the request has finished are not recorded anywhere
+    record_span("late", time.perf_counter(), 0.0)
+    assert len(entry["spans"]) == 1
+
+
+async def test_fast_requests_are_dropped():
+    """Profiled requests under the threshold are not kept."""
+    profiler = RequestProfiler(sample_rate=1.0, slow_threshold=10.0)
+
+    trace = profiler.start("GET /health", [])
+    assert await profiler.finish(trace, 200) is None
+    assert profiler.stats()["profiled"] == 1
+    assert profiler.stats()["slow"] == 0
+
+
+async def test_dump_directory_is_a_bounded_ring(tmp_path):
+    """Only the newest max_files dumps are kept."""
+    profiler = RequestProfiler(sample_rate=1.0, slow_threshold=0.0,
+                               directory=str(tmp_path), max_files=2)
+
+    for _ in range(4):
+        await profiler.finish(profiler.start("GET /health", []), 200)
+        # Dump names sort by timestamp, then by trace ID within a second
+        await asyncio.sleep(0)
+
+    dumps = sorted(path.name for path in tmp_path.iterdir())
+    assert len(dumps) == 2
+    assert [entry["profile"] for entry in profiler.recent][:2] == dumps[::-1]
+
+
+async def test_only_one_request_runs_under_cprofile():
+    """Concurrent profiled requests still get traces, but one CPU profile."""
+    profiler = RequestProfiler(sample_rate=1.0, slow_threshold=0.0)
+
+    async def request():
+        trace = profiler.start("GET /health", [])
+        await asyncio.sleep(0.01)
+        return await profiler.finish(trace, 200)
+
+    first, second = await asyncio.gather(request(), request())
+    assert (first["hotspots"] is None) != (second["hotspots"] is None)
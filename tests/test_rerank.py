@@ -0,0 +1,49 @@
+"""Unit tests for search result re-ranking and deduplication."""
+from types import SimpleNamespace
+
+import pytest
+
+from rerank import bm25_scores, merge_by_file, rerank
+
+
+def hit(file_id, text, score=0.5, filename=None):
+    return SimpleNamespace(file_id=file_id, filename=filename or f"{file_id}.txt", score=score,
+                           content=[SimpleNamespace(type="text", text=text)])
+
+
+def test_merge_by_file_combines_chunks():
+    """Chunks of one file become one document with every chunk and the best score."""
+    items = [hit("a", "first", 0.9), hit("b", "other", 0.8), hit("a", "second", 0.7),
+             SimpleNamespace(content=[])]
+
+    documents = merge_by_file(items)
+
+    assert [d.file_id for d in documents[:2]] == ["a", "b"]
+    assert [c.text for c in documents[0].content] == ["first", "second"]
+    assert documents[0].score == 0.9
+    assert len(documents) == 3
+
+
+def test_bm25_scores_rank_matching_text_first():
+    """Texts with more (and rarer) query terms score higher."""
+    scores = bm25_scores("rook castle", ["the rook can castle", "a rook moves", "bishops"])
+
+    assert scores[0] > scores[1] > scores[2] == 0
+    assert bm25_scores("", ["text"]).tolist() == [0.0]
+
+
+def test_rerank_returns_distinct_documents_up_to_limit():
+    """Duplicate chunks no longer take up result slots."""
+    items = [hit("a", "x", 0.9), hit("a", "y", 0.8), hit("b", "z", 0.7), hit("c", "w", 0.6)]
+
+    assert [d.file_id for d in rerank("query", items, 2)] == ["a", "b"]
+
+
+@pytest.mark.parametrize("mode", ["bm25", "hybrid"])
+def test_rerank_lexical_modes_promote_exact_matches(mode):
+    """Lexical re-scoring lifts documents that actually contain the query terms."""
+    items = [hit("a", "general strategy advice", 0.80), hit("b", "how to castle the king", 0.79),
+             hit("c", "opening theory", 0.50)]
+
+    assert rerank("castle king", items, 3, mode)[0].file_id == "b"
+    assert rerank("castle king", items, 3, "none")[0].file_id == "a"
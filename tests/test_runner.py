@@ -0,0 +1,54 @@
+"""Unit tests for the production runner."""
+import os
+from unittest.mock import AsyncMock, patch
+
+import runner
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_cgroup_cpu_limit(tmp_path):
+    """CPU quotas are read from cgroup v2, then v1; no quota means no limit."""
+    assert runner.cgroup_cpu_limit(str(tmp_path)) is None
+
+    write(tmp_path / "v1" / "cpu" / "cpu.cfs_quota_us", "150000\n")
+    write(tmp_path / "v1" / "cpu" / "cpu.cfs_period_us", "100000\n")
+    assert runner.cgroup_cpu_limit(str(tmp_path / "v1")) == 1.5
+
+    write(tmp_path / "v2" / "cpu.max", "max 100000\n")
+    assert runner.cgroup_cpu_limit(str(tmp_path / "v2")) is None
+    write(tmp_path / "v2" / "cpu.max", "200000 100000\n")
+    assert runner.cgroup_cpu_limit(str(tmp_path / "v2")) == 2.0
+
+
+def test_available_cpus_capped_by_quota(tmp_path):
+    """A fractional quota rounds up, and never exceeds the affinity mask."""
+    write(tmp_path / "cpu.max", "150000 100000\n")
+    with patch("os.sched_getaffinity", return_value=set(range(64))):
+        assert runner.available_cpus(str(tmp_path)) == 2
+    with patch("os.sched_getaffinity", return_value={0}):
+        assert runner.available_cpus(str(tmp_path)) == 1
+
+
+def test_default_workers_honours_web_concurrency(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert runner.default_workers() == 3
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    with patch.object(runner, "available_cpus", return_value=4):
+        assert runner.default_workers() == 4
+
+
+def test_warm_up_instance_turns_off_worker_warm_up(monkeypatch):
+    """Once the runner has warmed the shared tiers, workers skip their warm-up."""
+    import server
+
+    monkeypatch.delenv("WARMUP_ON_STARTUP", raising=False)
+    with patch.object(server, "warm_up_instance", AsyncMock(return_value=False)):
+        runner.warm_up_instance()
+    assert "WARMUP_ON_STARTUP" not in os.environ
+    with patch.object(server, "warm_up_instance", AsyncMock(return_value=True)):
+        runner.warm_up_instance()
+    assert os.environ["WARMUP_ON_STARTUP"] == "false"
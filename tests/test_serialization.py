@@ -0,0 +1,39 @@
+"""Unit tests for the pluggable JSON serialization layer."""
+import json
+
+import pytest
+
+import serialization
+
+
+@pytest.mark.parametrize("name", list(serialization.BACKENDS))
+def test_backends_round_trip_to_bytes(name):
+    """Every available backend encodes to UTF-8 bytes and decodes back."""
+    _, dumps, loads = serialization.load_backend(name)
+    payload = {"id": "file_1", "text": "Königsspringer ♞", "results": [1, 2.5, None, True]}
+
+    encoded = dumps(payload)
+
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == payload
+    assert loads(encoded) == payload
+
+
+@pytest.mark.parametrize("name", list(serialization.BACKENDS))
+def test_backends_fall_back_for_unsupported_values(name):
+    """Values the fast backends reject still serialize via the stdlib."""
+    _, dumps, _ = serialization.load_backend(name)
+
+    assert json.loads(dumps({1: "non-str key"})) == {"1": "non-str key"}
+
+
+def test_invalid_json_raises_value_error():
+    """Decode errors surface as ValueError for every backend."""
+    with pytest.raises(ValueError):
+        serialization.loads(b"{not json")
+
+
+def test_unknown_backend():
+    """Unknown backend names are rejected."""
+    with pytest.raises(ValueError):
+        serialization.load_backend("yaml")
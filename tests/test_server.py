@@ -1,6 +1,8 @@
 """Unit tests for the GameBot server."""
+import time
+
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 # Mark all async tests with pytest.mark.asyncio
 pytestmark = pytest.mark.asyncio
@@ -29,13 +31,13 @@ async def test_fetch_endpoint(test_client, mock_openai_client):
         'data': [type('obj', (), {'text': 'Full document content'})]
     })
     
-    mock_file_info = type('MockFileInfo', (), {
-        'filename': 'test_document.txt',
-        'attributes': {'size': 1234}
-    })
+    # Vector store files carry attributes; the filename is on the file object
+    mock_file_info = type('MockFileInfo', (), {'attributes': {'size': 1234}})
     
     mock_openai_client.vector_stores.files.content = AsyncMock(return_value=mock_content)
     mock_openai_client.vector_stores.files.retrieve = AsyncMock(return_value=mock_file_info)
+    mock_openai_client.files.retrieve = AsyncMock(
+        return_value=type('MockFile', (), {'filename': 'test_document.txt'}))
     
     # Make request to fetch endpoint
     response = test_client.post("/fetch", json={"id": "file_123"})
@@ -46,6 +48,8 @@ async def test_fetch_endpoint(test_client, mock_openai_client):
     assert data["id"] == "file_123"
     assert data["title"] == "test_document.txt"
     assert "Full document content" in data["text"]
+    assert data["metadata"] == {'size': 1234}
+    mock_openai_client.files.retrieve.assert_awaited_once_with("file_123")
 
 # Test health check endpoint
 async def test_health_check(test_client):
@@ -106,3 +110,846 @@ async def test_fetch_invalid_id(test_client):
     response = test_client.post("/fetch", json={"id": "invalid_id"})
     
     assert response.status_code == 400  # Bad request
+
+async def test_search_results_are_cached(test_client, mock_openai_client, mock_search_response):
+    """Repeated, trivially different queries are served from the search cache."""
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+
+    first = test_client.post("/search", json={"query": "Test query"})
+    second = test_client.post("/search", json={"query": "  test QUERY? "})
+
+    assert first.status_code == 200
+    assert second.json()["results"] == first.json()["results"]
+    assert mock_openai_client.vector_stores.search.await_count == 1
+
+    stats = test_client.get("/cache/stats").json()["search"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+    invalidated = test_client.post("/cache/invalidate", json={})
+    assert invalidated.json()["invalidated"] == 1
+
+async def test_semantic_cache_serves_similar_query(mock_openai_client, mock_search_response):
+    """A reworded query is answered from the semantic cache without a search."""
+    from starlette.testclient import TestClient
+
+    from cache import HashingEmbedder
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    mcp = create_server(mock_openai_client, embedder=HashingEmbedder())
+
+    with TestClient(FastMCPASGIWrapper(mcp)) as client:
+        first = client.post("/search", json={"query": "how to beat the dragon boss"})
+        second = client.post("/search", json={"query": "beat dragon boss"})
+        client.post("/search", json={"query": "unlock fast travel"})
+
+        assert second.json()["results"] == first.json()["results"]
+        assert mock_openai_client.vector_stores.search.await_count == 2
+        stats = client.get("/cache/stats").json()["semantic"]
+        assert stats["hits"] == 1
+        assert stats["size"] == 2
+
+        client.post("/cache/invalidate", json={})
+        assert client.get("/cache/stats").json()["semantic"]["size"] == 0
+
+async def test_shared_cache_serves_other_workers(tmp_path, mock_openai_client, mock_search_response):
+    """A search answered by one worker is served to another from the shared tier."""
+    from starlette.testclient import TestClient
+
+    import server
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    with patch.object(server, "SHARED_STATE_PATH", str(tmp_path / "shared.sqlite3")):
+        workers = [create_server(mock_openai_client), create_server(mock_openai_client)]
+
+    with TestClient(FastMCPASGIWrapper(workers[0])) as first, \
+            TestClient(FastMCPASGIWrapper(workers[1])) as second:
+        expected = first.post("/search", json={"query": "dragon boss"}).json()["results"]
+        assert second.post("/search", json={"query": "Dragon boss?"}).json()["results"] == expected
+        assert mock_openai_client.vector_stores.search.await_count == 1
+        assert second.get("/cache/stats").json()["shared"]["hits"] == 1
+        # Promoted into the second worker's own cache
+        assert second.get("/cache/stats").json()["search"]["size"] == 1
+
+        assert second.post("/cache/invalidate", json={}).json()["invalidated"] == 1
+        assert first.get("/cache/stats").json()["shared"]["size"] == 0
+
+
+async def test_shared_cache_is_kept_per_vector_store(mock_openai_client, mock_search_response,
+                                                     tmp_path):
+    """Results cached for one vector store are never served for another."""
+    from starlette.testclient import TestClient
+
+    import server
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    with patch.object(server, "SHARED_STATE_PATH", str(tmp_path / "shared.sqlite3")):
+        old = create_server(mock_openai_client)
+        with patch.object(server, "VECTOR_STORE_ID", "vs_new"):
+            new = create_server(mock_openai_client)
+
+    with TestClient(FastMCPASGIWrapper(old)) as first, TestClient(FastMCPASGIWrapper(new)) as second:
+        first.post("/search", json={"query": "dragon boss"})
+        second.post("/search", json={"query": "dragon boss"})
+        assert mock_openai_client.vector_stores.search.await_count == 2
+        assert second.get("/cache/stats").json()["shared"]["hits"] == 0
+
+
+async def test_fetch_cancels_sibling_request_on_failure(test_client, mock_openai_client):
+    """A failed metadata request cancels the in-flight content request."""
+    import asyncio
+
+    cancelled = asyncio.Event()
+
+    async def slow_content(**kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    mock_openai_client.vector_stores.files.content = slow_content
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(side_effect=RuntimeError("boom"))
+
+    response = test_client.post("/fetch", json={"id": "file_123"})
+
+    assert response.status_code == 500
+    assert cancelled.is_set()
+
+async def test_fetch_served_from_document_store(mock_openai_client, tmp_path):
+    """Documents fetched once are served locally on later calls."""
+    from starlette.testclient import TestClient
+    from docstore import DocumentStore
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_content = type('MockContent', (), {
+        'data': [type('obj', (), {'text': 'Full document content'})]
+    })
+    mock_file_info = type('MockFileInfo', (), {'filename': 'test_document.txt'})
+    mock_openai_client.vector_stores.files.content = AsyncMock(return_value=mock_content)
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(return_value=mock_file_info)
+
+    store = DocumentStore(str(tmp_path / "documents.sqlite3"), vector_store_id="test_vs_123")
+    app = FastMCPASGIWrapper(create_server(mock_openai_client, document_store=store))
+    with TestClient(app) as client:
+        first = client.post("/fetch", json={"id": "file_123"})
+        second = client.post("/fetch", json={"id": "file_123"})
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["text"] == first.json()["text"] == "Full document content"
+    assert mock_openai_client.vector_stores.files.content.await_count == 1
+    assert store.stats()["hits"] == 1
+
+async def test_search_local_backend(mock_openai_client):
+    """The local backend answers searches from the mirrored index."""
+    from starlette.testclient import TestClient
+    from local_index import LocalIndex
+    from server import FastMCPASGIWrapper, create_server
+
+    index = LocalIndex.build([
+        {"id": "file_123", "title": "rules.txt", "text": "Rooks move in straight lines."},
+    ])
+    mock_openai_client.vector_stores.search = AsyncMock()
+    mcp = create_server(mock_openai_client, local_index=index, search_backend="local")
+    with TestClient(FastMCPASGIWrapper(mcp)) as client:
+        response = client.post("/search", json={"query": "how do rooks move"})
+
+    assert response.status_code == 200
+    assert response.json()["results"][0]["id"] == "file_123"
+    mock_openai_client.vector_stores.search.assert_not_awaited()
+
+async def test_search_batch_endpoint(test_client, mock_openai_client, mock_search_response):
+    """Batch search dedupes queries and isolates per-query errors."""
+    async def search(vector_store_id, query, max_num_results):
+        if query == "broken":
+            raise RuntimeError("upstream failed")
+        return mock_search_response
+
+    mock_openai_client.vector_stores.search = AsyncMock(side_effect=search)
+
+    response = test_client.post(
+        "/search/batch", json={"queries": ["test", "Test!", "broken", ""]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["query"] for r in results] == ["test", "Test!", "broken", ""]
+    assert results[0]["results"][0]["id"] == "file_123"
+    assert results[1]["results"] == results[0]["results"]
+    assert results[2]["error"] == "upstream failed"
+    assert results[3]["results"] == []
+    # "test" and "Test!" normalize to the same query
+    assert mock_openai_client.vector_stores.search.await_count == 2
+
+async def test_fetch_range(test_client, mock_openai_client):
+    """Fetch returns only the requested character range."""
+    mock_content = type('MockContent', (), {
+        'data': [type('obj', (), {'text': '0123456789'})]
+    })
+    mock_file_info = type('MockFileInfo', (), {'filename': 'test_document.txt'})
+    mock_openai_client.vector_stores.files.content = AsyncMock(return_value=mock_content)
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(return_value=mock_file_info)
+
+    response = test_client.post("/fetch", json={"id": "file_123", "offset": 2, "length": 3})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["text"] == "234"
+    assert data["range"] == {"offset": 2, "length": 3, "total": 10}
+
+
+async def test_fetch_stream_ndjson(test_client, mock_openai_client):
+    """Streaming fetch sends metadata, content parts and an end marker."""
+    import json
+
+    mock_content = type('MockContent', (), {
+        'data': [type('obj', (), {'text': 'first part'}), type('obj', (), {'text': 'second part'})]
+    })
+    mock_openai_client.vector_stores.files.content = AsyncMock(return_value=mock_content)
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(return_value=MagicMock(attributes=None))
+    mock_openai_client.files.retrieve = AsyncMock(
+        return_value=type('MockFile', (), {'filename': 'test_document.txt'}))
+
+    response = test_client.post("/fetch/stream", json={"id": "file_123", "offset": 6})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["type"] == "metadata"
+    assert events[0]["title"] == "test_document.txt"
+    text = "".join(e["text"] for e in events if e["type"] == "content")
+    assert text == "part\nsecond part"
+    assert events[-1] == {"type": "end", "length": len(text)}
+
+
+async def test_fetch_stream_invalid_id(test_client):
+    """Streaming fetch rejects invalid IDs before streaming starts."""
+    response = test_client.post("/fetch/stream", json={"id": "invalid_id"})
+
+    assert response.status_code == 400
+
+async def test_iter_text_range_rechunks_parts():
+    """Text parts are joined with newlines and re-chunked within the range."""
+    from server import iter_text_range
+
+    chunks = [c async for c in iter_text_range(["abcdef", "ghij"], 2, 7, 3)]
+
+    assert chunks == ["cde", "f", "\ngh"]
+
+async def test_unknown_route_returns_404(test_client):
+    """Requests that match no route in the dispatch table get a 404."""
+    assert test_client.get("/search").status_code == 404
+    assert test_client.post("/nope", json={}).status_code == 404
+
+
+async def test_tool_registry_refreshes_for_new_tools(test_client):
+    """Tools added after the registry was cached are still routable."""
+    import functools
+
+    app = test_client.app
+    assert test_client.get("/health").status_code == 200  # caches the registry
+
+    @app.mcp_server.tool()
+    async def ping() -> dict:
+        return {"pong": True}
+
+    app.routes[('GET', '/ping')] = functools.partial(app._handle_tool, 'ping')
+    response = test_client.get("/ping")
+
+    assert response.status_code == 200
+    assert response.json()["pong"] is True
+
+async def test_request_body_too_large(test_client):
+    """Bodies over MAX_BODY_SIZE are rejected with a 413."""
+    from server import MAX_BODY_SIZE
+
+    response = test_client.post("/search", content=b"x" * (MAX_BODY_SIZE + 1))
+
+    assert response.status_code == 413
+
+
+async def test_request_body_read_in_chunks(mock_openai_client, mock_search_response):
+    """A body sent in many chunks is accumulated and parsed once."""
+    import json
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    app = FastMCPASGIWrapper(create_server(mock_openai_client))
+
+    payload = json.dumps({"query": "test"}).encode()
+    messages = [
+        {"type": "http.request", "body": payload[i:i + 3], "more_body": i + 3 < len(payload)}
+        for i in range(0, len(payload), 3)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": "POST", "path": "/search", "headers": []}, receive, send)
+
+    assert sent[0]["status"] == 200
+    assert json.loads(sent[1]["body"])["results"][0]["id"] == "file_123"
+
+async def test_sse_connection_registered_until_disconnect(mock_openai_client):
+    """SSE streams are tracked by the registry and released on disconnect."""
+    import asyncio
+    from server import FastMCPASGIWrapper, create_server
+
+    app = FastMCPASGIWrapper(create_server(mock_openai_client))
+    disconnect = asyncio.Event()
+    sent = []
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/sse",
+             "headers": [(b"accept", b"text/event-stream")]}
+    task = asyncio.create_task(app(scope, receive, send))
+    await asyncio.sleep(0.01)
+
+    assert app.sse_connections.stats()["connections"] == 1
+    assert sent[0]["status"] == 200
+    assert sent[1]["body"].startswith(b"event: init")
+
+    disconnect.set()
+    await asyncio.wait_for(task, 1)
+    assert app.sse_connections.stats()["connections"] == 0
+    await app.sse_connections.close()
+
+async def test_drain_ends_sse_streams(mock_openai_client):
+    """Draining completes open SSE responses and refuses new streams."""
+    import asyncio
+    from server import FastMCPASGIWrapper, create_server
+
+    app = FastMCPASGIWrapper(create_server(mock_openai_client))
+    ended = asyncio.Event()
+    sent = []
+
+    # Like uvicorn, report a disconnect once the response is complete
+    async def receive():
+        await ended.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            ended.set()
+
+    scope = {"type": "http", "method": "GET", "path": "/sse",
+             "headers": [(b"accept", b"text/event-stream")]}
+    task = asyncio.create_task(app(scope, receive, send))
+    await asyncio.sleep(0.01)
+
+    await app.drain()
+    await asyncio.wait_for(task, 1)
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    assert app.sse_connections.stats()["connections"] == 0
+
+    sent.clear()
+    await app(scope, receive, send)
+    assert sent[0]["status"] == 503
+    await app.sse_connections.close()
+
+
+async def test_jsonrpc_initialize_and_tools_list(test_client):
+    """The root path speaks MCP JSON-RPC for initialize and tools/list."""
+    init = test_client.post("/", json={
+        "jsonrpc": "2.0", "id": 1, "method": "initialize",
+        "params": {"protocolVersion": "2025-03-26"}
+    }).json()
+    assert init["result"]["protocolVersion"] == "2025-03-26"
+    assert init["result"]["serverInfo"]["name"] == "GameBot MCP Server"
+
+    tools = test_client.post("/", json={"jsonrpc": "2.0", "id": 2, "method": "tools/list"}).json()
+    names = {tool["name"] for tool in tools["result"]["tools"]}
+    assert {"search", "search_batch", "fetch", "health_check"} <= names
+    search = next(t for t in tools["result"]["tools"] if t["name"] == "search")
+    assert search["inputSchema"]["type"] == "object"
+    assert "query" in search["inputSchema"]["properties"]
+
+    assert test_client.get("/tools").json()["result"]["tools"] == tools["result"]["tools"]
+
+
+async def test_jsonrpc_batch_tools_call(test_client, mock_openai_client, mock_search_response):
+    """Batched calls are answered together; notifications get no entry."""
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+
+    response = test_client.post("/", json=[
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        {"jsonrpc": "2.0", "id": "a", "method": "tools/call",
+         "params": {"name": "search", "arguments": {"query": "test"}}},
+        {"jsonrpc": "2.0", "id": "b", "method": "tools/call",
+         "params": {"name": "fetch", "arguments": {"id": "invalid_id"}}},
+        {"jsonrpc": "2.0", "id": "c", "method": "tools/call", "params": {"name": "missing"}},
+        {"jsonrpc": "2.0", "id": "d", "method": "no/such/method"},
+    ])
+
+    assert response.status_code == 200
+    by_id = {entry["id"]: entry for entry in response.json()}
+    assert set(by_id) == {"a", "b", "c", "d"}
+    assert by_id["a"]["result"]["isError"] is False
+    assert by_id["a"]["result"]["structuredContent"]["results"][0]["id"] == "file_123"
+    assert by_id["b"]["result"]["isError"] is True
+    assert by_id["c"]["error"]["code"] == -32602
+    assert by_id["d"]["error"]["code"] == -32601
+
+
+async def test_jsonrpc_notification_only(test_client):
+    """A request made only of notifications is accepted with no body."""
+    response = test_client.post("/", json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    assert response.status_code == 202
+    assert response.content == b""
+
+
+async def test_lifespan_opens_and_closes_upstream_pool(mock_openai_client):
+    """The server and its upstream pool are built on startup and closed on shutdown."""
+    from starlette.testclient import TestClient
+    import server
+    from server import FastMCPASGIWrapper
+
+    app = FastMCPASGIWrapper(lifespan=server.server_lifespan)
+    assert app.mcp_server is None
+
+    with TestClient(app) as client:
+        transport = app.mcp_server.upstream_transport
+        http_client = transport.client
+        assert server.AsyncOpenAI.call_args.kwargs["http_client"] is http_client
+        assert server.AsyncOpenAI.call_args.kwargs["timeout"] == http_client.timeout
+
+        assert client.get("/health").status_code == 200
+        stats = client.get("/stats/upstream").json()
+        assert stats["upstream"]["open"] is True
+        assert stats["upstream"]["max_connections"] == server.UPSTREAM_MAX_CONNECTIONS
+
+    assert app.mcp_server is None
+    assert http_client.is_closed
+
+
+async def test_import_defers_heavy_dependencies():
+    """Importing the module loads neither fastmcp nor openai and needs no vector store."""
+    import json
+    import os
+    import subprocess
+    import sys
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    env = {key: value for key, value in os.environ.items() if key != "VECTOR_STORE_ID"}
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import json, sys, server; "
+         "print(json.dumps([m for m in ('fastmcp', 'openai', 'fastapi') if m in sys.modules]))"],
+        cwd=root, env=env, capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+
+async def test_lifespan_requires_vector_store_id(mock_openai_client):
+    """A missing VECTOR_STORE_ID fails startup instead of the import."""
+    import server
+
+    with patch.object(server, "VECTOR_STORE_ID", ""):
+        with pytest.raises(ValueError, match="Vector Store ID"):
+            async with server.server_lifespan():
+                pass
+
+
+async def test_server_built_on_first_request_without_lifespan(mock_openai_client):
+    """ASGI servers that skip lifespan events still get a server on first request."""
+    import contextlib
+    from starlette.testclient import TestClient
+    from server import FastMCPASGIWrapper, create_server
+
+    @contextlib.asynccontextmanager
+    async def lifespan():
+        yield create_server(mock_openai_client)
+
+    app = FastMCPASGIWrapper(lifespan=lifespan)
+    client = TestClient(app)  # not entered, so no lifespan events are sent
+
+    assert client.get("/health").status_code == 200
+    assert app.mcp_server is not None
+    assert client.get("/stats/upstream").json()["upstream"] is None
+
+
+async def test_upstream_calls_go_through_policies(test_client, mock_openai_client, mock_search_response):
+    """Search and fetch upstream calls are counted by their hedging policies."""
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    mock_openai_client.vector_stores.files.content = AsyncMock(
+        return_value=MagicMock(data=[MagicMock(text="body")]))
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(
+        return_value=MagicMock(filename="doc.txt", attributes=None))
+
+    assert test_client.post("/search", json={"query": "policy"}).status_code == 200
+    assert test_client.post("/fetch", json={"id": "file_policy"}).status_code == 200
+
+    policies = test_client.get("/stats/upstream").json()["policies"]
+    assert policies["search"]["calls"] == 1
+    assert policies["fetch"]["calls"] == 1
+    assert policies["search"]["hedges"] == 0
+
+
+async def test_search_serves_stale_results_when_upstream_fails(test_client, mock_openai_client,
+                                                                mock_search_response):
+    """Expired cached results are returned, marked stale, while the upstream errors."""
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    fresh = test_client.post("/search", json={"query": "stale test"}).json()
+
+    # Expire the cached entry without waiting out its TTL
+    search_cache = test_client.app.mcp_server.search_cache
+    for key, (_, value) in list(search_cache._data.items()):
+        search_cache._data[key] = (time.monotonic() - 1, value)
+    mock_openai_client.vector_stores.search = AsyncMock(side_effect=Exception("upstream down"))
+
+    response = test_client.post("/search", json={"query": "stale test"}).json()
+    assert response["stale"] is True
+    assert response["results"] == fresh["results"]
+
+    missing = test_client.post("/search", json={"query": "never searched"}).json()
+    assert missing["results"] == []
+    assert "upstream down" in missing["error"]
+
+
+async def test_open_circuit_fails_fetch_fast(test_client, mock_openai_client):
+    """Once the fetch circuit is open, fetches fail with a 503 without calling upstream."""
+    mock_openai_client.vector_stores.files.content = AsyncMock(side_effect=Exception("upstream down"))
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(side_effect=Exception("upstream down"))
+    breaker = test_client.app.mcp_server.upstream_policies["fetch"].breaker
+
+    for i in range(breaker.min_calls):
+        assert test_client.post("/fetch", json={"id": f"file_{i}"}).status_code == 500
+    assert breaker.state == "open"
+
+    calls = mock_openai_client.vector_stores.files.content.await_count
+    response = test_client.post("/fetch", json={"id": "file_next"})
+    assert response.status_code == 503
+    assert mock_openai_client.vector_stores.files.content.await_count == calls
+    circuit = test_client.get("/stats/upstream").json()["policies"]["fetch"]["circuit"]
+    assert circuit["state"] == "open"
+    assert circuit["rejected"] == 1
+
+
+async def test_fetch_stream_uses_policy_and_serves_stale_copy(mock_openai_client, tmp_path):
+    """Streaming fetch goes through the fetch policy and falls back to an expired stored copy."""
+    import json
+    from starlette.testclient import TestClient
+    from docstore import DocumentStore
+    from server import FastMCPASGIWrapper, create_server
+
+    path = str(tmp_path / "documents.sqlite3")
+    DocumentStore(path, vector_store_id="test_vs_123").put(
+        {"id": "file_123", "title": "rules.txt", "text": "Stored content", "url": None, "metadata": None})
+    mock_openai_client.vector_stores.files.content = AsyncMock(side_effect=Exception("upstream down"))
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(side_effect=Exception("upstream down"))
+
+    store = DocumentStore(path, vector_store_id="test_vs_123", max_age=1e-9)
+    mcp = create_server(mock_openai_client, document_store=store)
+    with TestClient(FastMCPASGIWrapper(mcp)) as client:
+        response = client.post("/fetch/stream", json={"id": "file_123"})
+        missing = client.post("/fetch/stream", json={"id": "file_456"})
+
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["stale"] is True
+    assert "".join(e["text"] for e in events if e["type"] == "content") == "Stored content"
+    assert missing.status_code == 500
+    assert mcp.upstream_policies["fetch"].stats()["calls"] == 2
+
+
+async def test_admission_rejects_over_limit_clients(test_client, mock_openai_client,
+                                                    mock_search_response, monkeypatch):
+    """Requests over a client's rate get a 429 with Retry-After; health is never throttled."""
+    import server
+    from admission import AdmissionBudget, AdmissionController
+    monkeypatch.setattr(server, "ADMISSION_KEY_DIGESTS", frozenset([server._key_digest(b"known")]))
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    app = test_client.app
+    app.admission = AdmissionController(10, {
+        "search": AdmissionBudget(10, rate=0.5, burst=1),
+        "fetch": AdmissionBudget(10),
+        "rpc": AdmissionBudget(10),
+    }, queue_timeout=0.0)
+
+    assert test_client.post("/search", json={"query": "one"}).status_code == 200
+    response = test_client.post("/search", json={"query": "two"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert response.json()["error"] == "rate limit exceeded"
+
+    # An unknown API key does not escape the IP's bucket, a known one has its own
+    unknown = test_client.post("/search", json={"query": "two"}, headers={"x-api-key": "random"})
+    assert unknown.status_code == 429
+    known = test_client.post("/search", json={"query": "two"},
+                             headers={"authorization": "Bearer known"})
+    assert known.status_code == 200
+    for _ in range(3):
+        assert test_client.get("/health").status_code == 200
+
+    stats = test_client.get("/stats/admission").json()["admission"]
+    assert stats["classes"]["search"]["rejected"]["rate"] == 2
+    assert stats["global"]["inflight"] == 0
+    metrics = test_client.get("/metrics").text
+    assert 'gamebot_http_stage_duration_seconds_count{route="POST /search",stage="admission"} 2' in metrics
+
+
+async def test_admission_charges_each_call_and_query(test_client, mock_openai_client,
+                                                     mock_search_response):
+    """Batch queries and JSON-RPC tool calls each cost a token of the tool's budget."""
+    import server
+    from admission import AdmissionBudget, AdmissionController
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    app = test_client.app
+    app.admission = AdmissionController(10, {
+        "search": AdmissionBudget(10, rate=0.1, burst=3),
+        "fetch": AdmissionBudget(10),
+        "rpc": AdmissionBudget(10, rate=0.1, burst=1),
+    }, queue_timeout=0.0)
+
+    assert test_client.post("/search/batch", json={"queries": ["a", "b"]}).status_code == 200
+    # Two more queries do not fit in the one token left
+    response = test_client.post("/search/batch", json={"queries": ["c", "d"]})
+    assert response.status_code == 429
+
+    response = test_client.post("/", json=[
+        {"jsonrpc": "2.0", "id": i, "method": "tools/call",
+         "params": {"name": "search", "arguments": {"query": f"q{i}"}}}
+        for i in range(2)
+    ] + [{"jsonrpc": "2.0", "id": "ping", "method": "ping"}])
+    by_id = {entry["id"]: entry for entry in response.json()}
+    results = [by_id[i] for i in range(2)]
+    assert sum("result" in entry for entry in results) == 1
+    [rejected] = [entry for entry in results if "error" in entry]
+    assert rejected["error"]["code"] == server.RPC_RATE_LIMITED
+    assert rejected["error"]["data"]["retry_after"] > 0
+    # Other methods are charged to the separate rpc budget
+    assert "result" in by_id["ping"]
+
+    # A single rejected message gets a 429
+    response = test_client.post("/", json={"jsonrpc": "2.0", "id": 1, "method": "ping"})
+    assert response.status_code == 429
+    assert response.json()["error"]["code"] == server.RPC_RATE_LIMITED
+    assert "retry-after" in response.headers
+
+
+async def test_client_key_uses_trusted_forwarded_hop(monkeypatch):
+    """Only the X-Forwarded-For entry added by a trusted proxy identifies the client."""
+    import server
+    from server import FastMCPASGIWrapper
+
+    def scope(*forwarded):
+        return {'client': ('10.0.0.1', 1234),
+                'headers': [(b'x-forwarded-for', value.encode()) for value in forwarded]}
+
+    key = FastMCPASGIWrapper._client_key
+    assert key(scope("1.2.3.4, 5.6.7.8")) == 'ip:10.0.0.1'
+    monkeypatch.setattr(server, "FORWARDED_TRUSTED_HOPS", 1)
+    # The client's own entries are ignored, however many it sends
+    assert key(scope("1.2.3.4, 5.6.7.8")) == 'ip:5.6.7.8'
+    assert key(scope("9.9.9.9", "5.6.7.8")) == 'ip:5.6.7.8'
+    assert key(scope()) == 'ip:10.0.0.1'
+    monkeypatch.setattr(server, "FORWARDED_TRUSTED_HOPS", 2)
+    assert key(scope("1.2.3.4, 5.6.7.8, 172.16.0.2")) == 'ip:5.6.7.8'
+    assert key(scope("172.16.0.2")) == 'ip:10.0.0.1'
+
+
+async def test_search_snippet_shows_matched_passage(test_client, mock_openai_client):
+    """Search snippets come from the matching chunk, not the first 500 characters."""
+    from types import SimpleNamespace
+
+    filler = "Unrelated introduction text. " * 40
+    item = SimpleNamespace(file_id="file_123", filename="rules.txt", content=[
+        SimpleNamespace(type="text", text=filler),
+        SimpleNamespace(type="text", text=filler + "En passant captures a pawn that moved two squares."),
+    ])
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=SimpleNamespace(data=[item]))
+
+    response = test_client.post("/search", json={"query": "en passant"})
+
+    text = response.json()["results"][0]["text"]
+    assert "**En** **passant** captures a pawn" in text
+
+
+async def test_search_overfetches_and_dedupes_by_file(test_client, mock_openai_client):
+    """Several chunks of one file are merged so distinct files fill the results."""
+    from types import SimpleNamespace
+    import server
+
+    def chunk(file_id, text, score):
+        return SimpleNamespace(file_id=file_id, filename=f"{file_id}.txt", score=score,
+                               content=[SimpleNamespace(type="text", text=text)])
+
+    data = [chunk("file_a", "castling rules part one", 0.9),
+            chunk("file_a", "castling rules part two", 0.8),
+            chunk("file_b", "castling in tournaments", 0.7)]
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=SimpleNamespace(data=data))
+
+    results = test_client.post("/search", json={"query": "castling"}).json()["results"]
+
+    assert [r["id"] for r in results] == ["file_a", "file_b"]
+    assert "part two" in results[0]["text"]
+    limit = mock_openai_client.vector_stores.search.call_args.kwargs["max_num_results"]
+    assert limit == max(server.SEARCH_RESULT_LIMIT, server.SEARCH_UPSTREAM_LIMIT)
+
+async def test_metrics_endpoint(test_client, mock_openai_client, mock_search_response):
+    """/metrics exposes request, stage, cache and upstream metrics as Prometheus text."""
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    test_client.post("/search", json={"query": "test"})
+    test_client.post("/search", json={"query": "test"})
+    test_client.get("/missing")
+
+    response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'gamebot_http_requests_total{route="POST /search",status="200"} 2.0' in text
+    assert 'gamebot_http_requests_total{route="unmatched",status="404"} 1.0' in text
+    # No "admission" stage: admission control is off by default
+    for stage in ("parse", "handler", "encode"):
+        assert f'gamebot_http_stage_duration_seconds_count{{route="POST /search",stage="{stage}"}} 2' in text
+    assert 'gamebot_tool_stage_duration_seconds_count{tool="search",stage="backend"} 1' in text
+    assert 'gamebot_cache_lookups_total{cache="search",result="hit"} 1' in text
+    assert 'gamebot_upstream_calls_total{endpoint="search"} 1' in text
+    assert 'gamebot_circuit_state{endpoint="search"} 0' in text
+    assert "gamebot_sse_connections 0" in text
+
+async def test_slow_requests_route(test_client, mock_openai_client, mock_search_response, tmp_path):
+    """A request sent with the profiling token is traced and listed when slow."""
+    from profiling import RequestProfiler
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    test_client.app.profiler = RequestProfiler(slow_threshold=0.0, directory=str(tmp_path),
+                                               token="secret")
+    headers = {"x-profile-token": "secret"}
+
+    test_client.post("/search", json={"query": "test"}, headers=headers)
+    test_client.post("/search", json={"query": "untraced"})
+
+    assert test_client.get("/debug/slow-requests").status_code == 403
+    response = test_client.get("/debug/slow-requests", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    # The traced search and this request, which also carries the token
+    assert data["profiling"]["profiled"] == 2
+    [entry] = [r for r in data["requests"] if r["route"] == "POST /search"]
+    assert entry["status"] == 200
+    spans = [span["name"] for span in entry["spans"]]
+    for name in ("parse", "upstream.search", "search.backend", "search.shape",
+                 "encode", "handler"):
+        assert name in spans
+    assert (tmp_path / entry["profile"]).exists()
+
+async def test_slow_requests_route_when_disabled(test_client):
+    """Without PROFILING_ENABLED the admin route reports profiling as off."""
+    assert test_client.get("/debug/slow-requests").status_code == 404
+
+
+def mock_document(mock_openai_client, text="Full document content"):
+    mock_openai_client.vector_stores.files.content = AsyncMock(return_value=type(
+        'MockContent', (), {'data': [type('obj', (), {'text': text})]}))
+    mock_openai_client.vector_stores.files.retrieve = AsyncMock(return_value=type(
+        'MockFileInfo', (), {'filename': 'test_document.txt', 'attributes': None}))
+
+
+async def test_search_prefetches_top_documents(mock_openai_client, mock_search_response):
+    """Documents in search results are fetched in the background and served locally."""
+    from starlette.testclient import TestClient
+
+    import server
+    from server import FastMCPASGIWrapper, create_server
+
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    mock_document(mock_openai_client)
+    with patch.object(server, "PREFETCH_ENABLED", True):
+        mcp = create_server(mock_openai_client)
+
+    with TestClient(FastMCPASGIWrapper(mcp)) as client:
+        client.post("/search", json={"query": "dragon boss"})
+        for _ in range(100):
+            if client.get("/cache/stats").json()["prefetch"]["fetched"]:
+                break
+            time.sleep(0.01)
+
+        response = client.post("/fetch", json={"id": "file_123"})
+        assert response.json()["text"] == "Full document content"
+        assert mock_openai_client.vector_stores.files.content.await_count == 1
+        assert client.get("/cache/stats").json()["document_cache"]["hits"] == 1
+
+        # Already prefetched, so a repeated search schedules nothing new
+        client.post("/search", json={"query": "dragon boss"})
+        assert client.get("/cache/stats").json()["prefetch"]["skipped"] == 1
+
+
+async def test_lifespan_warms_caches_from_query_log(tmp_path, mock_openai_client, mock_search_response):
+    """Startup replays logged queries and fetches their top documents."""
+    import json
+
+    import server
+
+    log = tmp_path / "requests.jsonl"
+    log.write_text("\n".join(json.dumps(record) for record in [
+        {"query": "dragon boss"},
+        {"params": {"name": "search", "arguments": {"query": "Dragon boss?"}}},
+        {"arguments": {"queries": ["fast travel"]}},
+    ]))
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    mock_document(mock_openai_client)
+
+    with patch.object(server, "WARMUP_FILE", str(log)):
+        async with server.server_lifespan() as mcp:
+            assert mock_openai_client.vector_stores.search.await_count == 2
+            assert mock_openai_client.vector_stores.files.content.await_count == 1
+            assert len(mcp.search_cache) == 2
+            assert "file_123" in mcp.document_cache
+
+
+async def test_warm_up_instance_runs_once_for_all_workers(tmp_path, mock_openai_client,
+                                                         mock_search_response):
+    """The runner's warm-up fills the shared tiers; workers skip theirs only if both persist."""
+    import json
+
+    import server
+
+    log = tmp_path / "requests.jsonl"
+    log.write_text(json.dumps({"query": "dragon boss"}))
+    mock_openai_client.vector_stores.search = AsyncMock(return_value=mock_search_response)
+    mock_document(mock_openai_client)
+
+    with patch.object(server, "WARMUP_FILE", str(log)):
+        assert not await server.warm_up_instance()
+        with patch.object(server, "SHARED_STATE_PATH", str(tmp_path / "shared.sqlite3")):
+            # Without a document store the fetches would be lost, so only the
+            # searches are warmed and the workers still warm themselves
+            assert not await server.warm_up_instance()
+            assert mock_openai_client.vector_stores.search.await_count == 1
+            assert mock_openai_client.vector_stores.files.content.await_count == 0
+
+            with patch.object(server, "DOCUMENT_STORE_PATH", str(tmp_path / "documents.sqlite3")):
+                assert await server.warm_up_instance()
+                assert mock_openai_client.vector_stores.files.content.await_count == 1
+                with patch.object(server, "WARMUP_ON_STARTUP", False):
+                    async with server.server_lifespan() as mcp:
+                        assert mock_openai_client.vector_stores.search.await_count == 1
+                        assert len(mcp.shared_cache) == 1
+                        assert mcp.document_store.contains("file_123")
+
+
+async def test_failed_warm_up_does_not_block_startup(tmp_path, mock_openai_client):
+    """A missing query log is logged and the server starts cold."""
+    import server
+
+    with patch.object(server, "WARMUP_FILE", str(tmp_path / "missing.jsonl")):
+        async with server.server_lifespan() as mcp:
+            assert len(mcp.search_cache) == 0
@@ -0,0 +1,99 @@
+"""Unit tests for the state shared between workers."""
+import time
+
+import pytest
+
+from admission import AdmissionBudget, AdmissionController, AdmissionRejected
+from shared import SharedCache, SharedDatabase, SharedRateLimiter
+
+
+def make_cache(path, **kwargs):
+    return SharedCache(SharedDatabase(path), "search", **kwargs)
+
+
+def test_shared_cache_round_trip_across_workers(tmp_path):
+    """Values written by one worker are read by another, per namespace."""
+    path = str(tmp_path / "shared.sqlite3")
+    writer = make_cache(path)
+    writer.set(("vs_1", "rook moves", 5), {"results": [{"id": "file_1"}]})
+
+    reader = make_cache(path)
+    assert reader.get(("vs_1", "rook moves", 5)) == {"results": [{"id": "file_1"}]}
+    assert reader.get(("vs_1", "bishop moves", 5)) is None
+    assert SharedCache(SharedDatabase(path), "other").get(("vs_1", "rook moves", 5)) is None
+    assert reader.stats()["hits"] == 1
+    assert reader.stats()["misses"] == 1
+    assert len(reader) == 1
+
+
+def test_shared_cache_expiry_stale_and_invalidate(tmp_path):
+    """Expired entries are misses but served by get_stale until the stale TTL passes."""
+    cache = make_cache(str(tmp_path / "shared.sqlite3"), ttl=0.05, stale_ttl=60)
+    cache.set("a", {"results": []})
+    cache.set("b", {"results": []}, ttl=0)
+    time.sleep(0.06)
+
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == {"results": []}
+    assert cache.stats()["stale_hits"] == 1
+    assert cache.invalidate("a") == 1
+    assert cache.get_stale("a") is None
+    assert cache.invalidate() == 1
+
+
+def test_shared_cache_sweep_evicts_least_recently_used(tmp_path):
+    """A sweep drops expired entries and trims the rest to maxsize."""
+    cache = make_cache(str(tmp_path / "shared.sqlite3"), maxsize=2, stale_ttl=0)
+    cache.set("expired", 1, ttl=-1)
+    for key in ("old", "mid", "new"):
+        cache.set(key, key)
+        time.sleep(0.01)
+
+    assert cache.sweep() == 2
+    assert cache.get("old") is None
+    assert cache.get("mid") == "mid" and cache.get("new") == "new"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_rate_limiter_bucket_is_shared(tmp_path):
+    """Tokens taken through one worker's limiter are gone for the others."""
+    path = str(tmp_path / "shared.sqlite3")
+    first = SharedRateLimiter(SharedDatabase(path))
+    second = SharedRateLimiter(SharedDatabase(path))
+
+    assert first.reserve("search:a", rate=1.0, burst=2, max_wait=0) == (0.0, 0.0)
+    wait, _ = second.reserve("search:a", rate=1.0, burst=2, max_wait=0)
+    assert wait == 0.0
+    wait, retry_after = first.reserve("search:a", rate=1.0, burst=2, max_wait=0)
+    assert wait is None and 0.9 < retry_after <= 1.0
+    assert second.reserve("search:b", rate=1.0, burst=2, max_wait=0)[0] == 0.0
+    assert first.stats()["clients"] == 2
+
+
+def test_rate_limiter_refund_returns_a_token(tmp_path):
+    """A refunded token can be taken again, but never beyond the burst."""
+    limiter = SharedRateLimiter(SharedDatabase(str(tmp_path / "shared.sqlite3")))
+
+    assert limiter.reserve("search:a", rate=0.1, burst=1, max_wait=0)[0] == 0.0
+    assert limiter.reserve("search:a", rate=0.1, burst=1, max_wait=0)[0] is None
+    limiter.refund("search:a", rate=0.1, burst=1)
+    limiter.refund("search:a", rate=0.1, burst=1)
+    assert limiter.reserve("search:a", rate=0.1, burst=1, max_wait=0)[0] == 0.0
+    assert limiter.reserve("search:a", rate=0.1, burst=1, max_wait=0)[0] is None
+
+
+@pytest.mark.asyncio
+async def test_admission_controllers_share_rate_limits(tmp_path):
+    """Two workers' admission controllers enforce one rate per client."""
+    path = str(tmp_path / "shared.sqlite3")
+
+    def controller():
+        return AdmissionController(10, {"search": AdmissionBudget(10, rate=1.0, burst=1)},
+                                   queue_timeout=0.0,
+                                   shared_buckets=SharedRateLimiter(SharedDatabase(path)))
+
+    first, second = controller(), controller()
+    first.release(await first.acquire("search", "a"))
+    with pytest.raises(AdmissionRejected):
+        await second.acquire("search", "a")
+    assert second.stats()["shared_buckets"] is True
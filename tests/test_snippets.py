@@ -0,0 +1,52 @@
+"""Unit tests for query-aware snippet extraction."""
+from snippets import extract_snippet, truncate_bytes
+
+FILLER = " ".join(["the board game has many levels and players"] * 40)
+
+
+def test_snippet_finds_passage_in_later_chunk():
+    """The best passage is found even when it is not in the first chunk."""
+    texts = [FILLER, FILLER + " To castle, the king moves two squares toward a rook. " + FILLER]
+
+    snippet = extract_snippet("how does the king castle", texts, budget=200)
+
+    assert "**king**" in snippet
+    assert "**castle**" in snippet
+    assert "**the**" not in snippet  # stopwords are not highlighted
+    assert snippet.startswith("...") and snippet.endswith("...")
+    assert len(snippet.replace("**", "").encode("utf-8")) <= 200
+
+
+def test_snippet_prefers_windows_with_more_distinct_terms():
+    """A window matching several terms beats one repeating a single term."""
+    text = ("rook " * 30) + FILLER + " The rook can castle with the king. " + FILLER
+
+    snippet = extract_snippet("rook castle king", [text], budget=120, highlight="")
+
+    assert "The rook can castle with the king." in snippet
+    assert "**" not in snippet
+
+
+def test_snippet_combines_passages_within_budget():
+    """Separate matches are joined in document order while they fit the budget."""
+    text = "Rooks move in straight lines. " + FILLER + " Bishops move diagonally. " + FILLER
+
+    snippet = extract_snippet("rooks bishops", [text], budget=300, highlight="")
+
+    assert snippet.index("Rooks") < snippet.index("Bishops")
+    assert len(snippet.encode("utf-8")) <= 300
+
+
+def test_snippet_without_matches_falls_back_to_start():
+    """Without any matching term the start of the first chunk is used."""
+    assert extract_snippet("zebra", ["short text"], budget=100) == "short text"
+    snippet = extract_snippet("zebra", [FILLER], budget=100)
+    assert snippet.startswith("the board game") and snippet.endswith("...")
+    assert len(snippet.encode("utf-8")) <= 100
+    assert extract_snippet("zebra", []) == ""
+
+
+def test_truncate_bytes_respects_multibyte_characters():
+    """Truncation never splits a UTF-8 character."""
+    assert truncate_bytes("héllo wörld", 8) == "héllo"
+    assert truncate_bytes("ééééé", 5) == "éé"
@@ -0,0 +1,69 @@
+"""Unit tests for the shared SSE keepalive registry."""
+import asyncio
+
+import pytest
+
+from sse import KEEPALIVE_FRAME, ConnectionRegistry, TooManyConnections
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_registry_sends_keepalives_from_one_timer():
+    """Every registered connection gets a keepalive once per interval."""
+    registry = ConnectionRegistry(interval=0.05, slots=5)
+    received = {1: [], 2: []}
+
+    def sender(key):
+        async def send(message):
+            received[key].append(message['body'])
+        return send
+
+    registry.register(sender(1))
+    registry.register(sender(2))
+    await asyncio.sleep(0.13)
+    await registry.close()
+
+    assert received[1] and received[2]
+    assert set(received[1] + received[2]) == {KEEPALIVE_FRAME}
+    assert registry.stats()["connections"] == 0
+
+
+async def test_registry_drops_dead_connections_and_enforces_cap():
+    """A failed keepalive unregisters the connection; the cap rejects extras."""
+    registry = ConnectionRegistry(interval=0.02, max_connections=1, slots=2)
+
+    async def broken_send(message):
+        raise OSError("connection reset")
+
+    registry.register(broken_send)
+    with pytest.raises(TooManyConnections):
+        registry.register(broken_send)
+
+    await asyncio.sleep(0.05)
+    stats = registry.stats()
+    assert stats["connections"] == 0
+    assert stats["send_failures"] == 1
+    assert stats["rejected"] == 1
+    await registry.close()
+
+
+async def test_registry_drops_stalled_client_without_stalling_others():
+    """A send that never completes times out instead of holding up the wheel."""
+    registry = ConnectionRegistry(interval=0.04, slots=1)
+    received = []
+
+    async def stalled_send(message):
+        await asyncio.Event().wait()
+
+    async def send(message):
+        received.append(message['body'])
+
+    registry.register(stalled_send)
+    registry.register(send)
+    await asyncio.sleep(0.15)
+    stats = registry.stats()
+    await registry.close()
+
+    assert stats["connections"] == 1
+    assert stats["send_timeouts"] == 1
+    assert len(received) >= 2
@@ -0,0 +1,245 @@
+"""Unit tests for the pooled upstream HTTP transport."""
+import asyncio
+
+import pytest
+
+import upstream
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamPolicy, UpstreamTransport
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _serve_ok(reader, writer):
+    """Minimal keep-alive HTTP/1.1 server answering every request with 200."""
+    try:
+        while await reader.readuntil(b"\r\n\r\n"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def test_transport_applies_limits_and_timeouts():
+    """Pool limits and the separate timeouts are set on the client."""
+    transport = UpstreamTransport(max_connections=7, max_keepalive_connections=3,
+                                  keepalive_expiry=12.0, http2=False, connect_timeout=1.0,
+                                  read_timeout=2.0, write_timeout=3.0, pool_timeout=4.0)
+    async with transport as client:
+        assert client.timeout.connect == 1.0
+        assert client.timeout.read == 2.0
+        assert client.timeout.write == 3.0
+        assert client.timeout.pool == 4.0
+        stats = transport.stats()
+        assert stats["open"] is True
+        assert stats["max_connections"] == 7
+        assert stats["max_keepalive_connections"] == 3
+        assert stats["keepalive_expiry"] == 12.0
+
+    assert transport.client is None
+    assert transport.stats()["open"] is False
+
+
+async def test_http2_falls_back_without_h2(monkeypatch):
+    """Requesting HTTP/2 without the h2 package uses HTTP/1.1 instead of failing."""
+    monkeypatch.setattr(upstream, "http2_available", lambda: False)
+
+    assert UpstreamTransport(http2=True).http2 is False
+    assert UpstreamTransport(http2=None).http2 is False
+
+
+async def test_stats_report_pooled_connections():
+    """A finished request leaves one idle keep-alive connection in the pool."""
+    server = await asyncio.start_server(_serve_ok, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    transport = UpstreamTransport(http2=False)
+    try:
+        async with transport as client:
+            for _ in range(3):
+                response = await client.get(f"http://127.0.0.1:{port}/")
+                assert response.text == "ok"
+
+            stats = transport.stats()
+            assert stats["connections"] == 1
+            assert stats["idle"] == 1
+            assert stats["active"] == 0
+            assert stats["waiting"] == 0
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def _warm(policy, seconds=0.01, samples=20):
+    for _ in range(samples):
+        policy.latency.observe(seconds)
+
+
+async def test_policy_does_not_hedge_without_samples():
+    """Without enough latency samples calls are neither hedged nor tightly timed out."""
+    policy = UpstreamPolicy("test", min_samples=20, max_timeout=30.0)
+
+    async def fn():
+        return "ok"
+
+    assert await policy.call(fn) == "ok"
+    assert policy.hedge_delay() is None
+    assert policy.timeout() == 30.0
+    assert policy.stats()["hedges"] == 0
+
+
+async def test_policy_hedges_slow_call():
+    """A call slower than the hedge quantile gets a duplicate that wins."""
+    policy = UpstreamPolicy("test", hedge_budget=1.0, min_hedge_delay=0.01)
+    _warm(policy, 0.01)
+    attempts = []
+
+    async def fn():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            await asyncio.sleep(5)
+            return "slow"
+        return "fast"
+
+    assert await policy.call(fn) == "fast"
+    assert len(attempts) == 2
+    stats = policy.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+async def test_policy_hedge_budget_limits_duplicates():
+    """Hedges are capped at the budgeted fraction of calls."""
+    policy = UpstreamPolicy("test", hedge_budget=0.25, min_hedge_delay=0.001)
+    _warm(policy, 0.001, samples=1000)
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    for _ in range(8):
+        await policy.call(fn)
+
+    assert policy.stats()["hedges"] == 2
+
+
+async def test_policy_uses_surviving_attempt_after_failure():
+    """If the first attempt fails after hedging, the hedge's result is used."""
+    policy = UpstreamPolicy("test", hedge_budget=1.0, min_hedge_delay=0.01)
+    _warm(policy, 0.01)
+    attempts = []
+
+    async def fn():
+        attempts.append(None)
+        if len(attempts) == 1:
+            await asyncio.sleep(0.03)
+            raise RuntimeError("boom")
+        await asyncio.sleep(0.05)
+        return "hedge"
+
+    assert await policy.call(fn) == "hedge"
+    assert policy.stats()["errors"] == 0
+
+
+async def test_policy_adaptive_timeout():
+    """The timeout follows p99 latency within the configured bounds."""
+    policy = UpstreamPolicy("test", hedge_budget=0.0, timeout_multiplier=3.0,
+                            min_timeout=0.05, max_timeout=1.0)
+    _warm(policy, 0.02)
+    assert policy.timeout() == pytest.approx(0.06)
+
+    async def fn():
+        await asyncio.sleep(5)
+
+    with pytest.raises(TimeoutError):
+        await policy.call(fn)
+    assert policy.stats()["timeouts"] == 1
+
+    _warm(policy, 10.0, samples=1000)
+    assert policy.timeout() == 1.0
+
+
+async def test_policy_counts_attempt_timeout_as_error():
+    """A TimeoutError raised by the call itself is an error, not a policy timeout."""
+    policy = UpstreamPolicy("test", hedge_budget=0.0, max_timeout=1.0)
+
+    async def fn():
+        raise TimeoutError("read timed out")
+
+    with pytest.raises(TimeoutError):
+        await policy.call(fn)
+    stats = policy.stats()
+    assert stats["errors"] == 1
+    assert stats["timeouts"] == 0
+    assert len(policy.latency) == 0
+
+
+async def test_breaker_opens_on_error_rate_and_recovers():
+    """The circuit opens on errors, fails fast, then closes after good trials."""
+    breaker = CircuitBreaker("test", window=10, min_calls=4, failure_rate=0.5,
+                             open_seconds=0.05, half_open_calls=2)
+    policy = UpstreamPolicy("test", hedge_budget=0.0, breaker=breaker)
+    healthy = False
+
+    async def fn():
+        if not healthy:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            await policy.call(fn)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError) as excinfo:
+        await policy.call(fn)
+    assert excinfo.value.status_code == 503
+    assert breaker.stats()["rejected"] == 1
+
+    await asyncio.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    healthy = True
+    assert await policy.call(fn) == "ok"
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert await policy.call(fn) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+async def test_breaker_reopens_on_failed_trial():
+    """A failed half-open trial opens the circuit again."""
+    breaker = CircuitBreaker("test", min_calls=1, open_seconds=0.01)
+    breaker.record(False)
+    await asyncio.sleep(0.02)
+
+    breaker.before_call()
+    breaker.record(False)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+async def test_breaker_opens_on_slow_calls():
+    """Successful but slow calls count against the slow-call rate."""
+    breaker = CircuitBreaker("test", min_calls=3, slow_call_duration=1.0, slow_call_rate=0.6)
+    breaker.record(True, 2.0)
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(True, 2.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+async def test_breaker_ignores_client_errors():
+    """4xx responses such as an unknown file ID do not open the circuit."""
+    class NotFound(Exception):
+        status_code = 404
+
+    breaker = CircuitBreaker("test", min_calls=2, failure_rate=0.5)
+    policy = UpstreamPolicy("test", hedge_budget=0.0, breaker=breaker)
+
+    async def fn():
+        raise NotFound()
+
+    for _ in range(5):
+        with pytest.raises(NotFound):
+            await policy.call(fn)
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,66 @@
+"""Unit tests for the cache warm-up."""
+import json
+
+import pytest
+
+from warmup import extract_queries, load_queries, warm_up
+
+
+def test_extract_queries_from_log_records():
+    """Queries are found at the top level, in tool arguments and in batches."""
+    assert extract_queries({"query": "rook moves"}) == ["rook moves"]
+    assert extract_queries({"arguments": {"query": "rook moves"}}) == ["rook moves"]
+    assert extract_queries({"method": "tools/call",
+                            "params": {"name": "search", "arguments": {"query": "castling"}}}) == ["castling"]
+    assert extract_queries({"queries": ["a", "b", 3]}) == ["a", "b"]
+    assert extract_queries({"q": "en passant"}, field="q") == ["en passant"]
+    assert extract_queries([{"query": "a"}, {"query": "b"}]) == ["a", "b"]
+    assert extract_queries({"id": "file_1"}) == []
+
+
+def test_load_queries_ranks_by_frequency(tmp_path):
+    """The most frequent normalized queries come first; bad lines are skipped."""
+    log = tmp_path / "requests.jsonl"
+    log.write_text("\n".join([
+        json.dumps({"query": "castling"}),
+        json.dumps({"query": "Rook moves?"}),
+        "not json",
+        json.dumps({"query": "rook moves"}),
+        "",
+        json.dumps({"query": "   "}),
+        json.dumps({"query": "en passant"}),
+        json.dumps({"query": "castling"}),
+        json.dumps({"query": "castling"}),
+    ]))
+
+    assert load_queries(str(log)) == ["castling", "Rook moves?", "en passant"]
+    assert load_queries(str(log), limit=1) == ["castling"]
+
+
+@pytest.mark.asyncio
+async def test_warm_up_searches_and_fetches_top_documents():
+    """Each top document is fetched once; failures are counted, not raised."""
+    results = {
+        "rook": {"results": [{"id": "file_1"}, {"id": "file_2"}, {"id": "file_3"}]},
+        "bishop": {"results": [{"id": "file_2"}, {"id": "vs_0"}]},
+    }
+    fetched = []
+
+    async def search(query):
+        if query == "broken":
+            raise RuntimeError("boom")
+        return results[query]
+
+    async def fetch(doc_id):
+        if doc_id == "file_2":
+            raise RuntimeError("boom")
+        fetched.append(doc_id)
+
+    report = await warm_up(search, fetch, ["rook", "bishop", "broken"], fetch_top=2)
+
+    assert fetched == ["file_1"]
+    assert report["queries"] == 3
+    assert report["searched"] == 2
+    assert report["search_errors"] == 1
+    assert report["documents"] == 1
+    assert report["fetch_errors"] == 1
@@ -0,0 +1,439 @@
+"""
+Upstream HTTP transport and call policy for OpenAI API calls.
+
+The AsyncOpenAI client is given an explicit ``httpx.AsyncClient`` with
+tuned connection pool limits, keep-alive expiry, optional HTTP/2 and
+separate connect/read/write/pool timeouts. The client is opened in the
+ASGI lifespan and closed on shutdown, and its pool utilization can be
+inspected to size workers.
+
+Individual upstream calls go through an ``UpstreamPolicy``, which hedges
+slow requests and derives their timeout from recently observed latency,
+and optionally a ``CircuitBreaker`` that fails calls fast while the
+upstream is erroring or too slow.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from metrics import RollingLatency
+from profiling import record_span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def http2_available() -> bool:
+    """Return True if the optional h2 package needed for HTTP/2 is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class UpstreamTransport:
+    """
+    Owner of the pooled ``httpx.AsyncClient`` used for upstream requests.
+
+    Use as an async context manager, or call ``open`` and ``aclose``
+    explicitly.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, http2: Optional[bool] = None,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 write_timeout: float = 30.0, pool_timeout: float = 5.0):
+        if http2 is None:
+            http2 = http2_available()
+        elif http2 and not http2_available():
+            logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        )
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def open(self) -> httpx.AsyncClient:
+        """Create the pooled client if it is not open yet and return it."""
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            logger.info(
+                f"Opened upstream HTTP client (http2={self.http2}, "
+                f"max_connections={self.limits.max_connections}, "
+                f"max_keepalive={self.limits.max_keepalive_connections})"
+            )
+        return self.client
+
+    async def aclose(self) -> None:
+        """Close the client and every pooled connection."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        return self.open()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return connection pool utilization.
+
+        ``active`` connections are serving a request, ``idle`` ones are kept
+        alive for reuse, and ``waiting`` requests are queued for a free
+        connection, which means the pool limits are too small for the load.
+        """
+        stats: Dict[str, Any] = {
+            "open": self.client is not None and not self.client.is_closed,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connections": 0,
+            "active": 0,
+            "idle": 0,
+            "requests": 0,
+            "waiting": 0,
+        }
+        # The pool lives on httpcore internals, so read it defensively
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        if pool is None:
+            return stats
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        requests = list(getattr(pool, "_requests", []))
+        stats.update({
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "requests": len(requests),
+            "waiting": sum(1 for request in requests if getattr(request, "connection", None) is None),
+        })
+        return stats
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the upstream while its circuit is open.
+
+    Carries ``status_code`` and ``detail`` like an ``HTTPException`` so tool
+    error handling maps it to a 503.
+    """
+
+    status_code = 503
+
+    def __init__(self, name: str, retry_after: float):
+        self.detail = f"Upstream {name} is unavailable, retry in {retry_after:.0f}s"
+        super().__init__(self.detail)
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """
+    Return True if ``exc`` means the upstream itself is unhealthy.
+
+    Client errors such as a 404 for an unknown file ID say nothing about
+    upstream health, so only timeouts, connection errors, 408/429 and 5xx
+    responses count against the circuit.
+    """
+    status_code = getattr(exc, "status_code", None)
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return status_code in (408, 429)
+    return True
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream endpoint.
+
+    While closed, the outcomes of the last ``window`` calls are tracked. Once
+    at least ``min_calls`` are recorded, the circuit opens if the share of
+    failures reaches ``failure_rate`` or the share of calls slower than
+    ``slow_call_duration`` reaches ``slow_call_rate``. An open circuit
+    rejects calls with ``CircuitOpenError`` for ``open_seconds``, then goes
+    half-open and lets ``half_open_calls`` trial calls through: if they all
+    succeed the circuit closes, and any failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10,
+                 failure_rate: float = 0.5, slow_call_duration: float = 10.0,
+                 slow_call_rate: float = 0.8, open_seconds: float = 30.0,
+                 half_open_calls: int = 3):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        # (failed, slow) outcome of each recent call
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._slow = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        """Current state; an open circuit turns half-open once its time is up."""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._trials = 0
+            self._trial_successes = 0
+        return self._state
+
+    def before_call(self) -> None:
+        """
+        Admit a call, or reject it while the circuit is open.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with all
+                trial calls already in flight
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and self._trials < self.half_open_calls:
+            self._trials += 1
+            return
+        self.rejected += 1
+        retry_after = max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, success: Optional[bool], duration: float = 0.0) -> None:
+        """
+        Record the outcome of an admitted call.
+
+        Args:
+            success: Whether the call succeeded; None if it was abandoned
+                (cancelled), which only frees its half-open trial slot
+            duration: Call latency in seconds
+        """
+        if self._state == self.HALF_OPEN:
+            if success is None:
+                self._trials -= 1
+            elif not success or duration >= self.slow_call_duration:
+                self._open()
+            else:
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._close()
+            return
+        if success is None or self._state != self.CLOSED:
+            return
+
+        if len(self._outcomes) == self._outcomes.maxlen:
+            failed, slow = self._outcomes[0]
+            self._failures -= failed
+            self._slow -= slow
+        failed, slow = not success, duration >= self.slow_call_duration
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and (
+                self._failures / calls >= self.failure_rate
+                or self._slow / calls >= self.slow_call_rate):
+            self._open()
+
+    def _open(self) -> None:
+        logger.warning(f"Circuit for upstream {self.name} opened")
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def _close(self) -> None:
+        logger.info(f"Circuit for upstream {self.name} closed")
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the state, recent failure/slow rates and counters."""
+        calls = len(self._outcomes)
+        return {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": (self._failures / calls) if calls else 0.0,
+            "slow_call_rate": (self._slow / calls) if calls else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamPolicy:
+    """
+    Hedging and adaptive timeouts for one kind of upstream call.
+
+    Latencies of successful calls are kept in a rolling window. Once
+    ``min_samples`` have been seen:
+
+    - a call still running after the ``hedge_quantile`` latency gets a
+      duplicate request, and whichever response arrives first wins
+    - the whole call (including its hedge) times out after
+      ``timeout_multiplier`` times the p99 latency, clamped to
+      ``[min_timeout, max_timeout]``
+
+    Until then calls are never hedged and time out after ``max_timeout``.
+    Hedges are paid for from a budget: every call earns ``hedge_budget``
+    tokens (up to ``hedge_burst``) and every hedge spends one, so at most
+    that fraction of calls is duplicated even when the upstream is slow
+    across the board.
+
+    With a ``breaker`` every call is admitted by it first and its outcome
+    recorded, with one outcome per call however many attempts were made.
+    """
+
+    def __init__(self, name: str, window: int = 1000, min_samples: int = 20,
+                 hedge_quantile: float = 95.0, hedge_budget: float = 0.05,
+                 hedge_burst: float = 10.0, min_hedge_delay: float = 0.01,
+                 timeout_multiplier: float = 3.0, min_timeout: float = 2.0,
+                 max_timeout: float = 30.0, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.breaker = breaker
+        self.latency = RollingLatency(size=window)
+        self.min_samples = min_samples
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.hedge_burst = hedge_burst
+        self.min_hedge_delay = min_hedge_delay
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        self._tokens = 0.0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little data."""
+        if self.hedge_budget <= 0 or len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_hedge_delay, self.latency.percentile(self.hedge_quantile))
+
+    def timeout(self) -> float:
+        """Deadline in seconds for a whole call, including its hedge."""
+        if len(self.latency) < self.min_samples:
+            return self.max_timeout
+        adaptive = self.latency.percentile(99) * self.timeout_multiplier
+        return min(self.max_timeout, max(self.min_timeout, adaptive))
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run ``fn()`` under the policy and return the first successful result.
+
+        ``fn`` is called once more for the hedge, so it must be safe to
+        repeat (true of the read-only vector store calls). If one attempt
+        fails while the other is still running, the other one is awaited.
+
+        Raises:
+            CircuitOpenError: If the breaker rejects the call
+            TimeoutError: If no attempt succeeds before the adaptive timeout
+        """
+        if self.breaker is not None:
+            self.breaker.before_call()
+        self.calls += 1
+        self._tokens = min(self.hedge_burst, self._tokens + self.hedge_budget)
+        delay = self.hedge_delay()
+        timeout = self.timeout()
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(fn())
+        pending = {primary}
+        success = None
+        outcome = "cancelled"
+        hedged = False
+        deadline = asyncio.timeout(timeout)
+        try:
+            async with deadline:
+                if delay is not None:
+                    done, pending = await asyncio.wait(pending, timeout=delay)
+                    if not done and self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self.hedges += 1
+                        pending.add(asyncio.ensure_future(fn()))
+                        hedged = True
+                    pending |= done
+                while True:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    failed = None
+                    for task in done:
+                        if task.exception() is None:
+                            success = True
+                            self.latency.observe(time.perf_counter() - started)
+                            if task is not primary:
+                                self.hedge_wins += 1
+                            outcome = "ok"
+                            return task.result()
+                        failed = task.exception()
+                    if not pending:
+                        outcome = "error"
+                        self.errors += 1
+                        success = not is_upstream_failure(failed)
+                        raise failed
+        except TimeoutError:
+            # An attempt that raised TimeoutError itself was already counted
+            # as an error; only the policy's own deadline is a timeout
+            if not deadline.expired():
+                raise
+            outcome = "timeout"
+            success = False
+            # Count the timeout as an observation so the window, and with it
+            # the next timeout, grows while the upstream is slow
+            self.latency.observe(time.perf_counter() - started)
+            self.timeouts += 1
+            logger.warning(f"Upstream {self.name} call timed out after {timeout:.2f}s")
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+            elapsed = time.perf_counter() - started
+            if self.breaker is not None:
+                self.breaker.record(success, elapsed)
+            record_span(f"upstream.{self.name}", started, elapsed, outcome=outcome, hedged=hedged)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current hedge delay, timeout and call counters."""
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "samples": len(self.latency),
+            "p50": self.latency.percentile(50),
+            "p95": self.latency.percentile(95),
+            "p99": self.latency.percentile(99),
+            "hedge_delay": self.hedge_delay(),
+            "timeout": self.timeout(),
+            "circuit": self.breaker.stats() if self.breaker is not None else None,
+        }
@@ -0,0 +1,191 @@
+"""
+Cache warm-up from a log of past queries.
+
+After a deploy every cache is cold, so the first agents pay full upstream
+latency on every call. A warm-up replays the most frequent queries of a
+JSONL log through the search path and prefetches the top documents of each
+result through the fetch path, so the caches and document tiers hold the
+hot set before traffic arrives.
+
+Each log line is a JSON object. The query is read from ``field`` (default
+"query") at the top level, under "arguments", or under "params" ->
+"arguments" (a JSON-RPC ``tools/call``), and the "queries" list of a batch
+search is expanded; lines that are JSON strings are taken as queries.
+
+The server runs a warm-up on startup when ``WARMUP_FILE`` is set. It can
+also be run by hand, in-process to fill the persistent tiers
+(``DOCUMENT_STORE_PATH``, ``SHARED_STATE_PATH``), or against a running
+server with ``--target``.
+
+Usage:
+    python warmup.py queries.jsonl [--limit 100] [--fetch-top 3]
+        [--concurrency 4] [--field query] [--target http://host:port]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+from cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+def extract_queries(record: Any, field: str = "query") -> List[str]:
+    """Return the search queries found in one log record."""
+    if isinstance(record, str):
+        return [record]
+    if isinstance(record, list):
+        return [query for item in record for query in extract_queries(item, field)]
+    if not isinstance(record, dict):
+        return []
+    params = record.get("params")
+    containers = (record, record.get("arguments"),
+                  params.get("arguments") if isinstance(params, dict) else None)
+    for container in containers:
+        if not isinstance(container, dict):
+            continue
+        value = container.get(field)
+        if isinstance(value, str):
+            return [value]
+        queries = container.get("queries")
+        if isinstance(queries, list):
+            return [query for query in queries if isinstance(query, str)]
+    return []
+
+
+def load_queries(path: str, limit: int = 100, field: str = "query") -> List[str]:
+    """
+    Read a JSONL log and return its ``limit`` most frequent queries.
+
+    Queries are counted by their normalized form, so "Rook moves?" and
+    "rook moves" count as one; the first spelling seen is returned.
+    Malformed lines are skipped.
+    """
+    counts: Counter = Counter()
+    spelling: Dict[str, str] = {}
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for query in extract_queries(record, field):
+                key = normalize_query(query)
+                if not key:
+                    continue
+                counts[key] += 1
+                spelling.setdefault(key, query)
+    return [spelling[key] for key, _ in counts.most_common(limit)]
+
+
+async def warm_up(search: Callable[[str], Awaitable[Dict[str, Any]]],
+                  fetch: Callable[[str], Awaitable[Any]], queries: List[str],
+                  fetch_top: int = 3, concurrency: int = 4) -> Dict[str, Any]:
+    """
+    Replay ``queries`` through ``search`` and fetch the top hits of each.
+
+    Args:
+        search: Runs one search and returns its result dict
+        fetch: Brings one document into the local tiers
+        queries: Queries to replay, most important first
+        fetch_top: Documents fetched per query (0 skips fetching)
+        concurrency: Searches or fetches run at once
+
+    Returns:
+        Counts of queries and documents warmed and failed, and the elapsed time
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    report = {"queries": len(queries), "searched": 0, "search_errors": 0,
+              "documents": 0, "fetch_errors": 0}
+
+    async def run_search(query: str) -> List[str]:
+        async with semaphore:
+            try:
+                result = await search(query)
+            except Exception as e:
+                logger.info(f"Warm-up search {query!r} failed: {str(e)}")
+                result = {"error": str(e)}
+        if result.get("error"):
+            report["search_errors"] += 1
+            return []
+        report["searched"] += 1
+        return [hit.get("id") for hit in result.get("results", [])[:fetch_top]]
+
+    async def run_fetch(doc_id: str) -> None:
+        async with semaphore:
+            try:
+                await fetch(doc_id)
+                report["documents"] += 1
+            except Exception as e:
+                logger.info(f"Warm-up fetch {doc_id} failed: {str(e)}")
+                report["fetch_errors"] += 1
+
+    hits = await asyncio.gather(*(run_search(query) for query in queries))
+    # Each document once, in order of first appearance
+    documents = dict.fromkeys(
+        doc_id for ids in hits for doc_id in ids if isinstance(doc_id, str) and doc_id.startswith("file_"))
+    await asyncio.gather(*(run_fetch(doc_id) for doc_id in documents))
+    report["elapsed"] = time.perf_counter() - started
+    return report
+
+
+async def warm_server(queries: List[str], fetch_top: int, concurrency: int) -> Dict[str, Any]:
+    """Warm the persistent tiers with an in-process server."""
+    import server
+
+    if not (server.DOCUMENT_STORE_PATH or server.SHARED_STATE_PATH):
+        logger.warning("Neither DOCUMENT_STORE_PATH nor SHARED_STATE_PATH is set; "
+                       "nothing warmed in-process outlives this command")
+    async with server.create_upstream_transport() as http_client:
+        mcp = server.create_server(server.create_openai_client(http_client))
+        return await warm_up(mcp.run_search, mcp.prefetch_document, queries, fetch_top, concurrency)
+
+
+async def warm_target(target: str, queries: List[str], fetch_top: int,
+                      concurrency: int) -> Dict[str, Any]:
+    """Warm a running server through its HTTP API."""
+    import httpx
+
+    async with httpx.AsyncClient(base_url=target.rstrip("/"), timeout=60.0) as client:
+        async def search(query: str) -> Dict[str, Any]:
+            response = await client.post("/search", json={"query": query})
+            response.raise_for_status()
+            return response.json()
+
+        async def fetch(doc_id: str) -> None:
+            response = await client.post("/fetch", json={"id": doc_id})
+            response.raise_for_status()
+
+        return await warm_up(search, fetch, queries, fetch_top, concurrency)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("log", help="JSONL log of past queries")
+    parser.add_argument("--limit", type=int, default=100, help="Most frequent queries replayed")
+    parser.add_argument("--fetch-top", type=int, default=3, help="Documents fetched per query")
+    parser.add_argument("--concurrency", type=int, default=4, help="Searches or fetches run at once")
+    parser.add_argument("--field", default="query", help="Field holding the query in each record")
+    parser.add_argument("--target", help="URL of a running server to warm over HTTP")
+    args = parser.parse_args()
+
+    queries = load_queries(args.log, args.limit, args.field)
+    if args.target:
+        coroutine = warm_target(args.target, queries, args.fetch_top, args.concurrency)
+    else:
+        coroutine = warm_server(queries, args.fetch_top, args.concurrency)
+    print(json.dumps(asyncio.run(coroutine), indent=2))
+
+
+if __name__ == "__main__":
+    main()